@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+"""
+流式归档写入器
+边接收成员数据边输出归档字节，不需要可 seek 的输出，也不在内存中保留成员内容
+"""
+
+import calendar
+import multiprocessing
+import struct
+import tarfile
+import threading
+import time
+import zlib
+import zipfile
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional
+
+# ZIP 结构签名
+_LOCAL_FILE_HEADER_SIGNATURE = 0x04034b50
+_DATA_DESCRIPTOR_SIGNATURE = 0x08074b50
+_CENTRAL_DIRECTORY_SIGNATURE = 0x02014b50
+_END_OF_CENTRAL_DIRECTORY_SIGNATURE = 0x06054b50
+_ZIP64_END_OF_CENTRAL_DIRECTORY_SIGNATURE = 0x06064b50
+_ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR_SIGNATURE = 0x07064b50
+_ZIP64_EXTRA_ID = 0x0001
+
+# 通用标志位：bit 3 表示 CRC 与大小写在数据描述符中，bit 11 表示文件名为 UTF-8
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+
+_VERSION = 20
+_VERSION_ZIP64 = 45
+# 高字节 3 表示 Unix，便于解压时还原权限
+_VERSION_MADE_BY = (3 << 8) | _VERSION_ZIP64
+_UINT32_MAX = 0xFFFFFFFF
+_UINT16_MAX = 0xFFFF
+_EXTERNAL_ATTR = (0o100644 << 16)
+
+# 本身已经压缩过的内容类型，再做 deflate 只浪费 CPU
+_COMPRESSED_MIME_PREFIXES = ('image/', 'video/', 'audio/')
+_UNCOMPRESSED_IMAGE_TYPES = ('image/svg+xml', 'image/bmp', 'image/x-ms-bmp', 'image/tiff')
+_COMPRESSED_MIME_TYPES = {
+    'application/pdf',
+    'application/zip',
+    'application/x-zip-compressed',
+    'application/gzip',
+    'application/x-gzip',
+    'application/x-bzip2',
+    'application/x-xz',
+    'application/x-7z-compressed',
+    'application/x-rar-compressed',
+    'application/vnd.rar',
+    'application/zstd',
+    'application/java-archive',
+    'application/epub+zip',
+}
+_COMPRESSED_MIME_MARKERS = ('openxmlformats', 'opendocument')
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+
+def is_compressed_mime_type(mime_type: Optional[str]) -> bool:
+    """判断内容是否已压缩（图片、音视频、压缩包、PDF、Office 文档等）"""
+    if not mime_type:
+        return False
+    mime_type = mime_type.lower()
+    if mime_type in _COMPRESSED_MIME_TYPES:
+        return True
+    if mime_type.startswith(_COMPRESSED_MIME_PREFIXES):
+        return mime_type not in _UNCOMPRESSED_IMAGE_TYPES
+    return any(marker in mime_type for marker in _COMPRESSED_MIME_MARKERS)
+
+
+def get_process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """
+    获取共享的压缩进程池
+
+    使用 fork 启动，避免 spawn/forkserver 在子进程里重新导入整个应用；
+    fork 模式会在首次提交任务时拉起全部工作进程，应在应用启动、线程尚少时调用一次完成预热。
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=max_workers,
+                                                mp_context=multiprocessing.get_context('fork'))
+            _process_pool.submit(int).result()
+        return _process_pool
+
+
+def shutdown_process_pool():
+    """关闭共享的压缩进程池"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+
+def deflate_block(data: bytes, level: int) -> bytes:
+    """
+    独立压缩一个数据块，以同步刷新结尾
+
+    各块互不引用，按顺序拼接后仍是合法的 raw deflate 流，最后再补一个空的结束块即可，
+    因此可以在多个进程中并行压缩。
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+# 空输入以 Z_FINISH 结束得到的最终块
+_DEFLATE_FINAL_BLOCK = zlib.compressobj(0, zlib.DEFLATED, -zlib.MAX_WBITS).flush(zlib.Z_FINISH)
+
+
+def _dos_datetime(modified: Optional[datetime]):
+    """转换为 ZIP 使用的 DOS 日期与时间"""
+    t = modified.timetuple() if modified else time.localtime()
+    year = max(t.tm_year, 1980)
+    dos_date = ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    return dos_time, dos_date
+
+
+class _ZipEntry:
+    __slots__ = ('name', 'method', 'dos_time', 'dos_date', 'crc', 'compressed_size', 'size', 'offset', 'zip64')
+
+    def __init__(self, name: bytes, method: int, dos_time: int, dos_date: int, offset: int, zip64: bool):
+        self.name = name
+        self.method = method
+        self.dos_time = dos_time
+        self.dos_date = dos_date
+        self.crc = 0
+        self.compressed_size = 0
+        self.size = 0
+        self.offset = offset
+        self.zip64 = zip64
+
+
+class ZipStreamWriter:
+    """
+    流式 ZIP 写入器
+
+    每个成员先输出本地文件头，数据边压缩边输出，结束后用数据描述符补上 CRC 与大小，
+    所有成员写完后输出中央目录。内存中只保留每个成员的目录项。
+
+    大小未知或可能超过 4 GB 的成员、超过 65535 个成员以及超过 4 GB 的归档自动使用 ZIP64 结构，
+    force_zip64 为 True 时所有成员都使用 ZIP64。
+    """
+
+    media_type = 'application/zip'
+    extension = 'zip'
+
+    def __init__(self, compression: int = zipfile.ZIP_DEFLATED, compresslevel: Optional[int] = None,
+                 executor: Optional[Executor] = None, max_pending: int = 8, force_zip64: bool = False):
+        """
+        :param compression: 默认压缩方式，ZIP_DEFLATED 或 ZIP_STORED
+        :param compresslevel: deflate 压缩级别 0-9
+        :param executor: 可选的进程池，提供时各数据块并行压缩
+        :param max_pending: 并行压缩时最多同时在途的数据块数
+        :param force_zip64: 是否对所有成员和目录结束记录使用 ZIP64
+        """
+        self.compression = compression
+        self.compresslevel = zlib.Z_DEFAULT_COMPRESSION if compresslevel is None else compresslevel
+        self.executor = executor
+        self.max_pending = max_pending
+        self.force_zip64 = force_zip64
+        self._entries: List[_ZipEntry] = []
+        self._offset = 0
+
+    def _deflate_parallel(self, chunks: Iterable[bytes], entry: '_ZipEntry') -> Iterator[bytes]:
+        """分块提交到进程池压缩，按提交顺序取回结果"""
+        pending = deque()
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                entry.crc = zlib.crc32(chunk, entry.crc)
+                entry.size += len(chunk)
+                pending.append(self.executor.submit(deflate_block, chunk, self.compresslevel))
+                if len(pending) >= self.max_pending:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+        yield _DEFLATE_FINAL_BLOCK
+
+    def _deflate_serial(self, chunks: Iterable[bytes], entry: '_ZipEntry') -> Iterator[bytes]:
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+        for chunk in chunks:
+            if not chunk:
+                continue
+            entry.crc = zlib.crc32(chunk, entry.crc)
+            entry.size += len(chunk)
+            yield compressor.compress(chunk)
+        yield compressor.flush()
+
+    def _store(self, chunks: Iterable[bytes], entry: '_ZipEntry') -> Iterator[bytes]:
+        for chunk in chunks:
+            entry.crc = zlib.crc32(chunk, entry.crc)
+            entry.size += len(chunk)
+            yield chunk
+
+    def _emit(self, data: bytes) -> bytes:
+        self._offset += len(data)
+        return data
+
+    def add_member(self, name: str, chunks: Iterable[bytes], modified: Optional[datetime] = None,
+                   size: Optional[int] = None, compression: Optional[int] = None) -> Iterator[bytes]:
+        """
+        写入一个成员，逐块产出归档字节
+
+        :param size: 预期的原始大小，用于判断是否需要 ZIP64，未知时按 ZIP64 处理
+        :param compression: 按成员覆盖默认压缩方式
+        """
+        dos_time, dos_date = _dos_datetime(modified)
+        method = self.compression if compression is None else compression
+        # deflate 对不可压缩数据会略微膨胀，按 zipfile 的做法留 5% 余量
+        zip64 = self.force_zip64 or size is None or size * 1.05 > zipfile.ZIP64_LIMIT
+        entry = _ZipEntry(name.encode('utf-8'), method, dos_time, dos_date, self._offset, zip64)
+
+        if zip64:
+            extra = struct.pack('<HHQQ', _ZIP64_EXTRA_ID, 16, 0, 0)
+            header_size = _UINT32_MAX
+        else:
+            extra = b''
+            header_size = 0
+        yield self._emit(struct.pack(
+            '<IHHHHHIIIHH',
+            _LOCAL_FILE_HEADER_SIGNATURE, _VERSION_ZIP64 if zip64 else _VERSION,
+            _FLAG_DATA_DESCRIPTOR | _FLAG_UTF8, entry.method,
+            dos_time, dos_date, 0, header_size, header_size, len(entry.name), len(extra)
+        ) + entry.name + extra)
+
+        if entry.method == zipfile.ZIP_STORED:
+            data_iter = self._store(chunks, entry)
+        elif self.executor is not None:
+            data_iter = self._deflate_parallel(chunks, entry)
+        else:
+            data_iter = self._deflate_serial(chunks, entry)
+
+        for data in data_iter:
+            if data:
+                entry.compressed_size += len(data)
+                yield self._emit(data)
+
+        if zip64:
+            descriptor = struct.pack(
+                '<IIQQ', _DATA_DESCRIPTOR_SIGNATURE, entry.crc, entry.compressed_size, entry.size
+            )
+        elif entry.compressed_size > _UINT32_MAX or entry.size > _UINT32_MAX:
+            raise zipfile.LargeZipFile(f"成员 {name} 超过 4 GB，但声明的大小为 {size}")
+        else:
+            descriptor = struct.pack(
+                '<IIII', _DATA_DESCRIPTOR_SIGNATURE, entry.crc, entry.compressed_size, entry.size
+            )
+        yield self._emit(descriptor)
+        self._entries.append(entry)
+
+    def _central_directory_record(self, entry: _ZipEntry) -> bytes:
+        extra_fields = []
+        size, compressed_size, offset = entry.size, entry.compressed_size, entry.offset
+        if entry.zip64 or size >= _UINT32_MAX:
+            extra_fields.append(size)
+            size = _UINT32_MAX
+        if entry.zip64 or compressed_size >= _UINT32_MAX:
+            extra_fields.append(compressed_size)
+            compressed_size = _UINT32_MAX
+        if entry.zip64 or offset >= _UINT32_MAX:
+            extra_fields.append(offset)
+            offset = _UINT32_MAX
+        extra = b''
+        if extra_fields:
+            extra = struct.pack(f'<HH{len(extra_fields)}Q', _ZIP64_EXTRA_ID, 8 * len(extra_fields), *extra_fields)
+        version = _VERSION_ZIP64 if extra else _VERSION
+        return struct.pack(
+            '<IHHHHHHIIIHHHHHII',
+            _CENTRAL_DIRECTORY_SIGNATURE, _VERSION_MADE_BY, version, _FLAG_DATA_DESCRIPTOR | _FLAG_UTF8,
+            entry.method, entry.dos_time, entry.dos_date, entry.crc, compressed_size, size,
+            len(entry.name), len(extra), 0, 0, 0, _EXTERNAL_ATTR, offset
+        ) + entry.name + extra
+
+    def close(self) -> Iterator[bytes]:
+        """输出中央目录与目录结束记录，必要时附带 ZIP64 目录结束记录"""
+        central_directory_offset = self._offset
+        for entry in self._entries:
+            yield self._emit(self._central_directory_record(entry))
+        central_directory_size = self._offset - central_directory_offset
+        count = len(self._entries)
+
+        if (self.force_zip64 or count >= _UINT16_MAX or central_directory_offset >= _UINT32_MAX
+                or central_directory_size >= _UINT32_MAX):
+            zip64_end_offset = self._offset
+            yield self._emit(struct.pack(
+                '<IQHHIIQQQQ',
+                _ZIP64_END_OF_CENTRAL_DIRECTORY_SIGNATURE, 44, _VERSION_MADE_BY, _VERSION_ZIP64, 0, 0,
+                count, count, central_directory_size, central_directory_offset
+            ))
+            yield self._emit(struct.pack(
+                '<IIQI', _ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR_SIGNATURE, 0, zip64_end_offset, 1
+            ))
+            count = min(count, _UINT16_MAX)
+            central_directory_size = min(central_directory_size, _UINT32_MAX)
+            central_directory_offset = min(central_directory_offset, _UINT32_MAX)
+
+        yield self._emit(struct.pack(
+            '<IHHHHIIH',
+            _END_OF_CENTRAL_DIRECTORY_SIGNATURE, 0, 0, count, count,
+            central_directory_size, central_directory_offset, 0
+        ))
+
+
+class TarStreamWriter:
+    """
+    流式 tar 写入器，可选 gzip 或 zstd 压缩
+
+    tar 按成员顺序依次输出头和数据，没有末尾索引，适合超大目录的严格顺序流式输出；
+    代价是成员头中必须写明大小，因此每个成员都需要提供 size。
+    """
+
+    def __init__(self, compression: Optional[str] = None, compresslevel: Optional[int] = None):
+        """
+        :param compression: None、'gz' 或 'zst'
+        :param compresslevel: 压缩级别，gzip 为 0-9，zstd 为 1-22
+        """
+        self.compression = compression
+        self._compressor = None
+        if compression == 'gz':
+            level = zlib.Z_DEFAULT_COMPRESSION if compresslevel is None else compresslevel
+            # wbits 加 16 输出带 gzip 头尾的流
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        elif compression == 'zst':
+            try:
+                import zstandard
+            except ImportError:
+                raise ValueError("tar.zst 格式需要安装 zstandard")
+            self._compressor = zstandard.ZstdCompressor(level=compresslevel or 3).compressobj()
+        elif compression is not None:
+            raise ValueError(f"不支持的 tar 压缩方式: {compression}")
+
+    @property
+    def media_type(self) -> str:
+        return {None: 'application/x-tar', 'gz': 'application/gzip', 'zst': 'application/zstd'}[self.compression]
+
+    @property
+    def extension(self) -> str:
+        return f'tar.{self.compression}' if self.compression else 'tar'
+
+    def _emit(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) if self._compressor else data
+
+    def add_member(self, name: str, chunks: Iterable[bytes], modified: Optional[datetime] = None,
+                   size: Optional[int] = None, compression: Optional[int] = None) -> Iterator[bytes]:
+        """写入一个成员，逐块产出归档字节；compression 参数仅为与 ZIP 写入器保持一致，tar 中忽略"""
+        if size is None:
+            raise ValueError(f"tar 成员 {name} 缺少大小")
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mode = 0o644
+        info.mtime = calendar.timegm(modified.timetuple()) if modified else int(time.time())
+        yield self._emit(info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape'))
+
+        written = 0
+        for chunk in chunks:
+            written += len(chunk)
+            if written > size:
+                raise IOError(f"tar 成员 {name} 的数据超过声明的大小 {size}")
+            yield self._emit(chunk)
+        if written != size:
+            raise IOError(f"tar 成员 {name} 的数据不足，声明 {size}，实际 {written}")
+
+        padding = -size % tarfile.BLOCKSIZE
+        if padding:
+            yield self._emit(tarfile.NUL * padding)
+
+    def close(self) -> Iterator[bytes]:
+        """输出归档结束标记的两个空块，并结束压缩流"""
+        yield self._emit(tarfile.NUL * tarfile.BLOCKSIZE * 2)
+        if self._compressor:
+            yield self._compressor.flush()
+
+
+# 批量下载支持的归档格式
+ARCHIVE_FORMATS = ('zip', 'zip64', 'tar', 'tar.gz', 'tar.zst')
+
+
+def create_archive_writer(archive_format: str, compresslevel: Optional[int] = None,
+                          executor: Optional[Executor] = None, max_pending: int = 8):
+    """
+    根据格式创建流式归档写入器
+
+    :param archive_format: ARCHIVE_FORMATS 之一
+    :param compresslevel: 压缩级别，ZIP 下 0 表示仅存储
+    :param executor: ZIP deflate 使用的进程池
+    """
+    if archive_format in ('zip', 'zip64'):
+        return ZipStreamWriter(
+            compression=zipfile.ZIP_STORED if compresslevel == 0 else zipfile.ZIP_DEFLATED,
+            compresslevel=compresslevel,
+            executor=executor,
+            max_pending=max_pending,
+            force_zip64=archive_format == 'zip64'
+        )
+    if archive_format == 'tar':
+        return TarStreamWriter()
+    if archive_format == 'tar.gz':
+        return TarStreamWriter('gz', compresslevel)
+    if archive_format == 'tar.zst':
+        return TarStreamWriter('zst', compresslevel)
+    raise ValueError(f"不支持的归档格式: {archive_format}，可选: {', '.join(ARCHIVE_FORMATS)}")
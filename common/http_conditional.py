@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP 条件请求（RFC 9110）
+根据 Drive 元数据生成 ETag / Last-Modified，并判断 If-None-Match、If-Modified-Since、If-Range
+"""
+
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional, Dict, Any
+
+from starlette.responses import Response
+
+
+def content_etag(file_info: Dict[str, Any]) -> Optional[str]:
+    """文件内容的强 ETag，优先使用 md5Checksum，Google 文档等没有 md5 时使用版本号"""
+    if file_info.get('md5Checksum'):
+        return f'"{file_info["md5Checksum"]}"'
+    if file_info.get('version'):
+        return f'"v{file_info["version"]}"'
+    return None
+
+
+def metadata_etag(file_info: Dict[str, Any]) -> Optional[str]:
+    """文件元数据的强 ETag，Drive 的 version 在内容或元数据任一变化时递增"""
+    if file_info.get('version'):
+        return f'"{file_info.get("id", "")}-v{file_info["version"]}"'
+    return None
+
+
+def last_modified(file_info: Dict[str, Any]) -> Optional[datetime]:
+    """解析 modifiedTime，精度截断到秒以匹配 HTTP 日期"""
+    value = file_info.get('modifiedTime')
+    if not value:
+        return None
+    try:
+        modified = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return modified.replace(microsecond=0)
+
+
+def validator_headers(etag: Optional[str], modified: Optional[datetime]) -> Dict[str, str]:
+    """构造 ETag 与 Last-Modified 响应头"""
+    headers = {}
+    if etag:
+        headers['ETag'] = etag
+    if modified:
+        headers['Last-Modified'] = format_datetime(modified.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+
+def _parse_http_date(value: str) -> Optional[datetime]:
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match 使用弱比较，忽略 W/ 前缀"""
+    if header.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def is_not_modified(if_none_match: Optional[str], if_modified_since: Optional[str],
+                    etag: Optional[str], modified: Optional[datetime]) -> bool:
+    """客户端缓存仍然有效时返回 True；同时携带两个条件时只看 If-None-Match"""
+    if if_none_match:
+        return etag is not None and _etag_matches(if_none_match, etag)
+    if if_modified_since and modified is not None:
+        since = _parse_http_date(if_modified_since)
+        return since is not None and modified <= since
+    return False
+
+
+def if_range_matches(if_range: Optional[str], etag: Optional[str], modified: Optional[datetime]) -> bool:
+    """If-Range 使用强比较：ETag 完全一致，或日期与 Last-Modified 完全一致"""
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        return etag is not None and if_range == etag
+    if if_range.startswith('W/'):
+        return False
+    since = _parse_http_date(if_range)
+    return since is not None and modified is not None and since == modified
+
+
+def not_modified_response(headers: Dict[str, str]) -> Response:
+    """304 响应，只携带校验头"""
+    return Response(status_code=304, headers=headers)
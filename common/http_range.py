@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP Range 请求头解析（RFC 9110）
+"""
+
+from typing import Optional, List, Tuple
+
+# 单个请求允许的最大区间数，超出时按完整内容响应
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiable(Exception):
+    """所有区间都超出了内容长度，应返回 416"""
+
+    def __init__(self, size: int):
+        super().__init__(f"请求的范围不可满足，内容长度 {size}")
+        self.size = size
+
+
+def parse_range_header(header: Optional[str], size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    解析 Range 请求头，返回按起始位置排序、合并重叠后的闭区间列表
+
+    请求头缺失、格式无法识别或区间过多时返回 None，调用方应返回完整内容；
+    所有区间都不可满足时抛出 RangeNotSatisfiable。
+
+    :param header: Range 请求头，例如 bytes=0-499,-500
+    :param size: 内容总长度
+    """
+    if not header:
+        return None
+    unit, _, spec = header.strip().partition('=')
+    if unit.strip().lower() != 'bytes' or not spec:
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start_text, dash, end_text = part.partition('-')
+        start_text, end_text = start_text.strip(), end_text.strip()
+        if not dash or not (start_text.isdigit() or start_text == '') or not (end_text.isdigit() or end_text == ''):
+            return None
+        if start_text == '':
+            # 后缀区间：最后 N 个字节
+            if end_text == '':
+                return None
+            suffix = int(end_text)
+            if suffix == 0:
+                continue
+            ranges.append((max(0, size - suffix), size - 1))
+            continue
+        start = int(start_text)
+        if end_text and int(end_text) < start:
+            return None
+        if start >= size:
+            continue
+        end = int(end_text) if end_text else size - 1
+        ranges.append((start, min(end, size - 1)))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+    if not ranges:
+        raise RangeNotSatisfiable(size)
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+# 全局调度器，在应用生命周期中启动与关闭
+scheduler = AsyncIOScheduler()
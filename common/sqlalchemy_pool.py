@@ -4,7 +4,10 @@ from sqlalchemy.orm import sessionmaker
 
 from common.config_loader import GLOBAL_CONFIG
 
-global sqlalchemy_pool, SQLAlchemySessionLocal, SQLAlchemyBase
+sqlalchemy_pool = None
+SQLAlchemySessionLocal = None
+# 模型在导入时继承该基类，不依赖连接池是否已初始化
+SQLAlchemyBase = declarative_base()
 
 
 class SQLAlchemyPool:
@@ -22,6 +25,12 @@ class SQLAlchemyPool:
         if self._initialized:
             return
 
+        if database_url.startswith('sqlite'):
+            # SQLite 仅用于本地测试，不配置连接池，允许跨线程使用连接
+            self.engine = create_engine(database_url, connect_args={'check_same_thread': False})
+            self._initialized = True
+            return
+
         # 创建引擎并配置连接池
         self.engine = create_engine(
             database_url,
@@ -35,11 +44,20 @@ class SQLAlchemyPool:
         self._initialized = True
 
 
-def init_sqlalchemy_pool():
+def get_sqlalchemy_url() -> str:
+    """数据库连接地址，配置了 sqlalchemy.url 时优先使用（例如本地测试用 sqlite:///data/local.db），否则连接 mysql 配置的库"""
+    url = (GLOBAL_CONFIG.get('sqlalchemy') or {}).get('url')
+    if url:
+        return url
     params = GLOBAL_CONFIG['mysql']
-    db_url = f"mysql+pymysql://{params['user']}:{params['password']}@{params['host']}:{params['port']}/{params['db']}"
-    global sqlalchemy_pool, SQLAlchemySessionLocal, SQLAlchemyBase
-    sqlalchemy_pool = SQLAlchemyPool(database_url=db_url, pool_size=params['max_connections'])
+    return f"mysql+pymysql://{params['user']}:{params['password']}@{params['host']}:{params['port']}/{params['db']}"
+
+
+def init_sqlalchemy_pool():
+    global sqlalchemy_pool, SQLAlchemySessionLocal
+    if SQLAlchemySessionLocal is not None:
+        return
+    pool_size = (GLOBAL_CONFIG.get('mysql') or {}).get('max_connections', 10)
+    sqlalchemy_pool = SQLAlchemyPool(database_url=get_sqlalchemy_url(), pool_size=pool_size)
     # 创建数据库会话
     SQLAlchemySessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=sqlalchemy_pool.engine)
-    SQLAlchemyBase = declarative_base()
@@ -659,19 +659,48 @@ def get_content_type(url):
         return None
 
 
+# 下载远程文件时使用的请求头
+DOWNLOAD_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                  'Chrome/126.0.0.0 Safari/537.36',
+}
+
+# 补充的根据Content-Type确定文件后缀，其余可以按/切分获取，如Content-Type: audio/wav
+_EXTRA_CONTENT_TYPE_SUFFIX = {
+    "application/octet-stream": ".mp4",
+    "audio/mpeg": ".mp3",
+    "audio/aac": ".aac",
+    "audio/x-aac": ".aac",
+    "audio/mp4": ".m4a"
+}
+
+
+def media_type_of(content_type: str) -> str:
+    """去掉 Content-Type 中的参数，例如 text/html; charset=utf-8 -> text/html"""
+    return content_type.split(';', 1)[0].strip().lower()
+
+
+def guess_extension(content_type: str) -> str:
+    """
+    根据 Content-Type 确定文件后缀名
+
+    :param content_type: 响应头中的 Content-Type
+    :return: 以 . 开头的后缀名
+    """
+    media_type = media_type_of(content_type)
+    extension = mimetypes.guess_extension(media_type)
+    if extension and extension != '.bin':
+        return extension
+    if media_type in _EXTRA_CONTENT_TYPE_SUFFIX:
+        return _EXTRA_CONTENT_TYPE_SUFFIX[media_type]
+    names = media_type.split('/')
+    logger.warning(f"Could not determine file extension from Content-Type: {content_type},"
+                   f" set it as file extension")
+    return '.' + (media_type if len(names) == 1 else names[1])
+
+
 async def download_file(url):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
-                      'Chrome/126.0.0.0 Safari/537.36',
-    }
-    # 补充的根据Content-Type确定文件后缀，其余可以按/切分获取，如Content-Type: audio/wav
-    _extra_type = {
-        "application/octet-stream": ".mp4",
-        "audio/mpeg": ".mp3",
-        "audio/aac": ".aac",
-        "audio/x-aac": ".aac",
-        "audio/mp4": ".m4a"
-    }
+    headers = DOWNLOAD_HEADERS
     suffix = ''
 
     result = urlparse(url)
@@ -699,18 +728,7 @@ async def download_file(url):
                     logger.warning("Content-Type header is missing. Cannot determine file extension.")
                     return None, suffix, content_type
                 # 根据Content-Type获取文件扩展名
-                extension = mimetypes.guess_extension(content_type)
-                if extension and extension != '.bin':
-                    suffix = extension
-                else:
-                    if content_type in _extra_type:
-                        suffix = _extra_type[content_type]
-                    else:
-                        names = content_type.split('/')
-                        extension = '.' + content_type if len(names) == 1 else names[1]
-                        suffix = extension
-                        logger.warning(f"Could not determine file extension from Content-Type: {content_type},"
-                                       f" set it as file extension")
+                suffix = guess_extension(content_type)
                 return response.content, suffix, content_type
             except httpx.ConnectError as e:
                 logger.error(f'download file: {url} httpx.ConnectError: {e}')
@@ -1,3 +1,28 @@
 CREATE DATABASE IF NOT EXISTS `template_db` CHARACTER SET = utf8mb4 COLLATE = utf8mb4_unicode_ci;
 
 USE template_db;
+
+-- Drive 元数据镜像，服务启动同步时也会自动创建
+CREATE TABLE IF NOT EXISTS `drive_file_mirror` (
+    `account` VARCHAR(64) NOT NULL,
+    `file_id` VARCHAR(128) NOT NULL,
+    `parent_id` VARCHAR(128) NULL,
+    `name` VARCHAR(512) NOT NULL,
+    `mime_type` VARCHAR(255) NOT NULL,
+    `size` BIGINT NULL,
+    `modified_time` VARCHAR(32) NULL,
+    `data` TEXT NOT NULL,
+    PRIMARY KEY (`account`, `file_id`),
+    INDEX `idx_drive_file_mirror_parent` (`account`, `parent_id`),
+    INDEX `idx_drive_file_mirror_name` (`account`, `name`),
+    INDEX `idx_drive_file_mirror_mime_type` (`account`, `mime_type`),
+    INDEX `idx_drive_file_mirror_modified_time` (`account`, `modified_time`)
+) ENGINE = InnoDB DEFAULT CHARSET = utf8mb4;
+
+CREATE TABLE IF NOT EXISTS `drive_mirror_state` (
+    `account` VARCHAR(64) NOT NULL,
+    `page_token` VARCHAR(255) NULL,
+    `synced_at` DOUBLE NULL,
+    `root_id` VARCHAR(128) NULL,
+    PRIMARY KEY (`account`)
+) ENGINE = InnoDB DEFAULT CHARSET = utf8mb4;
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+下载往返次数基准测试
+用模拟的 Drive（每个请求固定延迟）对比两种下载路径的耗时：
+  1. 旧路径：先 files().get 获取元数据，再请求内容，两次往返串行
+  2. 新路径：元数据请求与内容请求并发发出
+
+在项目根目录运行: python examples/benchmark_download_rtt.py --rtt 0.05 --count 20
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+from urllib.parse import urlparse, parse_qs
+
+import httplib2
+from googleapiclient.discovery import build
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import service.drive_transfer as drive_transfer
+import service.media_download as media_download
+from service.download_cache import download_cache
+
+
+class StubDriveHttp:
+    """模拟 Drive API：每个请求休眠 rtt 秒，支持文件元数据与带 Range 的内容请求"""
+
+    def __init__(self, files, rtt):
+        self.files = files
+        self.rtt = rtt
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        time.sleep(self.rtt)
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        parsed = urlparse(uri)
+        file_id = parsed.path.rstrip('/').rsplit('/', 1)[-1]
+        content = self.files[file_id]
+        if parse_qs(parsed.query).get('alt') == ['media']:
+            start, _, end = headers.get('range', 'bytes=0-').split('=', 1)[1].partition('-')
+            start, end = int(start), min(int(end) if end else len(content) - 1, len(content) - 1)
+            return httplib2.Response({'status': '206', 'content-range': f'bytes {start}-{end}/{len(content)}'}), \
+                content[start:end + 1]
+        meta = {
+            'name': f'{file_id}.bin', 'mimeType': 'application/octet-stream', 'size': str(len(content)),
+            'md5Checksum': hashlib.md5(content).hexdigest(), 'modifiedTime': '2025-01-01T00:00:00.000Z',
+            'version': '1'
+        }
+        return httplib2.Response({'status': '200', 'content-type': 'application/json'}), json.dumps(meta).encode()
+
+
+async def consume(response):
+    size = 0
+    async for chunk in response.body_iterator:
+        size += len(chunk)
+    return size
+
+
+def run_old_path(service, file_id):
+    """两次串行往返：元数据后再请求内容"""
+    file_info = service.files().get(fileId=file_id, fields=drive_transfer.DOWNLOAD_FILE_FIELDS).execute()
+    return media_download.build_download_response(service, None, file_id, file_info)
+
+
+def run_new_path(service, file_id):
+    return media_download.download_file_response(service, None, file_id)
+
+
+def benchmark(name, func, service, file_ids):
+    started = time.perf_counter()
+    for file_id in file_ids:
+        asyncio.run(consume(func(service, file_id)))
+    elapsed = time.perf_counter() - started
+    print(f"{name:<24} 共 {len(file_ids)} 次，平均 {elapsed / len(file_ids) * 1000:.1f} ms/次")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='下载往返次数基准测试')
+    parser.add_argument('--rtt', type=float, default=0.05, help='模拟的单次请求延迟（秒）')
+    parser.add_argument('--count', type=int, default=20, help='每种路径的下载次数')
+    parser.add_argument('--size', type=int, default=64 * 1024, help='文件大小（字节）')
+    args = parser.parse_args()
+
+    files = {f'file{i}': os.urandom(args.size) for i in range(args.count)}
+    stub = StubDriveHttp(files, args.rtt)
+    service = build('drive', 'v3', http=stub, static_discovery=True)
+    drive_transfer.authorized_http = lambda credentials: stub
+    media_download.authorized_http = drive_transfer.authorized_http
+    # 只比较网络往返，关闭内容缓存
+    download_cache.enabled = False
+
+    print(f"模拟延迟 {args.rtt * 1000:.0f} ms，文件大小 {args.size} 字节")
+    old = benchmark('旧路径（串行）', run_old_path, service, list(files))
+    new = benchmark('新路径（并发）', run_new_path, service, list(files))
+    print(f"并发路径节省 {(1 - new / old) * 100:.0f}%")
+
+
+if __name__ == '__main__':
+    main()
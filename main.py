@@ -1,23 +1,30 @@
 # -*- coding: utf-8 -*-
 import uuid
+from datetime import datetime
 from contextlib import asynccontextmanager
 import uvicorn
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from fastapi import FastAPI, APIRouter
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.middleware.cors import CORSMiddleware
 from starlette.requests import Request
 from starlette.responses import JSONResponse
 
+from common.archive_stream import get_process_pool, shutdown_process_pool
 from common.config_loader import GLOBAL_CONFIG
 from common.consul_client import init_service_register_and_discovery, service_register_and_discovery_enabled, \
     deregister_service
 from common.logger import UVICORN_LOGGING_CONFIG, logger, request_id_context
 from common.pymysql_pool import init_pymysql_pool
+from common.scheduler import scheduler
 from common.utils import generate_request_id
 from router.router import router
-
-scheduler = AsyncIOScheduler()
+from service.archive_fetcher import get_archive_compression_workers
+from service.archive_job_service import archive_job_service, get_archive_job_cleanup_interval
+from service.google_drive_service import google_drive_service
+from service.idempotency import idempotency_store
+from service.metadata_mirror import metadata_mirror, get_metadata_mirror_enabled, get_metadata_mirror_interval
+from service.search_index import search_index, get_search_index_enabled, get_search_index_interval
+from service.upload_job_service import upload_job_service
 
 
 @asynccontextmanager
@@ -25,6 +32,33 @@ async def lifespan(app: FastAPI):
     # 启动事件
     logger.info("Application startup")
 
+    # 预先拉起压缩进程池
+    compression_workers = get_archive_compression_workers()
+    if compression_workers > 0:
+        get_process_pool(compression_workers)
+
+    # 后台归档任务与产物淘汰
+    scheduler.add_job(archive_job_service.evict_artifacts, 'interval',
+                      seconds=get_archive_job_cleanup_interval(), id='archive-job-eviction', replace_existing=True)
+    # 异步上传任务队列与过期记录清理
+    scheduler.add_job(upload_job_service.purge_finished_jobs, 'interval',
+                      seconds=get_archive_job_cleanup_interval(), id='upload-job-purge', replace_existing=True)
+    scheduler.add_job(idempotency_store.purge_expired, 'interval',
+                      seconds=get_archive_job_cleanup_interval(), id='idempotency-purge', replace_existing=True)
+    # 元数据镜像，启动后立即同步一次
+    if get_metadata_mirror_enabled():
+        scheduler.add_job(metadata_mirror.sync, 'interval', args=(google_drive_service.service,
+                                                                  google_drive_service.credentials),
+                          seconds=get_metadata_mirror_interval(), next_run_time=datetime.now(),
+                          id='metadata-mirror-sync', replace_existing=True)
+    # 文件名搜索索引，启动后立即建立
+    if get_search_index_enabled():
+        scheduler.add_job(search_index.refresh, 'interval', args=(google_drive_service.service,
+                                                                  google_drive_service.credentials),
+                          seconds=get_search_index_interval(), next_run_time=datetime.now(),
+                          id='search-index-refresh', replace_existing=True)
+    scheduler.start()
+    upload_job_service.start()
 
     if service_register_and_discovery_enabled():
         init_service_register_and_discovery()
@@ -33,6 +67,9 @@ async def lifespan(app: FastAPI):
 
     # 关闭事件
     logger.info("Application shutdown")
+    upload_job_service.stop()
+    scheduler.shutdown(wait=False)
+    shutdown_process_pool()
     if service_register_and_discovery_enabled():
         deregister_service()
 
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Drive 元数据镜像表
+"""
+
+from sqlalchemy import Column, String, BigInteger, Float, Text, Index
+
+from common.sqlalchemy_pool import SQLAlchemyBase
+
+
+class DriveFileMirror(SQLAlchemyBase):
+    """镜像中的单个文件，data 保存 Drive 返回的完整元数据，其余列用于查询和排序"""
+    __tablename__ = 'drive_file_mirror'
+
+    account = Column(String(64), primary_key=True)
+    file_id = Column(String(128), primary_key=True)
+    # 多父目录的旧文件只索引第一个父目录，完整列表在 data 中
+    parent_id = Column(String(128))
+    name = Column(String(512), nullable=False)
+    mime_type = Column(String(255), nullable=False)
+    size = Column(BigInteger)
+    # Drive 的 RFC 3339 时间格式固定，按字符串比较即按时间比较
+    modified_time = Column(String(32))
+    data = Column(Text, nullable=False)
+
+    __table_args__ = (
+        Index('idx_drive_file_mirror_parent', 'account', 'parent_id'),
+        Index('idx_drive_file_mirror_name', 'account', 'name'),
+        Index('idx_drive_file_mirror_mime_type', 'account', 'mime_type'),
+        Index('idx_drive_file_mirror_modified_time', 'account', 'modified_time'),
+    )
+
+
+class DriveMirrorState(SQLAlchemyBase):
+    """每个账户的同步进度，page_token 为 changes.list 下次开始的位置"""
+    __tablename__ = 'drive_mirror_state'
+
+    account = Column(String(64), primary_key=True)
+    page_token = Column(String(255))
+    # 最近一次追平 Drive 变更的时间（Unix 时间戳），用于判断镜像是否足够新
+    synced_at = Column(Float)
+    # 根目录的真实 ID，查询中的 'root' in parents 按该 ID 匹配
+    root_id = Column(String(128))
@@ -1,9 +1,17 @@
 # -*- coding: utf-8 -*-
-from typing import Optional
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query
-from starlette.responses import JSONResponse
+import asyncio
+import json
+from typing import Optional, List
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query, Header
+from starlette.responses import JSONResponse, StreamingResponse
 
+from common.http_conditional import metadata_etag, last_modified, validator_headers, is_not_modified, \
+    not_modified_response
+from service.archive_job_service import archive_job_service
+from service.drive_fields import parse_fields, with_validator_fields, project, FILE_INFO_FIELDS
 from service.google_drive_service import google_drive_service
+from service.idempotency import idempotency_store, request_fingerprint
+from service.upload_job_service import upload_job_service
 from common.logger import logger
 
 router = APIRouter(prefix="/google-drive", tags=["Google Drive"])
@@ -12,21 +20,25 @@ router = APIRouter(prefix="/google-drive", tags=["Google Drive"])
 @router.post("/upload")
 async def upload_file(
     file: UploadFile = File(..., description="要上传的文件"),
-    parent_folder_id: Optional[str] = Form(None, description="父文件夹ID（可选）")
+    parent_folder_id: Optional[str] = Form(None, description="父文件夹ID（可选）"),
+    dedup: bool = Form(False, description="目标文件夹中已有相同内容的文件时不再上传，直接返回已有文件"),
+    idempotency_key: Optional[str] = Header(None, description="幂等键（可选）", alias="Idempotency-Key")
 ):
     """
     上传文件到 Google Drive
     
     - **file**: 要上传的文件
     - **parent_folder_id**: 可选，指定父文件夹ID
+    - **dedup**: 可选，按内容 MD5 去重，命中时返回已有文件且 deduplicated 为 true
+    - **Idempotency-Key**: 可选，请求头中的幂等键，重复请求返回第一次的结果
     """
-    try:
+    async def upload_file_once():
         if not file.filename:
             raise HTTPException(status_code=400, detail="文件名不能为空")
         
         logger.info(f"开始上传文件: {file.filename}")
         
-        result = google_drive_service.upload_file(file, parent_folder_id)
+        result = await asyncio.to_thread(google_drive_service.upload_file, file, parent_folder_id, dedup)
         
         return JSONResponse(
             status_code=200,
@@ -36,6 +48,12 @@ async def upload_file(
             }
         )
         
+    try:
+        return await idempotency_store.run(
+            idempotency_key, 'google-drive/upload',
+            request_fingerprint(file.filename, file.size, parent_folder_id, dedup), upload_file_once
+        )
+        
     except HTTPException:
         raise
     except Exception as e:
@@ -43,17 +61,276 @@ async def upload_file(
         raise HTTPException(status_code=500, detail=f"上传文件失败: {str(e)}")
 
 
+@router.post("/upload-batch")
+async def upload_files(
+    files: List[UploadFile] = File(..., description="要上传的文件，可以有多个"),
+    parent_folder_id: Optional[str] = Form(None, description="父文件夹ID（可选）")
+):
+    """
+    批量上传文件到 Google Drive
+    
+    - **files**: 要上传的文件，同一字段名重复多次
+    - **parent_folder_id**: 可选，指定父文件夹ID
+    
+    文件并发上传，响应为 NDJSON，每完成一个文件输出一行结果，包含 index、name、success 以及 data 或 error
+    """
+    try:
+        if any(not file.filename for file in files):
+            raise HTTPException(status_code=400, detail="文件名不能为空")
+        
+        logger.info(f"开始批量上传 {len(files)} 个文件")
+        
+        results = await asyncio.to_thread(google_drive_service.upload_files, files, parent_folder_id)
+        
+        return StreamingResponse(
+            (json.dumps(result, ensure_ascii=False) + "\n" for result in results),
+            media_type="application/x-ndjson"
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"批量上传文件接口异常: {e}")
+        raise HTTPException(status_code=500, detail=f"批量上传文件失败: {str(e)}")
+
+
+@router.post("/upload-from-url")
+async def upload_from_url(
+    url: str = Form(..., description="要拉取的文件地址，支持 http/https"),
+    name: Optional[str] = Form(None, description="保存的文件名（可选），默认按响应头或 URL 推断"),
+    parent_folder_id: Optional[str] = Form(None, description="父文件夹ID（可选）"),
+    idempotency_key: Optional[str] = Header(None, description="幂等键（可选）", alias="Idempotency-Key")
+):
+    """
+    由服务端拉取 URL 内容并流式上传到 Google Drive
+    
+    数据边下载边分块写入 Drive，不在服务端完整缓存；源站中断时按 Range 续传
+    
+    - **url**: 文件地址
+    - **name**: 可选，保存的文件名
+    - **parent_folder_id**: 可选，指定父文件夹ID
+    - **Idempotency-Key**: 可选，请求头中的幂等键，重复请求返回第一次的结果
+    """
+    async def upload_from_url_once():
+        logger.info(f"开始从 URL 上传文件: {url}")
+        
+        result = await google_drive_service.upload_from_url(url, name, parent_folder_id)
+        
+        return JSONResponse(
+            status_code=200,
+            content={
+                "success": True,
+                "data": result
+            }
+        )
+        
+    try:
+        return await idempotency_store.run(
+            idempotency_key, 'google-drive/upload-from-url',
+            request_fingerprint(url, name, parent_folder_id), upload_from_url_once
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"从 URL 上传文件接口异常: {e}")
+        raise HTTPException(status_code=500, detail=f"从 URL 上传文件失败: {str(e)}")
+
+
+@router.post("/upload-jobs")
+async def create_upload_job(
+    file: UploadFile = File(..., description="要上传的文件"),
+    parent_folder_id: Optional[str] = Form(None, description="父文件夹ID（可选）"),
+    idempotency_key: Optional[str] = Header(None, description="幂等键（可选）", alias="Idempotency-Key")
+):
+    """
+    异步上传文件，文件落盘登记任务后立即返回任务ID
+    
+    后台按队列上传到 Drive，失败自动重试，服务重启后从中断处续传；通过任务状态接口查询进度
+    
+    - **file**: 要上传的文件
+    - **parent_folder_id**: 可选，指定父文件夹ID
+    - **Idempotency-Key**: 可选，请求头中的幂等键，重复请求返回第一次的结果
+    """
+    async def create_upload_job_once():
+        if not file.filename:
+            raise HTTPException(status_code=400, detail="文件名不能为空")
+        
+        result = await asyncio.to_thread(upload_job_service.create_job, file, parent_folder_id)
+        
+        return JSONResponse(
+            status_code=202,
+            content={
+                "success": True,
+                "data": result
+            }
+        )
+        
+    try:
+        return await idempotency_store.run(
+            idempotency_key, 'google-drive/upload-jobs',
+            request_fingerprint(file.filename, file.size, parent_folder_id), create_upload_job_once
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"创建上传任务接口异常: {e}")
+        raise HTTPException(status_code=500, detail=f"创建上传任务失败: {str(e)}")
+
+
+@router.get("/upload-jobs")
+async def list_upload_jobs(
+    status: Optional[str] = Query(None, description="按状态过滤: pending、running、completed、failed"),
+    limit: int = Query(100, ge=1, le=1000, description="最多返回的任务数")
+):
+    """
+    按创建时间倒序列出异步上传任务
+    """
+    try:
+        result = upload_job_service.list_jobs(status, limit)
+        
+        return JSONResponse(
+            status_code=200,
+            content={
+                "success": True,
+                "data": result
+            }
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"列出上传任务接口异常: {e}")
+        raise HTTPException(status_code=500, detail=f"列出上传任务失败: {str(e)}")
+
+
+@router.get("/upload-jobs/{job_id}")
+async def get_upload_job(job_id: str):
+    """
+    查询异步上传任务状态与进度，完成后 data 为上传结果
+    
+    - **job_id**: 上传任务ID
+    """
+    try:
+        result = upload_job_service.get_job(job_id)
+        
+        return JSONResponse(
+            status_code=200,
+            content={
+                "success": True,
+                "data": result
+            }
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"查询上传任务接口异常: {e}")
+        raise HTTPException(status_code=500, detail=f"查询上传任务失败: {str(e)}")
+
+
+@router.post("/upload-sessions")
+async def create_upload_session(
+    name: str = Form(..., description="文件名"),
+    size: Optional[int] = Form(None, ge=0, description="文件大小（字节，可选）"),
+    mime_type: Optional[str] = Form(None, description="文件类型（可选）"),
+    parent_folder_id: Optional[str] = Form(None, description="父文件夹ID（可选）"),
+    origin: Optional[str] = Form(None, description="浏览器直传时的页面来源（可选）"),
+    idempotency_key: Optional[str] = Header(None, description="幂等键（可选）", alias="Idempotency-Key")
+):
+    """
+    创建 Drive 可续传上传会话，客户端直接向返回的 session_uri 上传文件内容，数据不经过本服务
+    
+    - **name**: 文件名
+    - **size**: 可选，文件大小，提供时 Drive 会校验上传长度
+    - **mime_type**: 可选，文件类型
+    - **parent_folder_id**: 可选，指定父文件夹ID
+    - **origin**: 可选，浏览器直传时传入页面的 Origin，Drive 会在会话地址上返回对应的 CORS 响应头
+    - **Idempotency-Key**: 可选，请求头中的幂等键，重复请求返回第一次的结果
+    """
+    async def create_upload_session_once():
+        if not name:
+            raise HTTPException(status_code=400, detail="文件名不能为空")
+        
+        logger.info(f"创建上传会话: {name}")
+        
+        result = await asyncio.to_thread(google_drive_service.create_upload_session, name, size, mime_type,
+                                         parent_folder_id, origin)
+        
+        return JSONResponse(
+            status_code=200,
+            content={
+                "success": True,
+                "data": result
+            }
+        )
+        
+    try:
+        return await idempotency_store.run(
+            idempotency_key, 'google-drive/upload-sessions',
+            request_fingerprint(name, size, mime_type, parent_folder_id, origin), create_upload_session_once
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"创建上传会话接口异常: {e}")
+        raise HTTPException(status_code=500, detail=f"创建上传会话失败: {str(e)}")
+
+
+@router.post("/upload-sessions/complete")
+async def complete_upload_session(
+    session_uri: str = Form(..., description="创建会话时返回的 session_uri"),
+    size: Optional[int] = Form(None, ge=0, description="文件大小（字节，可选）")
+):
+    """
+    客户端直传结束后确认上传结果
+    
+    - **session_uri**: 创建会话时返回的地址
+    - **size**: 可选，文件大小
+    
+    上传未完成时返回 status=incomplete 与已提交的字节数，客户端可从该位置继续上传
+    """
+    try:
+        result = await asyncio.to_thread(google_drive_service.complete_upload_session, session_uri, size)
+        
+        return JSONResponse(
+            status_code=200,
+            content={
+                "success": True,
+                "data": result
+            }
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"确认上传会话接口异常: {e}")
+        raise HTTPException(status_code=500, detail=f"确认上传会话失败: {str(e)}")
+
+
 @router.get("/download/{file_id}")
-async def download_file(file_id: str):
+async def download_file(
+    file_id: str,
+    range_header: Optional[str] = Header(None, alias="Range", description="可选，字节区间，例如 bytes=0-1023"),
+    if_range: Optional[str] = Header(None, alias="If-Range", description="可选，区间请求的校验条件"),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match", description="可选，客户端缓存的 ETag"),
+    if_modified_since: Optional[str] = Header(None, alias="If-Modified-Since", description="可选，客户端缓存的修改时间")
+):
     """
     从 Google Drive 下载指定文件
     
     - **file_id**: Google Drive 文件ID
+    - **Range**: 可选，请求头中的字节区间，返回 206 部分内容；多个区间以 multipart/byteranges 返回
+    - **If-None-Match / If-Modified-Since**: 可选，文件未变化时返回 304
     """
     try:
-        logger.info(f"开始下载文件: {file_id}")
+        logger.info(f"开始下载文件: {file_id}, 区间: {range_header}")
         
-        return google_drive_service.download_file(file_id)
+        # 元数据请求与首个分块的拉取都会阻塞，放到线程中执行，不占用事件循环
+        return await asyncio.to_thread(google_drive_service.download_file, file_id, range_header, if_range,
+                                       if_none_match, if_modified_since)
         
     except HTTPException:
         raise
@@ -64,17 +341,26 @@ async def download_file(file_id: str):
 
 @router.get("/download-all")
 async def download_all_files(
-    query: Optional[str] = Query(None, description="搜索查询条件，用于过滤文件")
+    query: Optional[str] = Query(None, description="搜索查询条件，用于过滤文件"),
+    compression_level: Optional[int] = Query(None, ge=0, le=9, description="压缩级别 0-9，0 表示仅存储"),
+    archive_format: str = Query("zip", alias="format", description="归档格式: zip、zip64、tar、tar.gz、tar.zst"),
+    folder_id: Optional[str] = Query(None, description="文件夹ID，指定时递归打包整个目录树")
 ):
     """
-    下载所有文件为ZIP压缩包
+    下载所有文件为压缩包
     
     - **query**: 可选，搜索查询条件来过滤文件
+    - **compression_level**: 可选，压缩级别，ZIP 中图片、视频、压缩包等已压缩内容始终仅存储
+    - **format**: 可选，归档格式。zip64 对所有成员强制使用 ZIP64；tar 系列严格顺序输出、没有末尾索引，适合超大目录
+    - **folder_id**: 可选，递归打包该文件夹下的所有子文件夹并保留相对路径，不能与 query 同时使用
     """
     try:
-        logger.info(f"开始下载所有文件，查询条件: {query}")
+        logger.info(f"开始下载所有文件，查询条件: {query}, 文件夹: {folder_id}, 压缩级别: {compression_level}, "
+                    f"格式: {archive_format}")
         
-        return google_drive_service.download_all_files(query)
+        # 打开归档时要等第一页文件列表返回，放到线程中执行，不占用事件循环
+        return await asyncio.to_thread(google_drive_service.download_all_files, query, compression_level,
+                                       archive_format, folder_id)
         
     except HTTPException:
         raise
@@ -83,10 +369,96 @@ async def download_all_files(
         raise HTTPException(status_code=500, detail=f"下载所有文件失败: {str(e)}")
 
 
+@router.post("/archive-jobs")
+async def create_archive_job(
+    query: Optional[str] = Form(None, description="搜索查询条件，用于过滤文件"),
+    compression_level: Optional[int] = Form(None, ge=0, le=9, description="压缩级别 0-9，0 表示仅存储"),
+    archive_format: str = Form("zip", alias="format", description="归档格式: zip、zip64、tar、tar.gz、tar.zst"),
+    folder_id: Optional[str] = Form(None, description="文件夹ID，指定时递归打包整个目录树"),
+    idempotency_key: Optional[str] = Header(None, description="幂等键（可选）", alias="Idempotency-Key")
+):
+    """
+    创建后台归档任务，参数与 download-all 相同
+    
+    任务在服务端写入本地磁盘，客户端断开不影响打包；通过任务状态接口查询进度，完成后下载产物
+    - **Idempotency-Key**: 可选，请求头中的幂等键，重复请求返回第一次的结果
+    """
+    async def create_archive_job_once():
+        result = archive_job_service.create_job(query, compression_level, archive_format, folder_id)
+        
+        return JSONResponse(
+            status_code=202,
+            content={
+                "success": True,
+                "data": result
+            }
+        )
+        
+    try:
+        return await idempotency_store.run(
+            idempotency_key, 'google-drive/archive-jobs',
+            request_fingerprint(query, compression_level, archive_format, folder_id), create_archive_job_once
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"创建归档任务接口异常: {e}")
+        raise HTTPException(status_code=500, detail=f"创建归档任务失败: {str(e)}")
+
+
+@router.get("/archive-jobs/{job_id}")
+async def get_archive_job(job_id: str):
+    """
+    查询后台归档任务状态与进度
+    
+    - **job_id**: 归档任务ID
+    """
+    try:
+        result = archive_job_service.get_job(job_id)
+        
+        return JSONResponse(
+            status_code=200,
+            content={
+                "success": True,
+                "data": result
+            }
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"查询归档任务接口异常: {e}")
+        raise HTTPException(status_code=500, detail=f"查询归档任务失败: {str(e)}")
+
+
+@router.get("/archive-jobs/{job_id}/download")
+async def download_archive_job(job_id: str):
+    """
+    下载已完成的归档产物，支持 Range 请求断点续传
+    
+    - **job_id**: 归档任务ID
+    """
+    try:
+        logger.info(f"开始下载归档任务产物: {job_id}")
+        
+        return archive_job_service.get_artifact_response(job_id)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"下载归档产物接口异常: {e}")
+        raise HTTPException(status_code=500, detail=f"下载归档产物失败: {str(e)}")
+
+
 @router.get("/list")
 async def list_files(
     query: Optional[str] = Query(None, description="搜索查询条件"),
-    page_size: int = Query(100, ge=1, le=1000, description="每页文件数量，范围1-1000")
+    page_size: int = Query(100, ge=1, le=1000, description="每页文件数量，范围1-1000"),
+    page_token: Optional[str] = Query(None, description="上一页返回的 next_page_token（可选）"),
+    stream: bool = Query(False, description="在服务端翻完全部分页，以 NDJSON 逐行返回文件"),
+    fields: Optional[str] = Query(None, description="逗号分隔的返回字段（可选），例如 id,name"),
+    max_staleness: Optional[float] = Query(None, ge=0, description="允许读取本地元数据镜像的最大延迟（秒，可选）")
 ):
     """
     列出 Google Drive 中的文件
@@ -95,12 +467,27 @@ async def list_files(
       - `name contains 'test'` - 搜索文件名包含 'test' 的文件
       - `mimeType = 'image/jpeg'` - 搜索JPEG图片文件
       - `parents in 'FOLDER_ID'` - 搜索指定文件夹中的文件
-    - **page_size**: 每页返回的文件数量
+    - **page_size**: 每页返回的文件数量，流式模式下为每次向 Drive 请求的数量
+    - **page_token**: 可选，从指定分页开始
+    - **stream**: 可选，为 true 时响应为 NDJSON，每行一个文件，最后一行为 {"done": true, "count": N}；
+      中途失败时最后一行为 {"error": ..., "page_token": ...}，可带该 page_token 继续
+    - **fields**: 可选，逗号分隔的文件字段，只向 Drive 请求并返回这些字段，例如 `id,name`
+    - **max_staleness**: 可选，元数据镜像在该秒数内同步过时直接读镜像，否则请求 Drive；流式模式始终请求 Drive
     """
     try:
-        logger.info(f"列出文件，查询条件: {query}, 页面大小: {page_size}")
+        logger.info(f"列出文件，查询条件: {query}, 页面大小: {page_size}, 流式: {stream}")
+        
+        if stream:
+            # 第一页在返回前取回，放到线程中执行，不占用事件循环
+            lines = await asyncio.to_thread(google_drive_service.stream_files, query, page_size, page_token, fields)
+            return StreamingResponse(
+                (json.dumps(line, ensure_ascii=False) + "\n" for line in lines),
+                media_type="application/x-ndjson"
+            )
         
-        result = google_drive_service.list_files(query, page_size)
+        # 在线程池中执行，相同查询的并发请求由列表缓存合并为一次 Drive 调用
+        result = await asyncio.to_thread(google_drive_service.list_files, query, page_size, page_token, fields,
+                                         max_staleness)
         
         return JSONResponse(
             status_code=200,
@@ -118,23 +505,41 @@ async def list_files(
 
 
 @router.get("/file-info/{file_id}")
-async def get_file_info(file_id: str):
+async def get_file_info(
+    file_id: str,
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match", description="可选，客户端缓存的 ETag"),
+    if_modified_since: Optional[str] = Header(None, alias="If-Modified-Since", description="可选，客户端缓存的修改时间"),
+    fields: Optional[str] = Query(None, description="逗号分隔的返回字段（可选），例如 id,name"),
+    max_staleness: Optional[float] = Query(None, ge=0, description="允许读取本地元数据镜像的最大延迟（秒，可选）")
+):
     """
     获取指定文件的详细信息
     
     - **file_id**: Google Drive 文件ID
+    - **If-None-Match / If-Modified-Since**: 可选，文件元数据未变化时返回 304
+    - **fields**: 可选，逗号分隔的文件字段，只向 Drive 请求并返回这些字段，例如 `id,name`
+    - **max_staleness**: 可选，元数据镜像在该秒数内同步过时直接读镜像，否则请求 Drive
     """
     try:
         logger.info(f"获取文件信息: {file_id}")
         
-        result = google_drive_service.get_file_info(file_id)
+        names = parse_fields(fields, FILE_INFO_FIELDS)
+        # 校验头需要的字段一并请求，返回前按调用方字段裁剪
+        result = google_drive_service.get_file_info(file_id, with_validator_fields(names), max_staleness)
+        
+        etag = metadata_etag(result)
+        modified = last_modified(result)
+        headers = validator_headers(etag, modified)
+        if is_not_modified(if_none_match, if_modified_since, etag, modified):
+            return not_modified_response(headers)
         
         return JSONResponse(
             status_code=200,
             content={
                 "success": True,
-                "data": result
-            }
+                "data": project(result, names)
+            },
+            headers=headers
         )
         
     except HTTPException:
@@ -144,14 +549,50 @@ async def get_file_info(file_id: str):
         raise HTTPException(status_code=500, detail=f"获取文件信息失败: {str(e)}")
 
 
+@router.get("/search")
+async def search_files(
+    q: str = Query(..., min_length=1, description="搜索词"),
+    mode: str = Query("auto", description="匹配方式: auto、prefix、substring、fuzzy"),
+    limit: int = Query(20, ge=1, le=200, description="最多返回的文件数，范围1-200"),
+    content: bool = Query(False, description="同时匹配已提取的文件内容")
+):
+    """
+    在本地索引中搜索文件名，不访问 Drive
+    
+    - **q**: 搜索词，多个单词时每个单词都要命中
+    - **mode**: 可选，auto 综合前缀、子串与模糊匹配并按相关度排序；prefix 只匹配单词前缀；
+      substring 按整个搜索词匹配子串；fuzzy 匹配单词前缀与拼写相近的单词
+    - **limit**: 可选，最多返回的文件数
+    - **content**: 可选，为 true 时也匹配已提取内容的小体积文本与 PDF 文件
+    """
+    try:
+        logger.info(f"搜索文件: {q}, 匹配方式: {mode}")
+        
+        result = google_drive_service.search_files(q, mode, limit, content)
+        
+        return JSONResponse(
+            status_code=200,
+            content={
+                "success": True,
+                "data": result
+            }
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"搜索文件接口异常: {e}")
+        raise HTTPException(status_code=500, detail=f"搜索文件失败: {str(e)}")
+
+
 @router.get("/health")
 async def health_check():
     """
     检查 Google Drive 服务健康状态
     """
     try:
-        # 尝试列出文件来检查服务是否正常
-        google_drive_service.list_files(page_size=1)
+        # 尝试列出文件来检查服务是否正常，不经过缓存，确保实际访问了 Drive
+        await asyncio.to_thread(google_drive_service.list_files, page_size=1, use_cache=False)
         
         return JSONResponse(
             status_code=200,
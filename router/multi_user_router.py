@@ -4,10 +4,14 @@
 支持每个用户使用自己的 Google Drive 账户
 """
 
+import asyncio
+import json
 from typing import Optional
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query, Header
-from starlette.responses import JSONResponse, RedirectResponse
+from starlette.responses import JSONResponse, RedirectResponse, StreamingResponse
 
+from service.idempotency import idempotency_store, request_fingerprint
+from service.metadata_cache import account_key
 from service.multi_user_google_drive_service import multi_user_google_drive_service
 from common.logger import logger
 
@@ -87,7 +91,8 @@ async def auth_callback(
 async def upload_file(
     file: UploadFile = File(..., description="要上传的文件"),
     parent_folder_id: Optional[str] = Form(None, description="父文件夹ID（可选）"),
-    user_token: str = Header(..., description="用户访问令牌", alias="X-User-Token")
+    user_token: str = Header(..., description="用户访问令牌", alias="X-User-Token"),
+    idempotency_key: Optional[str] = Header(None, description="幂等键（可选）", alias="Idempotency-Key")
 ):
     """
     上传文件到用户的 Google Drive
@@ -95,14 +100,16 @@ async def upload_file(
     - **file**: 要上传的文件
     - **parent_folder_id**: 可选，指定父文件夹ID
     - **X-User-Token**: 请求头中的用户令牌（JSON 格式）
+    - **Idempotency-Key**: 可选，请求头中的幂等键，重复请求返回第一次的结果
     """
-    try:
+    async def upload_file_once():
         if not file.filename:
             raise HTTPException(status_code=400, detail="文件名不能为空")
         
         logger.info(f"用户上传文件到自己的 Drive: {file.filename}")
         
-        result = multi_user_google_drive_service.upload_file(file, user_token, parent_folder_id)
+        result = await asyncio.to_thread(multi_user_google_drive_service.upload_file, file, user_token,
+                                         parent_folder_id)
         
         return JSONResponse(
             status_code=200,
@@ -112,6 +119,12 @@ async def upload_file(
             }
         )
         
+    try:
+        return await idempotency_store.run(
+            idempotency_key, f'multi-user/upload/{account_key(user_token)}',
+            request_fingerprint(file.filename, file.size, parent_folder_id), upload_file_once
+        )
+        
     except HTTPException:
         raise
     except Exception as e:
@@ -119,21 +132,115 @@ async def upload_file(
         raise HTTPException(status_code=500, detail=f"上传文件失败: {str(e)}")
 
 
+@router.post("/upload-sessions")
+async def create_upload_session(
+    name: str = Form(..., description="文件名"),
+    size: Optional[int] = Form(None, ge=0, description="文件大小（字节，可选）"),
+    mime_type: Optional[str] = Form(None, description="文件类型（可选）"),
+    parent_folder_id: Optional[str] = Form(None, description="父文件夹ID（可选）"),
+    origin: Optional[str] = Form(None, description="浏览器直传时的页面来源（可选）"),
+    user_token: str = Header(..., description="用户访问令牌", alias="X-User-Token"),
+    idempotency_key: Optional[str] = Header(None, description="幂等键（可选）", alias="Idempotency-Key")
+):
+    """
+    创建 Drive 可续传上传会话，客户端直接向返回的 session_uri 上传文件内容，数据不经过本服务
+    
+    - **name**: 文件名
+    - **size**: 可选，文件大小，提供时 Drive 会校验上传长度
+    - **mime_type**: 可选，文件类型
+    - **parent_folder_id**: 可选，指定父文件夹ID
+    - **X-User-Token**: 请求头中的用户令牌（JSON 格式）
+    - **origin**: 可选，浏览器直传时传入页面的 Origin，Drive 会在会话地址上返回对应的 CORS 响应头
+    - **Idempotency-Key**: 可选，请求头中的幂等键，重复请求返回第一次的结果
+    """
+    async def create_upload_session_once():
+        if not name:
+            raise HTTPException(status_code=400, detail="文件名不能为空")
+        
+        logger.info(f"用户创建上传会话: {name}")
+        
+        result = await asyncio.to_thread(
+            multi_user_google_drive_service.create_upload_session,
+            user_token, name, size, mime_type, parent_folder_id, origin
+        )
+        
+        return JSONResponse(
+            status_code=200,
+            content={
+                "success": True,
+                "data": result
+            }
+        )
+        
+    try:
+        return await idempotency_store.run(
+            idempotency_key, f'multi-user/upload-sessions/{account_key(user_token)}',
+            request_fingerprint(name, size, mime_type, parent_folder_id, origin), create_upload_session_once
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"创建上传会话接口异常: {e}")
+        raise HTTPException(status_code=500, detail=f"创建上传会话失败: {str(e)}")
+
+
+@router.post("/upload-sessions/complete")
+async def complete_upload_session(
+    session_uri: str = Form(..., description="创建会话时返回的 session_uri"),
+    size: Optional[int] = Form(None, ge=0, description="文件大小（字节，可选）"),
+    user_token: str = Header(..., description="用户访问令牌", alias="X-User-Token")
+):
+    """
+    客户端直传结束后确认上传结果
+    
+    - **session_uri**: 创建会话时返回的地址
+    - **size**: 可选，文件大小
+    - **X-User-Token**: 请求头中的用户令牌（JSON 格式），上传完成时清除该用户的列表缓存
+    
+    上传未完成时返回 status=incomplete 与已提交的字节数，客户端可从该位置继续上传
+    """
+    try:
+        result = await asyncio.to_thread(multi_user_google_drive_service.complete_upload_session, user_token,
+                                         session_uri, size)
+        
+        return JSONResponse(
+            status_code=200,
+            content={
+                "success": True,
+                "data": result
+            }
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"确认上传会话接口异常: {e}")
+        raise HTTPException(status_code=500, detail=f"确认上传会话失败: {str(e)}")
+
+
 @router.get("/download/{file_id}")
 async def download_file(
     file_id: str,
-    user_token: str = Header(..., description="用户访问令牌", alias="X-User-Token")
+    user_token: str = Header(..., description="用户访问令牌", alias="X-User-Token"),
+    range_header: Optional[str] = Header(None, alias="Range", description="可选，字节区间，例如 bytes=0-1023"),
+    if_range: Optional[str] = Header(None, alias="If-Range", description="可选，区间请求的校验条件"),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match", description="可选，客户端缓存的 ETag"),
+    if_modified_since: Optional[str] = Header(None, alias="If-Modified-Since", description="可选，客户端缓存的修改时间")
 ):
     """
     从用户的 Google Drive 下载指定文件
     
     - **file_id**: Google Drive 文件ID
     - **X-User-Token**: 请求头中的用户令牌（JSON 格式）
+    - **Range**: 可选，请求头中的字节区间，返回 206 部分内容
+    - **If-None-Match / If-Modified-Since**: 可选，文件未变化时返回 304
     """
     try:
         logger.info(f"用户从自己的 Drive 下载文件: {file_id}")
         
-        return multi_user_google_drive_service.download_file(file_id, user_token)
+        return await asyncio.to_thread(multi_user_google_drive_service.download_file, file_id, user_token,
+                                       range_header, if_range, if_none_match, if_modified_since)
         
     except HTTPException:
         raise
@@ -146,19 +253,36 @@ async def download_file(
 async def list_files(
     query: Optional[str] = Query(None, description="搜索查询条件"),
     page_size: int = Query(100, ge=1, le=1000, description="每页文件数量，范围1-1000"),
+    page_token: Optional[str] = Query(None, description="上一页返回的 next_page_token（可选）"),
+    stream: bool = Query(False, description="在服务端翻完全部分页，以 NDJSON 逐行返回文件"),
+    fields: Optional[str] = Query(None, description="逗号分隔的返回字段（可选），例如 id,name"),
     user_token: str = Header(..., description="用户访问令牌", alias="X-User-Token")
 ):
     """
     列出用户 Google Drive 中的文件
     
     - **query**: 可选，搜索查询条件
-    - **page_size**: 每页返回的文件数量
+    - **page_size**: 每页返回的文件数量，流式模式下为每次向 Drive 请求的数量
+    - **page_token**: 可选，从指定分页开始
+    - **stream**: 可选，为 true 时响应为 NDJSON，格式与 /google-drive/list 相同
+    - **fields**: 可选，逗号分隔的文件字段，只向 Drive 请求并返回这些字段，例如 `id,name`
     - **X-User-Token**: 请求头中的用户令牌（JSON 格式）
     """
     try:
-        logger.info(f"用户获取自己的 Drive 文件列表，查询条件: {query}")
+        logger.info(f"用户获取自己的 Drive 文件列表，查询条件: {query}, 流式: {stream}")
+        
+        if stream:
+            # 第一页在返回前取回，放到线程中执行，不占用事件循环
+            lines = await asyncio.to_thread(multi_user_google_drive_service.stream_files, user_token, query,
+                                            page_size, page_token, fields)
+            return StreamingResponse(
+                (json.dumps(line, ensure_ascii=False) + "\n" for line in lines),
+                media_type="application/x-ndjson"
+            )
         
-        result = multi_user_google_drive_service.list_files(user_token, query, page_size)
+        # 在线程池中执行，相同查询的并发请求由列表缓存合并为一次 Drive 调用
+        result = await asyncio.to_thread(multi_user_google_drive_service.list_files, user_token, query, page_size,
+                                         page_token, fields)
         
         return JSONResponse(
             status_code=200,
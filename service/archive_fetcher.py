@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+归档成员并发预取
+用有界线程池并发下载多个成员，按原始顺序交给归档写入器
+"""
+
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Iterable, Iterator
+
+from common.logger import logger
+from service.drive_transfer import get_transfer_config, authorized_http, iter_media_chunks
+
+DEFAULT_ARCHIVE_CONCURRENCY = 4
+DEFAULT_ARCHIVE_PREFETCH_BYTES = 64 * 1024 * 1024
+# 当前正在输出的成员不受预取预算限制时，最多允许积压的分块数
+_HEAD_QUEUE_CHUNKS = 4
+
+_EOF = object()
+
+
+def get_archive_compression_workers() -> int:
+    """并行压缩进程数，0 表示在请求线程内压缩"""
+    return int(get_transfer_config().get('archive_compression_workers', os.cpu_count() or 1))
+
+
+def get_archive_concurrency() -> int:
+    """同时从 Drive 拉取的归档成员数"""
+    return max(1, int(get_transfer_config().get('archive_concurrency', DEFAULT_ARCHIVE_CONCURRENCY)))
+
+
+def get_archive_prefetch_bytes() -> int:
+    """预取但尚未输出的成员数据总字节上限"""
+    return int(get_transfer_config().get('archive_prefetch_bytes', DEFAULT_ARCHIVE_PREFETCH_BYTES))
+
+
+class _ByteBudget:
+    """预取字节预算，超出上限时后续成员的下载线程阻塞等待"""
+
+    def __init__(self, limit: int):
+        self._limit = limit
+        self._used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, size: int, is_head, stop: threading.Event) -> bool:
+        with self._cond:
+            while self._used > 0 and self._used + size > self._limit and not is_head():
+                if stop.is_set():
+                    return False
+                self._cond.wait(0.5)
+            if stop.is_set():
+                return False
+            self._used += size
+            return True
+
+    def release(self, size: int):
+        with self._cond:
+            self._used -= size
+            self._cond.notify_all()
+
+    def notify(self):
+        with self._cond:
+            self._cond.notify_all()
+
+
+class FetchedMember:
+    """一个预取中的归档成员"""
+
+    def __init__(self, index: int, file_info: Dict[str, Any], uri: str, budget: _ByteBudget):
+        self.index = index
+        self.file_info = file_info
+        self.uri = uri
+        self.error: Optional[Exception] = None
+        self._budget = budget
+        self._queue = queue.Queue()
+        self._first = None
+
+    def put(self, chunk: bytes):
+        self._queue.put(chunk)
+
+    def backlog(self) -> int:
+        return self._queue.qsize()
+
+    def finish(self, error: Optional[Exception] = None):
+        self._queue.put(error if error is not None else _EOF)
+
+    def _get(self):
+        item = self._queue.get()
+        if isinstance(item, Exception):
+            raise item
+        if item is not _EOF:
+            self._budget.release(len(item))
+        return item
+
+    def wait_first_chunk(self):
+        """等待首个分块，打开失败时记录错误"""
+        try:
+            self._first = self._get()
+        except Exception as e:
+            self.error = e
+
+    def chunks(self) -> Iterator[bytes]:
+        """按顺序产出成员数据，中途出错时直接抛出"""
+        item = self._first
+        self._first = None
+        while item is not _EOF:
+            yield item
+            item = self._get()
+
+
+class ArchiveMemberFetcher:
+    """
+    归档成员并发预取器
+
+    最多 concurrency 个成员同时下载，已下载未输出的数据受 prefetch_bytes 限制；
+    当前输出的成员始终可以继续下载，避免预算被后续成员占满而死锁。
+    """
+
+    def __init__(self, service, credentials, concurrency: Optional[int] = None,
+                 prefetch_bytes: Optional[int] = None):
+        self.service = service
+        self.credentials = credentials
+        self.concurrency = concurrency or get_archive_concurrency()
+        self._budget = _ByteBudget(prefetch_bytes or get_archive_prefetch_bytes())
+        self._stop = threading.Event()
+        self._local = threading.local()
+        self._head_index = -1
+
+    def _http(self):
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = self._local.http = authorized_http(self.credentials)
+        return http
+
+    def _fetch(self, member: FetchedMember):
+        def is_head():
+            return member.index == self._head_index and member.backlog() < _HEAD_QUEUE_CHUNKS
+
+        try:
+            for chunk in iter_media_chunks(self._http(), member.uri):
+                if not self._budget.acquire(len(chunk), is_head, self._stop):
+                    return
+                member.put(chunk)
+            member.finish()
+        except Exception as e:
+            member.finish(e)
+
+    def fetch(self, files: Iterable[Dict[str, Any]]) -> Iterator[FetchedMember]:
+        """按输入顺序产出成员，首个分块已就绪或已记录打开错误"""
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='archive-fetch')
+        window = self.concurrency * 2
+        pending = deque()
+        files_iter = iter(files)
+        index = 0
+        try:
+            while True:
+                while len(pending) < window:
+                    file_info = next(files_iter, None)
+                    if file_info is None:
+                        break
+                    uri = self.service.files().get_media(fileId=file_info['id']).uri
+                    member = FetchedMember(index, file_info, uri, self._budget)
+                    index += 1
+                    executor.submit(self._fetch, member)
+                    pending.append(member)
+                if not pending:
+                    return
+                member = pending.popleft()
+                self._head_index = member.index
+                self._budget.notify()
+                member.wait_first_chunk()
+                yield member
+        finally:
+            self._stop.set()
+            self._budget.notify()
+            executor.shutdown(wait=False, cancel_futures=True)
+            logger.info(f"归档成员预取结束，共调度 {index} 个成员")
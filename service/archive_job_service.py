@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+后台归档任务
+由调度器在后台把下载全部文件的归档写入本地磁盘，客户端断开不影响打包，
+完成后通过支持 Range 的下载接口分段、断点续传地取回
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Optional, Dict, Any, List
+
+from apscheduler.executors.pool import ThreadPoolExecutor
+from fastapi import HTTPException
+from starlette.responses import FileResponse
+
+from common.archive_stream import ARCHIVE_FORMATS
+from common.logger import logger
+from common.scheduler import scheduler
+from service.drive_transfer import get_transfer_config
+from service.google_drive_service import google_drive_service
+
+DEFAULT_ARCHIVE_JOB_DIR = 'data/archive_jobs'
+DEFAULT_ARCHIVE_JOB_MAX_AGE = 24 * 3600
+DEFAULT_ARCHIVE_JOB_MAX_BYTES = 20 * 1024 * 1024 * 1024
+DEFAULT_ARCHIVE_JOB_CLEANUP_INTERVAL = 600
+DEFAULT_ARCHIVE_JOB_CONCURRENCY = 2
+
+# 归档任务使用独立的调度器执行器，长时间运行的打包不会占满定时任务的线程池
+ARCHIVE_JOB_EXECUTOR = 'archive-jobs'
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+JOB_EXPIRED = 'expired'
+
+# 进度写盘的最小间隔（秒），避免每个成员都重写任务文件
+_PERSIST_INTERVAL = 2
+
+
+def get_archive_job_dir() -> str:
+    """归档任务产物与任务描述文件的存放目录"""
+    return get_transfer_config().get('archive_job_dir', DEFAULT_ARCHIVE_JOB_DIR)
+
+
+def get_archive_job_max_age() -> int:
+    """已完成产物的最长保留时间（秒）"""
+    return int(get_transfer_config().get('archive_job_max_age', DEFAULT_ARCHIVE_JOB_MAX_AGE))
+
+
+def get_archive_job_max_bytes() -> int:
+    """所有已完成产物的总字节上限，超出时从最早完成的开始淘汰"""
+    return int(get_transfer_config().get('archive_job_max_bytes', DEFAULT_ARCHIVE_JOB_MAX_BYTES))
+
+
+def get_archive_job_cleanup_interval() -> int:
+    """产物淘汰任务的执行间隔（秒）"""
+    return int(get_transfer_config().get('archive_job_cleanup_interval', DEFAULT_ARCHIVE_JOB_CLEANUP_INTERVAL))
+
+
+def get_archive_job_concurrency() -> int:
+    """同时执行的归档任务数，超出的任务排队等待"""
+    return max(1, int(get_transfer_config().get('archive_job_concurrency', DEFAULT_ARCHIVE_JOB_CONCURRENCY)))
+
+
+class ArchiveJobService:
+    """后台归档任务管理，任务状态保存在内存并落盘为 <job_id>.json"""
+
+    def __init__(self, job_dir: Optional[str] = None):
+        self.job_dir = job_dir or get_archive_job_dir()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._last_persist: Dict[str, float] = {}
+        os.makedirs(self.job_dir, exist_ok=True)
+        self._load_jobs()
+
+    def _job_path(self, job_id: str) -> str:
+        return os.path.join(self.job_dir, f"{job_id}.json")
+
+    def _load_jobs(self):
+        """加载历史任务，服务重启前未完成的任务标记为失败并清理半成品"""
+        for entry in os.listdir(self.job_dir):
+            if not entry.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.job_dir, entry), 'r', encoding='utf-8') as f:
+                    job = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"读取归档任务 {entry} 失败，已忽略: {e}")
+                continue
+            if job.get('status') in (JOB_PENDING, JOB_RUNNING):
+                job['status'] = JOB_FAILED
+                job['error'] = '服务重启，任务已中断'
+                job['finished_at'] = time.time()
+                self._remove_file(self._part_path(job))
+            self._jobs[job['job_id']] = job
+            self._persist(job, force=True)
+        logger.info(f"已加载 {len(self._jobs)} 个归档任务")
+
+    def _persist(self, job: Dict[str, Any], force: bool = False):
+        now = time.time()
+        if not force and now - self._last_persist.get(job['job_id'], 0) < _PERSIST_INTERVAL:
+            return
+        self._last_persist[job['job_id']] = now
+        path = self._job_path(job['job_id'])
+        tmp_path = f"{path}.tmp"
+        with self._lock:
+            data = json.dumps(job, ensure_ascii=False)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _update(self, job: Dict[str, Any], force: bool = False, **fields):
+        with self._lock:
+            job.update(fields)
+        self._persist(job, force=force)
+
+    def _part_path(self, job: Dict[str, Any]) -> str:
+        return os.path.join(self.job_dir, f"{job['job_id']}.part")
+
+    def _artifact_path(self, job: Dict[str, Any]) -> str:
+        return os.path.join(self.job_dir, f"{job['job_id']}.{job['extension']}")
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def create_job(self, query: Optional[str] = None, compression_level: Optional[int] = None,
+                   archive_format: str = 'zip', folder_id: Optional[str] = None) -> Dict[str, Any]:
+        """创建后台归档任务并交给调度器执行"""
+        if query and folder_id:
+            raise HTTPException(status_code=400, detail="query 与 folder_id 不能同时指定")
+        if archive_format not in ARCHIVE_FORMATS:
+            raise HTTPException(status_code=400, detail=f"不支持的归档格式: {archive_format}，可选: {', '.join(ARCHIVE_FORMATS)}")
+
+        job_id = uuid.uuid4().hex
+        job = {
+            'job_id': job_id,
+            'status': JOB_PENDING,
+            'query': query,
+            'folder_id': folder_id,
+            'format': archive_format,
+            'compression_level': compression_level,
+            'extension': None,
+            'media_type': None,
+            'files_added': 0,
+            'bytes_written': 0,
+            'current_file': None,
+            'size': None,
+            'error': None,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+        self._persist(job, force=True)
+
+        scheduler.add_job(self._run_job, args=[job_id], id=f"archive-job-{job_id}", misfire_grace_time=None,
+                          executor=ARCHIVE_JOB_EXECUTOR)
+        logger.info(f"已创建归档任务 {job_id}，查询条件: {query}, 文件夹: {folder_id}, 格式: {archive_format}")
+        return self._public(job)
+
+    def _run_job(self, job_id: str):
+        """在归档任务专用的线程池中构建归档，先写入 .part，完成后原子改名"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        self._update(job, force=True, status=JOB_RUNNING, started_at=time.time())
+        part_path = self._part_path(job)
+
+        def on_member(name: str):
+            self._update(job, files_added=job['files_added'] + 1, current_file=name)
+
+        try:
+            writer, archive = google_drive_service.open_archive(
+                job['query'], job['compression_level'], job['format'], job['folder_id'], on_member=on_member
+            )
+            self._update(job, force=True, extension=writer.extension, media_type=writer.media_type)
+            bytes_written = 0
+            with open(part_path, 'wb') as f:
+                for data in archive:
+                    f.write(data)
+                    bytes_written += len(data)
+                    job['bytes_written'] = bytes_written
+            os.replace(part_path, self._artifact_path(job))
+            self._update(job, force=True, status=JOB_COMPLETED, size=bytes_written,
+                         current_file=None, finished_at=time.time())
+            logger.info(f"归档任务 {job_id} 完成，共 {job['files_added']} 个文件，{bytes_written} 字节")
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            logger.error(f"归档任务 {job_id} 失败: {detail}")
+            self._remove_file(part_path)
+            self._update(job, force=True, status=JOB_FAILED, error=detail, finished_at=time.time())
+
+    @staticmethod
+    def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: value for key, value in job.items() if key not in ('extension', 'media_type')}
+
+    def _get(self, job_id: str) -> Dict[str, Any]:
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="归档任务不存在")
+        return job
+
+    def get_job(self, job_id: str) -> Dict[str, Any]:
+        """查询任务状态与进度"""
+        job = self._get(job_id)
+        with self._lock:
+            return self._public(job)
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        """按创建时间倒序列出所有任务"""
+        with self._lock:
+            jobs = [self._public(job) for job in self._jobs.values()]
+        return sorted(jobs, key=lambda job: job['created_at'], reverse=True)
+
+    def get_artifact_response(self, job_id: str) -> FileResponse:
+        """返回已完成任务的产物，Range / If-Range 由 FileResponse 处理，支持断点续传"""
+        job = self._get(job_id)
+        if job['status'] == JOB_EXPIRED:
+            raise HTTPException(status_code=410, detail="归档产物已过期删除")
+        if job['status'] != JOB_COMPLETED:
+            raise HTTPException(status_code=409, detail=f"归档任务尚未完成，当前状态: {job['status']}")
+        path = self._artifact_path(job)
+        if not os.path.exists(path):
+            raise HTTPException(status_code=410, detail="归档产物已过期删除")
+        return FileResponse(path, media_type=job['media_type'],
+                            filename=f"google_drive_files_{job_id}.{job['extension']}")
+
+    def _expire(self, job: Dict[str, Any], reason: str):
+        self._remove_file(self._artifact_path(job))
+        self._update(job, force=True, status=JOB_EXPIRED, error=reason)
+        logger.info(f"归档任务 {job['job_id']} 的产物已删除: {reason}")
+
+    def evict_artifacts(self):
+        """按保留时间与总大小淘汰已完成的产物，失败任务的记录超过保留时间后一并删除"""
+        now = time.time()
+        max_age = get_archive_job_max_age()
+        with self._lock:
+            jobs = sorted(self._jobs.values(), key=lambda job: job['finished_at'] or now)
+
+        completed = []
+        for job in jobs:
+            if job['status'] in (JOB_PENDING, JOB_RUNNING):
+                continue
+            expired = job['finished_at'] is not None and now - job['finished_at'] > max_age
+            if job['status'] == JOB_COMPLETED:
+                if expired:
+                    self._expire(job, '超过保留时间')
+                else:
+                    completed.append(job)
+            elif expired:
+                with self._lock:
+                    self._jobs.pop(job['job_id'], None)
+                self._last_persist.pop(job['job_id'], None)
+                self._remove_file(self._job_path(job['job_id']))
+
+        total = sum(job['size'] or 0 for job in completed)
+        max_bytes = get_archive_job_max_bytes()
+        for job in completed:
+            if total <= max_bytes:
+                break
+            total -= job['size'] or 0
+            self._expire(job, '超过产物总大小上限')
+
+
+scheduler.add_executor(ThreadPoolExecutor(get_archive_job_concurrency()), alias=ARCHIVE_JOB_EXECUTOR)
+archive_job_service = ArchiveJobService()
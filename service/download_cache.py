@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+本地下载缓存
+按 Drive 的 md5Checksum 内容寻址，相同内容无论文件ID或所属用户只存一份，
+按总字节数做 LRU 淘汰；命中时以文件响应直接发送，不读入内存
+"""
+
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Iterator, Callable
+
+from common.logger import logger
+from service.drive_transfer import get_transfer_config
+
+DEFAULT_DOWNLOAD_CACHE_DIR = 'data/download_cache'
+DEFAULT_DOWNLOAD_CACHE_MAX_BYTES = 10 * 1024 * 1024 * 1024
+
+
+def get_download_cache_enabled() -> bool:
+    """是否启用下载缓存，默认关闭"""
+    return bool(get_transfer_config().get('download_cache_enabled', False))
+
+
+def get_download_cache_dir() -> str:
+    """下载缓存目录"""
+    return get_transfer_config().get('download_cache_dir', DEFAULT_DOWNLOAD_CACHE_DIR)
+
+
+def get_download_cache_max_bytes() -> int:
+    """下载缓存总字节上限"""
+    return int(get_transfer_config().get('download_cache_max_bytes', DEFAULT_DOWNLOAD_CACHE_MAX_BYTES))
+
+
+class DownloadCache:
+    """
+    内容寻址的下载缓存
+
+    缓存文件位于 <dir>/blobs/<md5 前两位>/<md5>；未命中的下载边发送边写入临时文件，
+    完整下载且 md5 校验通过后原子改名进入缓存，中途断开或校验失败则丢弃。
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None,
+                 enabled: Optional[bool] = None):
+        self.enabled = get_download_cache_enabled() if enabled is None else enabled
+        self.cache_dir = cache_dir or get_download_cache_dir()
+        self.max_bytes = get_download_cache_max_bytes() if max_bytes is None else max_bytes
+        self._blob_dir = os.path.join(self.cache_dir, 'blobs')
+        self._tmp_dir = os.path.join(self.cache_dir, 'tmp')
+        # md5 -> 字节数，按最近使用顺序排列
+        self._entries: 'OrderedDict[str, int]' = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+        if self.enabled:
+            self._load()
+
+    def _load(self):
+        """扫描已有缓存文件，按修改时间恢复 LRU 顺序，并清理上次残留的临时文件"""
+        os.makedirs(self._blob_dir, exist_ok=True)
+        os.makedirs(self._tmp_dir, exist_ok=True)
+        for entry in os.listdir(self._tmp_dir):
+            self._remove(os.path.join(self._tmp_dir, entry))
+        blobs = []
+        for prefix in os.listdir(self._blob_dir):
+            prefix_dir = os.path.join(self._blob_dir, prefix)
+            for md5 in os.listdir(prefix_dir):
+                stat = os.stat(os.path.join(prefix_dir, md5))
+                blobs.append((stat.st_mtime, md5, stat.st_size))
+        for _, md5, size in sorted(blobs):
+            self._entries[md5] = size
+            self._total += size
+        self._evict()
+        logger.info(f"下载缓存已加载 {len(self._entries)} 个文件，共 {self._total} 字节")
+
+    def _blob_path(self, md5: str) -> str:
+        return os.path.join(self._blob_dir, md5[:2], md5)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _cache_key(file_info: Dict[str, Any]) -> Optional[str]:
+        md5 = (file_info.get('md5Checksum') or '').lower()
+        # Google 文档等原生格式没有 md5Checksum，无法缓存
+        if len(md5) != 32 or any(c not in '0123456789abcdef' for c in md5):
+            return None
+        return md5
+
+    def contains(self, file_info: Dict[str, Any]) -> bool:
+        """内容是否已缓存，不改变 LRU 顺序"""
+        md5 = self._cache_key(file_info) if self.enabled else None
+        with self._lock:
+            return md5 is not None and md5 in self._entries
+
+    def lookup(self, file_info: Dict[str, Any]) -> Optional[str]:
+        """命中时返回缓存文件路径，并将其标记为最近使用"""
+        md5 = self._cache_key(file_info) if self.enabled else None
+        if md5 is None:
+            return None
+        with self._lock:
+            if md5 not in self._entries:
+                return None
+            self._entries.move_to_end(md5)
+        path = self._blob_path(md5)
+        try:
+            # 更新修改时间，重启后仍能恢复 LRU 顺序
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._total -= self._entries.pop(md5, 0)
+            return None
+        return path
+
+    def tee(self, file_info: Dict[str, Any]) -> Optional[Callable[[Iterator[bytes]], Iterator[bytes]]]:
+        """返回把下载数据同时写入缓存的包装函数，不可缓存时返回 None"""
+        md5 = self._cache_key(file_info) if self.enabled else None
+        if md5 is None:
+            return None
+        size = int(file_info['size']) if file_info.get('size') is not None else None
+        if size is None or size > self.max_bytes:
+            return None
+        return lambda chunks: self._tee(chunks, md5, size, file_info.get('modifiedTime'))
+
+    def _tee(self, chunks: Iterator[bytes], md5: str, size: int, modified_time: Optional[str]) -> Iterator[bytes]:
+        tmp_path = os.path.join(self._tmp_dir, uuid.uuid4().hex)
+        digest = hashlib.md5()
+        written = 0
+        committed = False
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    digest.update(chunk)
+                    written += len(chunk)
+                    yield chunk
+            if written == size and digest.hexdigest() == md5:
+                self._commit(tmp_path, md5, size)
+                committed = True
+                logger.info(f"已写入下载缓存: {md5} ({size} 字节, 修改时间 {modified_time})")
+            else:
+                logger.warning(f"下载内容与 md5Checksum 不一致，未写入缓存: {md5}")
+        finally:
+            if not committed:
+                self._remove(tmp_path)
+
+    def _commit(self, tmp_path: str, md5: str, size: int):
+        path = self._blob_path(md5)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        with self._lock:
+            # 并发下载同一内容时后写入的覆盖先写入的，内容完全相同
+            self._total += size - self._entries.pop(md5, 0)
+            self._entries[md5] = size
+        self._evict()
+
+    def _evict(self):
+        """超出总字节上限时淘汰最久未使用的缓存文件"""
+        evicted = []
+        with self._lock:
+            while self._total > self.max_bytes and self._entries:
+                md5, size = self._entries.popitem(last=False)
+                self._total -= size
+                evicted.append(md5)
+        for md5 in evicted:
+            self._remove(self._blob_path(md5))
+        if evicted:
+            logger.info(f"下载缓存淘汰 {len(evicted)} 个文件，当前共 {self._total} 字节")
+
+
+download_cache = DownloadCache()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+调用方指定返回字段
+校验 fields 参数后原样传给 Drive，只请求和返回调用方需要的字段
+"""
+
+from typing import Optional, List, Dict, Any
+
+from fastapi import HTTPException
+
+# 允许调用方选择的文件字段，只接受顶层字段名，不支持嵌套选择
+FILE_FIELD_CHOICES = (
+    'id', 'name', 'mimeType', 'size', 'createdTime', 'modifiedTime', 'parents', 'md5Checksum', 'version',
+    'webViewLink', 'webContentLink', 'iconLink', 'thumbnailLink', 'fileExtension', 'originalFilename',
+    'description', 'starred', 'trashed', 'shared', 'owners'
+)
+
+# 文件信息接口的默认字段
+FILE_INFO_FIELDS = 'id,name,size,mimeType,createdTime,modifiedTime,parents,webViewLink,webContentLink,' \
+                   'md5Checksum,version'
+
+# 生成 ETag / Last-Modified 所需的字段，调用方未选择时也向 Drive 请求，返回前去掉
+VALIDATOR_FIELDS = ('id', 'version', 'modifiedTime')
+
+
+def parse_fields(fields: Optional[str], default: str) -> List[str]:
+    """
+    解析逗号分隔的字段列表，去重并保持顺序
+
+    :param fields: 调用方传入的字段，为空时使用 default
+    """
+    if fields is None:
+        return default.split(',')
+    names = []
+    for name in fields.split(','):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in FILE_FIELD_CHOICES:
+            raise HTTPException(status_code=400,
+                                detail=f"不支持的字段: {name}，可选: {', '.join(FILE_FIELD_CHOICES)}")
+        if name not in names:
+            names.append(name)
+    if not names:
+        raise HTTPException(status_code=400, detail="fields 不能为空")
+    return names
+
+
+def with_validator_fields(names: List[str]) -> str:
+    """在调用方字段之外补上生成校验头所需的字段"""
+    return ','.join(names + [name for name in VALIDATOR_FIELDS if name not in names])
+
+
+def project(file_info: Dict[str, Any], names: List[str]) -> Dict[str, Any]:
+    """只保留调用方选择的字段"""
+    return {name: file_info[name] for name in names if name in file_info}
@@ -0,0 +1,588 @@
+# -*- coding: utf-8 -*-
+"""
+Google Drive 传输引擎
+单一账户与多用户服务共用的上传、下载底层实现
+"""
+
+import hashlib
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional, Dict, Any, IO, Iterator, Callable
+from urllib.parse import quote, urlencode, urlparse, parse_qs
+
+import google_auth_httplib2
+import httplib2
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload, build_http
+
+from common.config_loader import GLOBAL_CONFIG
+from common.logger import logger
+
+# Drive 要求可续传上传的非末尾分块大小必须是 256 KiB 的整数倍
+UPLOAD_CHUNK_ALIGNMENT = 256 * 1024
+DEFAULT_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_RESUMABLE_THRESHOLD = 5 * 1024 * 1024
+DEFAULT_DOWNLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+DEFAULT_DOWNLOAD_QUEUE_SIZE = 4
+DEFAULT_PARALLEL_DOWNLOAD_THRESHOLD = 64 * 1024 * 1024
+DEFAULT_PARALLEL_DOWNLOAD_CONNECTIONS = 4
+DEFAULT_PARALLEL_DOWNLOAD_PART_SIZE = 4 * 1024 * 1024
+DEFAULT_NUM_RETRIES = 3
+DEFAULT_BATCH_UPLOAD_CONCURRENCY = 4
+DEFAULT_MIME_TYPE = 'application/octet-stream'
+# 下载文件时需要的元数据字段
+DOWNLOAD_FILE_FIELDS = 'name,mimeType,size,md5Checksum,modifiedTime,version'
+
+# 需要重试的 HTTP 状态码
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+# 可续传上传会话地址
+UPLOAD_SESSION_ENDPOINT = 'https://www.googleapis.com/upload/drive/v3/files'
+UPLOAD_FILE_FIELDS = 'id,name,size,mimeType,createdTime'
+# 列表接口默认返回的文件字段
+LIST_FILE_FIELDS = 'id,name,size,mimeType,createdTime,modifiedTime,parents'
+
+
+def get_transfer_config() -> Dict[str, Any]:
+    """读取 google_drive 下的传输相关配置"""
+    return GLOBAL_CONFIG.get('google_drive', {}) or {}
+
+
+def get_num_retries() -> int:
+    """单个 Drive 请求的重试次数"""
+    return int(get_transfer_config().get('num_retries', DEFAULT_NUM_RETRIES))
+
+
+def get_upload_chunk_size() -> int:
+    """可续传上传的分块大小，向下对齐到 256 KiB"""
+    chunk_size = int(get_transfer_config().get('upload_chunk_size', DEFAULT_UPLOAD_CHUNK_SIZE))
+    return max(UPLOAD_CHUNK_ALIGNMENT, chunk_size - chunk_size % UPLOAD_CHUNK_ALIGNMENT)
+
+
+def get_batch_upload_concurrency() -> int:
+    """批量上传时同时上传的文件数"""
+    return max(1, int(get_transfer_config().get('batch_upload_concurrency', DEFAULT_BATCH_UPLOAD_CONCURRENCY)))
+
+
+def get_resumable_threshold() -> int:
+    """超过该大小的文件使用可续传上传，否则使用简单的 multipart 上传"""
+    return int(get_transfer_config().get('resumable_threshold', DEFAULT_RESUMABLE_THRESHOLD))
+
+
+def get_download_chunk_size() -> int:
+    """下载时单次 Range 请求的字节数"""
+    return int(get_transfer_config().get('download_chunk_size', DEFAULT_DOWNLOAD_CHUNK_SIZE))
+
+
+def get_download_queue_size() -> int:
+    """下载队列中最多缓存的分块数"""
+    return int(get_transfer_config().get('download_queue_size', DEFAULT_DOWNLOAD_QUEUE_SIZE))
+
+
+def get_parallel_download_threshold() -> int:
+    """超过该大小的下载拆成多个区间并行拉取"""
+    return int(get_transfer_config().get('parallel_download_threshold', DEFAULT_PARALLEL_DOWNLOAD_THRESHOLD))
+
+
+def get_parallel_download_connections() -> int:
+    """并行下载单个文件时的连接数，1 表示不并行"""
+    return max(1, int(get_transfer_config().get('parallel_download_connections',
+                                                DEFAULT_PARALLEL_DOWNLOAD_CONNECTIONS)))
+
+
+def get_parallel_download_part_size() -> int:
+    """并行下载时每个区间的字节数"""
+    return int(get_transfer_config().get('parallel_download_part_size', DEFAULT_PARALLEL_DOWNLOAD_PART_SIZE))
+
+
+def authorized_http(credentials):
+    """为凭据创建独立的 HTTP 连接，httplib2 连接不能跨线程共享"""
+    return google_auth_httplib2.AuthorizedHttp(credentials, http=build_http())
+
+
+def content_disposition(file_name: str) -> str:
+    """构造附件下载头，非 ASCII 文件名按 RFC 5987 编码"""
+    try:
+        file_name.encode('latin-1')
+        return f'attachment; filename="{file_name}"'
+    except UnicodeEncodeError:
+        return f"attachment; filename*=UTF-8''{quote(file_name)}"
+
+
+def parse_drive_time(value: Optional[str]) -> Optional[datetime]:
+    """解析 Drive 返回的 RFC 3339 时间，例如 2025-09-16T10:30:00.000Z"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%fZ')
+    except ValueError:
+        return None
+
+
+def get_stream_size(fd: IO[bytes]) -> int:
+    """获取可 seek 流的总大小，并将读指针复位到开头"""
+    fd.seek(0, os.SEEK_END)
+    size = fd.tell()
+    fd.seek(0)
+    return size
+
+
+class HashingReader:
+    """
+    包装可 seek 的流，在上传读取数据的同时计算 MD5
+
+    重试时上传对象会回退重读，已计入摘要的字节不会重复计算。
+    """
+
+    def __init__(self, fd: IO[bytes]):
+        self._fd = fd
+        self._digest = hashlib.md5()
+        self._hashed = 0
+
+    def read(self, size: int = -1) -> bytes:
+        position = self._fd.tell()
+        data = self._fd.read(size)
+        end = position + len(data)
+        if position <= self._hashed < end:
+            self._digest.update(data[self._hashed - position:])
+            self._hashed = end
+        return data
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        return self._fd.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._fd.tell()
+
+    @property
+    def hashed_bytes(self) -> int:
+        return self._hashed
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+
+def md5_of_stream(fd: IO[bytes], chunk_size: int = DEFAULT_DOWNLOAD_CHUNK_SIZE) -> str:
+    """计算可 seek 流的 MD5，完成后将读指针复位到开头"""
+    digest = hashlib.md5()
+    fd.seek(0)
+    for chunk in iter(lambda: fd.read(chunk_size), b''):
+        digest.update(chunk)
+    fd.seek(0)
+    return digest.hexdigest()
+
+
+def create_media_upload(fd: IO[bytes], mime_type: Optional[str]) -> MediaIoBaseUpload:
+    """
+    根据文件大小创建媒体上传对象
+
+    小文件一次 multipart 请求上传；大文件按固定分块走可续传会话，
+    分块直接从 fd 读取，峰值内存约为一个分块。
+    """
+    size = get_stream_size(fd)
+    resumable = size > get_resumable_threshold()
+    return MediaIoBaseUpload(
+        fd,
+        mimetype=mime_type or DEFAULT_MIME_TYPE,
+        chunksize=get_upload_chunk_size(),
+        resumable=resumable
+    )
+
+
+def execute_upload(request, file_name: str, http=None) -> Dict[str, Any]:
+    """执行上传请求，可续传上传时逐块推进并记录进度"""
+    num_retries = get_num_retries()
+    if not request.resumable or not request.resumable.resumable():
+        return request.execute(http=http, num_retries=num_retries)
+
+    response = None
+    while response is None:
+        status, response = request.next_chunk(http=http, num_retries=num_retries)
+        if status:
+            logger.info(f"上传进度: {file_name} {int(status.progress() * 100)}%")
+    return response
+
+
+def upload_stream(service, fd: IO[bytes], file_metadata: Dict[str, Any], mime_type: Optional[str],
+                  fields: str = UPLOAD_FILE_FIELDS, http=None) -> Dict[str, Any]:
+    """将可 seek 的流上传到 Google Drive，返回 Drive 文件元数据"""
+    media = create_media_upload(fd, mime_type)
+    request = service.files().create(
+        body=file_metadata,
+        media_body=media,
+        fields=fields
+    )
+    return execute_upload(request, file_metadata.get('name'), http=http)
+
+
+def create_upload_session(http, file_metadata: Dict[str, Any], mime_type: Optional[str] = None,
+                          size: Optional[int] = None, origin: Optional[str] = None,
+                          fields: str = UPLOAD_FILE_FIELDS) -> str:
+    """
+    创建 Drive 可续传上传会话，返回会话地址
+
+    客户端之后直接向会话地址 PUT 文件内容，数据不再经过本服务。
+
+    :param http: 已授权的 HTTP 对象
+    :param size: 文件大小，已知时 Drive 会校验上传总长度
+    :param origin: 浏览器直传时的页面来源，Drive 据此在会话地址上返回 CORS 响应头
+    """
+    headers = {
+        'Content-Type': 'application/json; charset=UTF-8',
+        'X-Upload-Content-Type': mime_type or DEFAULT_MIME_TYPE
+    }
+    if size is not None:
+        headers['X-Upload-Content-Length'] = str(size)
+    if origin:
+        headers['Origin'] = origin
+    uri = f"{UPLOAD_SESSION_ENDPOINT}?{urlencode({'uploadType': 'resumable', 'fields': fields})}"
+    body = json.dumps(file_metadata)
+    num_retries = get_num_retries()
+    for attempt in range(num_retries + 1):
+        if attempt > 0:
+            time.sleep(random.random() * 2 ** attempt)
+        resp, content = http.request(uri, method='POST', body=body, headers=headers)
+        if resp.status in RETRYABLE_STATUS and attempt < num_retries:
+            logger.warning(f"创建上传会话返回 {resp.status}，准备重试 ({attempt + 1}/{num_retries})")
+            continue
+        if resp.status >= 300 or not resp.get('location'):
+            raise HttpError(resp, content, uri=uri)
+        return resp['location']
+
+
+def is_upload_session_uri(session_uri: str) -> bool:
+    """只接受 Drive 的可续传会话地址，避免向任意地址发起请求"""
+    parsed = urlparse(session_uri or '')
+    return parsed.scheme == 'https' and parsed.netloc == urlparse(UPLOAD_SESSION_ENDPOINT).netloc \
+        and parsed.path == urlparse(UPLOAD_SESSION_ENDPOINT).path and 'upload_id' in parse_qs(parsed.query)
+
+
+def query_upload_session(session_uri: str, size: Optional[int] = None, http=None) -> Dict[str, Any]:
+    """
+    查询可续传上传会话状态
+
+    会话地址本身即凭据，查询不需要授权头。返回 {'complete': True, 'file': 文件元数据}，
+    或 {'complete': False, 'committed_bytes': 已提交字节数}。
+    """
+    return put_session_chunk(http or build_http(), session_uri, b'', 0, size)
+
+
+def put_session_chunk(http, session_uri: str, data: bytes, offset: int,
+                      total: Optional[int] = None) -> Dict[str, Any]:
+    """
+    向可续传会话写入从 offset 开始的一个分块，返回值格式与 query_upload_session 相同
+
+    :param total: 文件总大小，未知时为空，最后一块必须给出
+    """
+    total_range = str(total) if total is not None else '*'
+    content_range = f"bytes {offset}-{offset + len(data) - 1}/{total_range}" if data else f"bytes */{total_range}"
+    headers = {'Content-Length': str(len(data)), 'Content-Range': content_range}
+    resp, content = http.request(session_uri, method='PUT', body=data, headers=headers)
+    if resp.status in (200, 201):
+        return {'complete': True, 'file': json.loads(content)}
+    if resp.status == 308:
+        # Range: bytes=0-N 表示已提交 N+1 个字节，没有 Range 表示尚未提交任何数据
+        committed = resp.get('range')
+        committed_bytes = int(committed.rsplit('-', 1)[1]) + 1 if committed else 0
+        return {'complete': False, 'committed_bytes': committed_bytes}
+    raise HttpError(resp, content, uri=session_uri)
+
+
+def push_upload_session(session_uri: str, fd: IO[bytes], size: int, offset: int = 0,
+                        on_progress: Optional[Callable[[int], None]] = None, http=None) -> Dict[str, Any]:
+    """
+    从 offset 起把 fd 的内容分块 PUT 到可续传会话，返回 Drive 文件元数据
+
+    每块完成后以 Drive 确认的已提交字节数回调 on_progress，中断后可用
+    query_upload_session 查询已提交字节数再从该位置继续。
+    """
+    http = http or build_http()
+    chunk_size = get_upload_chunk_size()
+    while True:
+        fd.seek(offset)
+        data = fd.read(chunk_size)
+        status = put_session_chunk(http, session_uri, data, offset, size)
+        if status['complete']:
+            return status['file']
+        if not data:
+            raise RuntimeError(f"上传会话未完成，Drive 仅确认 {status['committed_bytes']}/{size} 字节")
+        offset = status['committed_bytes']
+        if on_progress:
+            on_progress(offset)
+
+
+def _request_with_retry(http, uri: str, headers: Dict[str, str], num_retries: int):
+    """发送 GET 请求，对网络错误和可重试状态码做指数退避重试"""
+    for attempt in range(num_retries + 1):
+        if attempt > 0:
+            time.sleep(random.random() * 2 ** attempt)
+        try:
+            resp, content = http.request(uri, method='GET', headers=headers)
+        except (OSError, httplib2.HttpLib2Error) as e:
+            if attempt == num_retries:
+                raise
+            logger.warning(f"请求 Drive 失败，准备重试 ({attempt + 1}/{num_retries}): {e}")
+            continue
+        if resp.status in RETRYABLE_STATUS and attempt < num_retries:
+            logger.warning(f"Drive 返回 {resp.status}，准备重试 ({attempt + 1}/{num_retries})")
+            continue
+        if resp.status >= 300:
+            raise HttpError(resp, content, uri=uri)
+        return resp, content
+
+
+def iter_media_chunks(http, uri: str, chunk_size: Optional[int] = None,
+                      start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+    """
+    按 Range 分块拉取 Drive 媒体内容
+
+    :param http: 已授权的 HTTP 对象
+    :param uri: get_media 请求的 URI
+    :param chunk_size: 单次请求的字节数
+    :param start: 起始字节位置
+    :param end: 结束字节位置（含），为空时读到文件末尾
+    """
+    chunk_size = chunk_size or get_download_chunk_size()
+    num_retries = get_num_retries()
+    position = start
+    total_size = None
+    while (total_size is None or position < total_size) and (end is None or position <= end):
+        last = position + chunk_size - 1 if end is None else min(position + chunk_size - 1, end)
+        headers = {'range': f'bytes={position}-{last}'}
+        try:
+            resp, content = _request_with_retry(http, uri, headers, num_retries)
+        except HttpError as e:
+            # 空文件对任何 Range 都返回 416
+            if e.resp.status == 416 and position == 0:
+                return
+            raise
+        if resp.status == 200:
+            # 服务端忽略了 Range，直接返回了完整内容
+            yield content[position:] if end is None else content[position:end + 1]
+            return
+        content_range = resp.get('content-range', '')
+        total_size = int(content_range.rsplit('/', 1)[1]) if '/' in content_range else position + len(content)
+        if not content:
+            return
+        position += len(content)
+        yield content
+
+
+class BackgroundChunkStream:
+    """
+    在后台线程中拉取数据块，通过有界队列交给响应流
+
+    网络拉取与向客户端发送并行进行，队列满时生产者阻塞，
+    内存占用不超过 queue_size 个分块。
+    """
+
+    _EOF = object()
+
+    def __init__(self, chunks: Iterator[bytes], queue_size: Optional[int] = None, name: str = 'drive-download'):
+        self._queue = queue.Queue(maxsize=queue_size or get_download_queue_size())
+        self._stop = threading.Event()
+        self._pending = []
+        self._thread = threading.Thread(target=self._produce, args=(chunks,), name=name, daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self, chunks: Iterator[bytes]):
+        try:
+            for chunk in chunks:
+                if not self._put(chunk):
+                    return
+            self._put(self._EOF)
+        except Exception as e:
+            self._put(e)
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close:
+                close()
+
+    def _get(self):
+        item = self._queue.get()
+        if isinstance(item, Exception):
+            self._stop.set()
+            raise item
+        return item
+
+    def prime(self) -> 'BackgroundChunkStream':
+        """等待第一个分块到达，让打开阶段的错误在返回响应前抛出"""
+        self._pending.append(self._get())
+        return self
+
+    def close(self):
+        self._stop.set()
+
+    def __iter__(self) -> Iterator[bytes]:
+        try:
+            while True:
+                item = self._pending.pop(0) if self._pending else self._get()
+                if item is self._EOF:
+                    return
+                yield item
+        finally:
+            self.close()
+
+
+def iter_file_pages(service, http, query: Optional[str] = None, page_size: int = 1000,
+                    fields: str = LIST_FILE_FIELDS, page_token: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """从 page_token 开始按 nextPageToken 依次请求每一页"""
+    while True:
+        results = service.files().list(
+            q=query if query else "",
+            pageSize=page_size,
+            pageToken=page_token,
+            fields=f"nextPageToken, files({fields})"
+        ).execute(http=http, num_retries=get_num_retries())
+        yield results
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return
+
+
+def get_start_page_token(service, http) -> str:
+    """当前的变更起点，之后的文件变更可通过 iter_change_pages 获取"""
+    return service.changes().getStartPageToken().execute(http=http, num_retries=get_num_retries())['startPageToken']
+
+
+def get_root_folder_id(service, http) -> str:
+    """“我的云端硬盘”根目录的真实 ID，文件的 parents 中保存的是该 ID 而不是别名 root"""
+    return service.files().get(fileId='root', fields='id').execute(http=http, num_retries=get_num_retries())['id']
+
+
+def iter_change_pages(service, http, page_token: str, page_size: int = 1000,
+                      fields: str = LIST_FILE_FIELDS) -> Iterator[Dict[str, Any]]:
+    """
+    从 page_token 开始依次请求 changes.list 的每一页
+
+    中间页带 nextPageToken，最后一页带 newStartPageToken，作为下次同步的起点
+    """
+    while page_token:
+        results = service.changes().list(
+            pageToken=page_token,
+            pageSize=page_size,
+            includeRemoved=True,
+            spaces='drive',
+            fields=f'nextPageToken,newStartPageToken,changes(changeType,fileId,removed,file({fields}))'
+        ).execute(http=http, num_retries=get_num_retries())
+        yield results
+        page_token = results.get('nextPageToken')
+
+
+def iter_file_listing(service, http, query: Optional[str] = None, page_size: int = 1000,
+                      fields: str = LIST_FILE_FIELDS, page_token: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    遍历全部分页，逐个产出文件，最后产出 {'done': True, 'count': 文件数}
+
+    后台线程在输出当前页时预取下一页，内存中最多保留约三页。第一页在返回前取回，
+    查询条件错误等问题直接抛出；中途失败时产出 {'error': 原因, 'page_token': 失败页的令牌}，
+    客户端可带该令牌从失败处继续。
+    """
+    pages = BackgroundChunkStream(iter_file_pages(service, http, query, page_size, fields, page_token),
+                                  queue_size=1, name='drive-list').prime()
+
+    def listing() -> Iterator[Dict[str, Any]]:
+        current_token = page_token
+        count = 0
+        try:
+            for page in pages:
+                for file_info in page.get('files', []):
+                    count += 1
+                    yield file_info
+                current_token = page.get('nextPageToken')
+        except Exception as e:
+            logger.error(f"遍历文件列表失败，已输出 {count} 个文件: {e}")
+            yield {'error': str(e), 'page_token': current_token, 'count': count}
+            return
+        finally:
+            pages.close()
+        logger.info(f"文件列表遍历完成，共 {count} 个文件")
+        yield {'done': True, 'count': count}
+
+    return listing()
+
+
+def iter_media_parallel(credentials, uri: str, start: int, end: int, connections: Optional[int] = None,
+                        part_size: Optional[int] = None) -> Iterator[bytes]:
+    """
+    将 [start, end] 拆成固定大小的区间，多个连接并行拉取后按顺序产出
+
+    正在拉取和已拉取未产出的区间合计最多 connections 个，加上已产出、仍被调用方持有的区间，
+    本函数的峰值内存约为 (connections + 1) * part_size。
+    """
+    connections = connections or get_parallel_download_connections()
+    part_size = part_size or get_parallel_download_part_size()
+    local = threading.local()
+
+    def fetch(part_start: int, part_end: int) -> bytes:
+        http = getattr(local, 'http', None)
+        if http is None:
+            http = local.http = authorized_http(credentials)
+        return b''.join(iter_media_chunks(http, uri, start=part_start, end=part_end))
+
+    executor = ThreadPoolExecutor(max_workers=connections, thread_name_prefix='drive-range')
+    window = connections
+    parts = iter(range(start, end + 1, part_size))
+    pending = deque()
+    try:
+        while True:
+            while len(pending) < window:
+                part_start = next(parts, None)
+                if part_start is None:
+                    break
+                pending.append(executor.submit(fetch, part_start, min(part_start + part_size - 1, end)))
+            if not pending:
+                return
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def use_parallel_download(start: int, end: Optional[int]) -> bool:
+    """区间长度已知且超过并行下载阈值时使用多连接并行拉取"""
+    return end is not None and get_parallel_download_connections() > 1 \
+        and end - start + 1 > get_parallel_download_threshold()
+
+
+def stream_media(service, credentials, file_id: str, start: int = 0, end: Optional[int] = None,
+                 tee: Optional[Callable[[Iterator[bytes]], Iterator[bytes]]] = None) -> BackgroundChunkStream:
+    """
+    打开一个文件内容的后台下载流，首个分块到达后返回
+
+    区间长度超过并行下载阈值时多连接并行拉取，否则单连接按 Range 分块拉取。
+    并行拉取时队列中的每一项是一个完整区间，队列只保留一项，
+    单个下载的峰值内存约为 (connections + 2) * part_size，默认 4 个连接、4 MiB 区间时约 24 MiB。
+
+    :param start: 起始字节位置
+    :param end: 结束字节位置（含），为空时读到文件末尾且不并行
+    :param tee: 可选的数据包装函数，在后台线程中处理拉取到的分块，例如写入下载缓存
+    """
+    uri = service.files().get_media(fileId=file_id).uri
+    if use_parallel_download(start, end):
+        logger.info(f"并行下载文件 {file_id}: bytes {start}-{end}")
+        chunks = iter_media_parallel(credentials, uri, start, end)
+        queue_size = 1
+    else:
+        chunks = iter_media_chunks(authorized_http(credentials), uri, start=start, end=end)
+        queue_size = None
+    if tee is not None:
+        chunks = tee(chunks)
+    return BackgroundChunkStream(chunks, queue_size=queue_size).prime()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+文件夹树并行遍历
+按广度优先并发列出子文件夹，遍历过程中即可产出文件
+"""
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Iterator
+
+from common.logger import logger
+from service.drive_transfer import get_transfer_config, get_num_retries, authorized_http
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+DEFAULT_FOLDER_WALK_CONCURRENCY = 8
+# 遍历结果队列长度，消费端跟不上时列目录线程阻塞
+_RESULT_QUEUE_SIZE = 1000
+_WALK_FILE_FIELDS = 'id,name,size,mimeType,modifiedTime'
+
+_DONE = object()
+
+
+def get_folder_walk_concurrency() -> int:
+    """同时列出的文件夹数"""
+    return max(1, int(get_transfer_config().get('folder_walk_concurrency', DEFAULT_FOLDER_WALK_CONCURRENCY)))
+
+
+def sanitize_path_component(name: str) -> str:
+    """归档路径中的单级名称不能包含路径分隔符，也不能是 . 或 .."""
+    name = (name or '').replace('/', '_').replace('\\', '_').strip()
+    if name in ('', '.', '..'):
+        return '_'
+    return name
+
+
+class ArchiveNameAllocator:
+    """为归档成员分配唯一路径，重名时追加序号，例如 report (1).pdf"""
+
+    def __init__(self):
+        self._used = set()
+
+    def allocate(self, path: str) -> str:
+        if path not in self._used:
+            self._used.add(path)
+            return path
+        directory, _, name = path.rpartition('/')
+        stem, dot, extension = name.rpartition('.')
+        if not stem:
+            stem, dot, extension = name, '', ''
+        counter = 1
+        while True:
+            candidate_name = f"{stem} ({counter}){dot}{extension}"
+            candidate = f"{directory}/{candidate_name}" if directory else candidate_name
+            if candidate not in self._used:
+                self._used.add(candidate)
+                return candidate
+            counter += 1
+
+
+class FolderTreeWalker:
+    """
+    文件夹树并行遍历器
+
+    每个文件夹由线程池中的一个任务完整列出（含分页），发现的子文件夹立即提交新任务，
+    文件带上相对路径 path 放入有界队列，调用方边遍历边消费。
+    """
+
+    def __init__(self, service, credentials, concurrency: Optional[int] = None):
+        self.service = service
+        self.credentials = credentials
+        self.concurrency = concurrency or get_folder_walk_concurrency()
+        self._local = threading.local()
+
+    def _http(self):
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = self._local.http = authorized_http(self.credentials)
+        return http
+
+    def _iter_children(self, folder_id: str) -> Iterator[Dict[str, Any]]:
+        page_token = None
+        while True:
+            results = self.service.files().list(
+                q=f"'{folder_id}' in parents and trashed = false",
+                pageSize=1000,
+                pageToken=page_token,
+                fields=f"nextPageToken, files({_WALK_FILE_FIELDS})"
+            ).execute(http=self._http(), num_retries=get_num_retries())
+            yield from results.get('files', [])
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return
+
+    def walk(self, root_folder_id: str) -> Iterator[Dict[str, Any]]:
+        """
+        遍历 root_folder_id 下的全部文件，产出的文件字典带有相对路径 path
+
+        任一文件夹列出失败时停止遍历并抛出该异常，不会返回缺少子树的结果
+        """
+        results = queue.Queue(maxsize=_RESULT_QUEUE_SIZE)
+        # stop: 遍历出错或调用方不再消费时停止列出；closed: 调用方不再消费
+        stop = threading.Event()
+        closed = threading.Event()
+        lock = threading.Lock()
+        visited = {root_folder_id}
+        outstanding = [0]
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='folder-walk')
+
+        def put(item, until: threading.Event = stop) -> bool:
+            while not until.is_set():
+                try:
+                    results.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def submit(folder_id: str, prefix: str):
+            with lock:
+                outstanding[0] += 1
+            executor.submit(list_folder, folder_id, prefix)
+
+        def list_folder(folder_id: str, prefix: str):
+            try:
+                if stop.is_set():
+                    return
+                for item in self._iter_children(folder_id):
+                    if stop.is_set():
+                        return
+                    name = sanitize_path_component(item.get('name'))
+                    if item.get('mimeType') == FOLDER_MIME_TYPE:
+                        # 同一文件夹可能挂在多个父文件夹下，避免重复遍历
+                        with lock:
+                            if item['id'] in visited:
+                                continue
+                            visited.add(item['id'])
+                        submit(item['id'], f"{prefix}{name}/")
+                    elif not put(dict(item, path=f"{prefix}{name}")):
+                        return
+            except Exception as e:
+                # 不跳过失败的子树，否则归档会悄悄缺少整个目录；交给调用方在 walk 中抛出
+                logger.error(f"列出文件夹 {folder_id} 失败: {e}")
+                stop.set()
+                put(e, until=closed)
+            finally:
+                with lock:
+                    outstanding[0] -= 1
+                    finished = outstanding[0] == 0
+                if finished:
+                    put(_DONE)
+
+        submit(root_folder_id, '')
+        try:
+            while True:
+                item = results.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            closed.set()
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            logger.info(f"文件夹遍历结束，共访问 {len(visited)} 个文件夹")
@@ -1,27 +1,51 @@
 # -*- coding: utf-8 -*-
+import itertools
 import os
-import io
+import threading
 import zipfile
-from typing import Optional, List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, List, Dict, Any, Iterator, Iterable, Callable
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google.oauth2.service_account import Credentials as ServiceAccountCredentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from fastapi import HTTPException, UploadFile
-from starlette.responses import StreamingResponse
+from starlette.responses import StreamingResponse, Response
 
+from common.archive_stream import create_archive_writer, is_compressed_mime_type, get_process_pool
 from common.config_loader import GLOBAL_CONFIG
 from common.logger import logger
+from service.archive_fetcher import ArchiveMemberFetcher, get_archive_compression_workers
+from service.folder_walker import FolderTreeWalker, ArchiveNameAllocator, sanitize_path_component
+from service.drive_transfer import upload_stream, authorized_http, parse_drive_time, \
+    BackgroundChunkStream, create_upload_session, get_batch_upload_concurrency, get_stream_size, HashingReader, \
+    UPLOAD_FILE_FIELDS, LIST_FILE_FIELDS, iter_file_pages, iter_file_listing
+from service.drive_fields import parse_fields, FILE_INFO_FIELDS
+from service.media_download import download_file_response
+from service.list_cache import list_cache
+from service.metadata_cache import DEFAULT_ACCOUNT
+from service.metadata_mirror import metadata_mirror
+from service.search_index import search_index, get_search_index_enabled
+from service.upload_dedup import folder_checksum_index
+from service.upload_session import confirm_upload_session
+from service.url_upload import upload_from_url
 
 
 class GoogleDriveService:
     def __init__(self):
         self.service = None
         self.credentials = None
+        self._local = threading.local()
         self._initialize_service()
 
+    def _thread_http(self):
+        """当前线程专用的 HTTP 连接，列表请求在线程池中并发执行"""
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = self._local.http = authorized_http(self.credentials)
+        return http
+
     def _initialize_service(self):
         """初始化 Google Drive API 服务"""
         try:
@@ -100,195 +124,386 @@ class GoogleDriveService:
         logger.info("OAuth 2.0 认证初始化成功")
         return creds
 
-    def upload_file(self, file: UploadFile, parent_folder_id: Optional[str] = None) -> Dict[str, Any]:
-        """上传文件到 Google Drive"""
+    def _build_file_metadata(self, file_name: str, parent_folder_id: Optional[str] = None) -> Dict[str, Any]:
+        """构造上传文件的元数据，未指定父文件夹时使用默认文件夹"""
+        # 准备文件元数据
+        file_metadata = {
+            'name': file_name,
+        }
+        
+        # 如果指定了父文件夹，添加到元数据中
+        if parent_folder_id:
+            file_metadata['parents'] = [parent_folder_id]
+        else:
+            # 检查是否有默认文件夹配置（解决服务账号存储配额问题）
+            config = GLOBAL_CONFIG.get('google_drive', {})
+            default_folder_id = config.get('default_folder_id')
+            if default_folder_id:
+                file_metadata['parents'] = [default_folder_id]
+                logger.info(f"使用默认文件夹: {default_folder_id}")
+            elif config.get('auth_method') == 'service_account':
+                # 服务账号认证时，如果没有指定文件夹，给出友好提示
+                logger.warning("服务账号认证需要指定父文件夹 ID，建议配置 default_folder_id 或在请求中指定 parent_folder_id")
+                raise HTTPException(
+                    status_code=400,
+                    detail="服务账号没有存储配额，请指定 parent_folder_id 参数上传到共享文件夹，或在配置文件中设置 default_folder_id"
+                )
+        return file_metadata
+
+    def upload_file(self, file: UploadFile, parent_folder_id: Optional[str] = None,
+                    dedup: bool = False) -> Dict[str, Any]:
+        """
+        上传文件到 Google Drive
+
+        :param dedup: 为 True 时目标文件夹中已有相同内容的文件则直接返回该文件，不再上传
+        """
         try:
-            # 创建临时文件
-            temp_file_path = f"/tmp/{file.filename}"
-            with open(temp_file_path, "wb") as temp_file:
-                content = file.file.read()
-                temp_file.write(content)
-            
-            # 准备文件元数据
-            file_metadata = {
-                'name': file.filename,
-            }
-            
-            # 如果指定了父文件夹，添加到元数据中
-            if parent_folder_id:
-                file_metadata['parents'] = [parent_folder_id]
-            else:
-                # 检查是否有默认文件夹配置（解决服务账号存储配额问题）
-                config = GLOBAL_CONFIG.get('google_drive', {})
-                default_folder_id = config.get('default_folder_id')
-                if default_folder_id:
-                    file_metadata['parents'] = [default_folder_id]
-                    logger.info(f"使用默认文件夹: {default_folder_id}")
-                elif config.get('auth_method') == 'service_account':
-                    # 服务账号认证时，如果没有指定文件夹，给出友好提示
-                    logger.warning("服务账号认证需要指定父文件夹 ID，建议配置 default_folder_id 或在请求中指定 parent_folder_id")
-                    raise HTTPException(
-                        status_code=400,
-                        detail="服务账号没有存储配额，请指定 parent_folder_id 参数上传到共享文件夹，或在配置文件中设置 default_folder_id"
-                    )
+            file_metadata = self._build_file_metadata(file.filename, parent_folder_id)
+            result = self._upload_one(file, file_metadata, dedup)
+            list_cache.invalidate_parent(DEFAULT_ACCOUNT, file_metadata.get('parents', [None])[0])
+            return result
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"上传文件失败: {e}")
+            raise HTTPException(status_code=500, detail=f"上传文件失败: {str(e)}")
+
+    def _upload_one(self, file: UploadFile, file_metadata: Dict[str, Any], dedup: bool) -> Dict[str, Any]:
+        if not dedup:
+            # 直接从上传的临时文件分块推送到 Drive，不再整体读入内存
+            uploaded_file = upload_stream(self.service, file.file, file_metadata, file.content_type)
+            logger.info(f"文件上传成功: {uploaded_file.get('name')} (ID: {uploaded_file.get('id')})")
+            return self._upload_result(uploaded_file)
+
+        folder_id = file_metadata.get('parents', ['root'])[0]
+        # 文件夹中没有同样大小的文件时不会预先读取内容，MD5 在上传过程中顺带计算
+        existing, md5 = folder_checksum_index.find_duplicate(self.service, folder_id, file.file,
+                                                             get_stream_size(file.file))
+        if existing:
+            logger.info(f"文件夹中已有相同内容的文件，跳过上传: {file.filename} -> {existing.get('id')}")
+            return dict(self._upload_result(existing), deduplicated=True, message='已存在相同内容的文件，未重复上传')
+
+        # 比对时已经算过 MD5 的直接复用，避免再读一遍
+        reader = None if md5 else HashingReader(file.file)
+        uploaded_file = upload_stream(self.service, reader or file.file, file_metadata, file.content_type,
+                                      fields=f'{UPLOAD_FILE_FIELDS},md5Checksum')
+        md5 = md5 or reader.hexdigest()
+        if uploaded_file.get('md5Checksum') and uploaded_file['md5Checksum'] != md5:
+            logger.warning(f"上传内容 MD5 与 Drive 返回的 md5Checksum 不一致: {uploaded_file.get('id')}")
+        else:
+            uploaded_file.setdefault('md5Checksum', md5)
+            folder_checksum_index.add(folder_id, uploaded_file)
+        logger.info(f"文件上传成功: {uploaded_file.get('name')} (ID: {uploaded_file.get('id')})")
+        return dict(self._upload_result(uploaded_file), deduplicated=False)
+
+    async def upload_from_url(self, url: str, file_name: Optional[str] = None,
+                              parent_folder_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        从 URL 拉取文件并流式上传到 Google Drive，内存占用与文件大小无关
+
+        :param file_name: 保存的文件名，为空时按响应头或 URL 推断，并根据 Content-Type 补全后缀
+        """
+        try:
+            file_metadata = self._build_file_metadata(file_name, parent_folder_id)
+            uploaded_file, content_type = await upload_from_url(self.credentials, url, file_metadata)
+            list_cache.invalidate_parent(DEFAULT_ACCOUNT, file_metadata.get('parents', [None])[0])
             
-            # 创建媒体上传对象
-            media = MediaFileUpload(temp_file_path, mimetype=file.content_type)
+            return dict(self._upload_result(uploaded_file), source_url=url, source_content_type=content_type)
             
-            # 上传文件
-            uploaded_file = self.service.files().create(
-                body=file_metadata,
-                media_body=media,
-                fields='id,name,size,mimeType,createdTime'
-            ).execute()
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"从 URL 上传文件失败: {e}")
+            raise HTTPException(status_code=500, detail=f"从 URL 上传文件失败: {str(e)}")
+
+    @staticmethod
+    def _upload_result(uploaded_file: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'file_id': uploaded_file.get('id'),
+            'name': uploaded_file.get('name'),
+            'size': uploaded_file.get('size'),
+            'mime_type': uploaded_file.get('mimeType'),
+            'created_time': uploaded_file.get('createdTime'),
+            'message': '文件上传成功'
+        }
+
+    def upload_files(self, files: List[UploadFile], parent_folder_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        并发上传多个文件，按完成顺序逐个产出结果
+
+        每个文件的内容已由表单解析器落到临时文件，这里直接从临时文件分块上传，
+        同时上传的文件数由 batch_upload_concurrency 控制。单个文件失败不影响其他文件。
+        """
+        # 父文件夹校验在开始输出结果前完成，服务账号未配置文件夹时直接返回 400
+        file_metadata = self._build_file_metadata('', parent_folder_id)
+        return self._iter_batch_upload(files, file_metadata)
+
+    def _iter_batch_upload(self, files: List[UploadFile], file_metadata: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        local = threading.local()
+
+        def upload(file: UploadFile) -> Dict[str, Any]:
+            http = getattr(local, 'http', None)
+            if http is None:
+                http = local.http = authorized_http(self.credentials)
+            uploaded_file = upload_stream(self.service, file.file, dict(file_metadata, name=file.filename),
+                                          file.content_type, http=http)
+            list_cache.invalidate_parent(DEFAULT_ACCOUNT, file_metadata.get('parents', [None])[0])
+            logger.info(f"批量上传文件成功: {uploaded_file.get('name')} (ID: {uploaded_file.get('id')})")
+            return self._upload_result(uploaded_file)
+
+        executor = ThreadPoolExecutor(max_workers=get_batch_upload_concurrency(), thread_name_prefix='batch-upload')
+        futures = {executor.submit(upload, file): (index, file.filename) for index, file in enumerate(files)}
+        succeeded = 0
+        try:
+            for future in as_completed(futures):
+                index, file_name = futures[future]
+                try:
+                    result = {'index': index, 'name': file_name, 'success': True, 'data': future.result()}
+                    succeeded += 1
+                except Exception as e:
+                    logger.error(f"批量上传文件失败: {file_name}: {e}")
+                    result = {'index': index, 'name': file_name, 'success': False, 'error': str(e)}
+                yield result
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        logger.info(f"批量上传完成，成功 {succeeded}/{len(files)} 个文件")
+
+    def create_upload_session(self, file_name: str, size: Optional[int] = None, mime_type: Optional[str] = None,
+                              parent_folder_id: Optional[str] = None, origin: Optional[str] = None) -> Dict[str, Any]:
+        """创建可续传上传会话，客户端拿到会话地址后直接上传到 Drive"""
+        try:
+            file_metadata = self._build_file_metadata(file_name, parent_folder_id)
             
-            # 清理临时文件
-            os.remove(temp_file_path)
+            session_uri = create_upload_session(authorized_http(self.credentials), file_metadata, mime_type,
+                                                size, origin)
             
-            logger.info(f"文件上传成功: {uploaded_file.get('name')} (ID: {uploaded_file.get('id')})")
+            logger.info(f"已创建上传会话: {file_name}")
             
             return {
-                'file_id': uploaded_file.get('id'),
-                'name': uploaded_file.get('name'),
-                'size': uploaded_file.get('size'),
-                'mime_type': uploaded_file.get('mimeType'),
-                'created_time': uploaded_file.get('createdTime'),
-                'message': '文件上传成功'
+                'session_uri': session_uri,
+                'name': file_name,
+                'parents': file_metadata.get('parents'),
+                'message': '上传会话创建成功，请直接向 session_uri 上传文件内容'
             }
             
+        except HTTPException:
+            raise
         except Exception as e:
-            logger.error(f"上传文件失败: {e}")
-            # 清理可能存在的临时文件
-            if os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
-            raise HTTPException(status_code=500, detail=f"上传文件失败: {str(e)}")
+            logger.error(f"创建上传会话失败: {e}")
+            raise HTTPException(status_code=500, detail=f"创建上传会话失败: {str(e)}")
 
-    def download_file(self, file_id: str) -> StreamingResponse:
-        """从 Google Drive 下载文件"""
+    def complete_upload_session(self, session_uri: str, size: Optional[int] = None) -> Dict[str, Any]:
+        """客户端直传完成后确认上传结果"""
+        result = confirm_upload_session(session_uri, size)
+        if result['status'] == 'complete':
+            # 会话地址中不含目标文件夹，清除该账户的全部列表缓存
+            list_cache.invalidate_parent(DEFAULT_ACCOUNT)
+        return result
+
+    def download_file(self, file_id: str, range_header: Optional[str] = None,
+                      if_range: Optional[str] = None, if_none_match: Optional[str] = None,
+                      if_modified_since: Optional[str] = None) -> Response:
+        """从 Google Drive 下载文件，支持 Range 区间请求与条件请求"""
         try:
-            # 获取文件信息
-            file_info = self.service.files().get(fileId=file_id, fields='name,mimeType,size').execute()
-            file_name = file_info.get('name')
-            mime_type = file_info.get('mimeType')
-            
-            # 下载文件内容
-            request = self.service.files().get_media(fileId=file_id)
-            file_io = io.BytesIO()
-            downloader = MediaIoBaseDownload(file_io, request)
-            
-            done = False
-            while done is False:
-                status, done = downloader.next_chunk()
-                logger.info(f"下载进度: {int(status.progress() * 100)}%")
-            
-            # 重置文件指针到开始
-            file_io.seek(0)
-            
-            logger.info(f"文件下载成功: {file_name} (ID: {file_id})")
-            
-            # 返回流式响应
-            return StreamingResponse(
-                io.BytesIO(file_io.read()),
-                media_type=mime_type or 'application/octet-stream',
-                headers={
-                    "Content-Disposition": f"attachment; filename={file_name}",
-                    "Content-Length": str(len(file_io.getvalue()))
-                }
-            )
+            return download_file_response(self.service, self.credentials, file_id, DEFAULT_ACCOUNT,
+                                          range_header, if_range, if_none_match, if_modified_since)
             
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"下载文件失败: {e}")
             raise HTTPException(status_code=500, detail=f"下载文件失败: {str(e)}")
 
-    def list_files(self, query: Optional[str] = None, page_size: int = 100) -> Dict[str, Any]:
-        """列出 Google Drive 中的文件"""
+    def list_files(self, query: Optional[str] = None, page_size: int = 100,
+                   page_token: Optional[str] = None, fields: Optional[str] = None,
+                   max_staleness: Optional[float] = None, use_cache: bool = True) -> Dict[str, Any]:
+        """
+        列出 Google Drive 中的文件
+
+        :param fields: 逗号分隔的文件字段，为空时返回默认字段
+        :param max_staleness: 允许的镜像最大延迟（秒），镜像足够新时直接读本地镜像
+        :param use_cache: 为 False 时跳过本地镜像和列表缓存，直接访问 Drive
+        """
+        names = parse_fields(fields, LIST_FILE_FIELDS)
+        list_fields = ','.join(names)
         try:
-            # 构建查询参数
-            search_query = query if query else ""
-            
-            # 执行文件列表请求
-            results = self.service.files().list(
-                q=search_query,
-                pageSize=page_size,
-                fields="nextPageToken, files(id,name,size,mimeType,createdTime,modifiedTime,parents)"
-            ).execute()
-            
-            files = results.get('files', [])
-            
-            logger.info(f"找到 {len(files)} 个文件")
+            if use_cache:
+                mirrored = metadata_mirror.list_files(query, page_size, page_token, names, max_staleness)
+                if mirrored is not None:
+                    return mirrored
+
+            def load() -> Dict[str, Any]:
+                # 构建查询参数
+                search_query = query if query else ""
+                
+                # 执行文件列表请求
+                results = self.service.files().list(
+                    q=search_query,
+                    pageSize=page_size,
+                    pageToken=page_token,
+                    fields=f"nextPageToken, files({list_fields})"
+                ).execute(http=self._thread_http())
+                
+                files = results.get('files', [])
+                
+                logger.info(f"找到 {len(files)} 个文件")
+                
+                return {
+                    'files': files,
+                    'count': len(files),
+                    'next_page_token': results.get('nextPageToken'),
+                    'message': f'成功获取 {len(files)} 个文件'
+                }
             
-            return {
-                'files': files,
-                'count': len(files),
-                'next_page_token': results.get('nextPageToken'),
-                'message': f'成功获取 {len(files)} 个文件'
-            }
+            if not use_cache:
+                return load()
+            return list_cache.get_or_load(DEFAULT_ACCOUNT, query, page_size, page_token, list_fields, load)
             
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"列出文件失败: {e}")
             raise HTTPException(status_code=500, detail=f"列出文件失败: {str(e)}")
 
-    def download_all_files(self, query: Optional[str] = None) -> StreamingResponse:
-        """下载所有文件为 ZIP 压缩包"""
+    def stream_files(self, query: Optional[str] = None, page_size: int = 1000,
+                     page_token: Optional[str] = None, fields: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """在服务端翻完全部分页，逐个产出文件，格式见 iter_file_listing"""
+        list_fields = ','.join(parse_fields(fields, LIST_FILE_FIELDS))
         try:
-            # 获取文件列表
-            files_result = self.list_files(query=query)
-            files = files_result['files']
-            
-            if not files:
-                raise HTTPException(status_code=404, detail="没有找到任何文件")
-            
-            # 创建内存中的 ZIP 文件
-            zip_buffer = io.BytesIO()
-            
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                for file_info in files:
-                    file_id = file_info['id']
-                    file_name = file_info['name']
-                    
-                    try:
-                        # 下载单个文件
-                        request = self.service.files().get_media(fileId=file_id)
-                        file_io = io.BytesIO()
-                        downloader = MediaIoBaseDownload(file_io, request)
-                        
-                        done = False
-                        while done is False:
-                            status, done = downloader.next_chunk()
-                        
-                        # 将文件添加到 ZIP
-                        file_io.seek(0)
-                        zip_file.writestr(file_name, file_io.read())
-                        logger.info(f"已添加到 ZIP: {file_name}")
-                        
-                    except Exception as e:
-                        logger.warning(f"跳过文件 {file_name}: {e}")
-                        continue
-            
-            # 重置缓冲区指针
-            zip_buffer.seek(0)
-            
-            logger.info(f"成功创建包含 {len(files)} 个文件的 ZIP 压缩包")
+            return iter_file_listing(self.service, authorized_http(self.credentials), query, page_size,
+                                     list_fields, page_token)
+        except Exception as e:
+            logger.error(f"列出文件失败: {e}")
+            raise HTTPException(status_code=500, detail=f"列出文件失败: {str(e)}")
+
+    def iter_files(self, query: Optional[str] = None, page_size: int = 1000,
+                   fields: str = LIST_FILE_FIELDS) -> Iterator[Dict[str, Any]]:
+        """逐页遍历匹配的全部文件，处理当前页时后台预取下一页"""
+        pages = BackgroundChunkStream(iter_file_pages(self.service, authorized_http(self.credentials), query,
+                                                      page_size, fields), queue_size=1, name='drive-list')
+        for page in pages:
+            yield from page.get('files', [])
+
+    def open_archive(self, query: Optional[str] = None, compression_level: Optional[int] = None,
+                     archive_format: str = 'zip', folder_id: Optional[str] = None,
+                     on_member: Optional[Callable[[str], None]] = None):
+        """
+        校验参数并打开流式归档，返回 (写入器, 归档字节迭代器)
+
+        :param on_member: 每写完一个成员时回调，参数为成员在归档中的路径
+        """
+        if query and folder_id:
+            raise HTTPException(status_code=400, detail="query 与 folder_id 不能同时指定")
+
+        workers = get_archive_compression_workers()
+        try:
+            writer = create_archive_writer(
+                archive_format,
+                compresslevel=compression_level,
+                executor=get_process_pool(workers) if workers > 0 else None,
+                max_pending=max(workers, 1) * 2
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        # 惰性遍历全部匹配文件（分页或目录树），先取第一个文件确认结果非空
+        if folder_id:
+            files = FolderTreeWalker(self.service, self.credentials).walk(folder_id)
+        else:
+            files = self.iter_files(query=query)
+        first_file = next(files, None)
+
+        if first_file is None:
+            raise HTTPException(status_code=404, detail="没有找到任何文件")
+
+        logger.info(f"开始流式打包文件，查询条件: {query}, 文件夹: {folder_id}, 格式: {archive_format}")
+        return writer, self._iter_archive(writer, itertools.chain([first_file], files), on_member)
+
+    def download_all_files(self, query: Optional[str] = None, compression_level: Optional[int] = None,
+                           archive_format: str = 'zip', folder_id: Optional[str] = None) -> StreamingResponse:
+        """
+        下载所有文件为压缩包
+
+        :param query: 搜索查询条件
+        :param compression_level: 压缩级别 0-9，ZIP 下 0 表示全部仅存储
+        :param archive_format: 归档格式，zip、zip64、tar、tar.gz 或 tar.zst
+        :param folder_id: 指定时递归打包该文件夹下的完整目录树，保留相对路径
+        """
+        try:
+            writer, archive = self.open_archive(query, compression_level, archive_format, folder_id)
             
-            # 返回 ZIP 文件流
+            # 边下载边压缩边输出，不在内存中构建整个压缩包
             return StreamingResponse(
-                io.BytesIO(zip_buffer.read()),
-                media_type='application/zip',
+                archive,
+                media_type=writer.media_type,
                 headers={
-                    "Content-Disposition": "attachment; filename=google_drive_files.zip"
+                    "Content-Disposition": f"attachment; filename=google_drive_files.{writer.extension}"
                 }
             )
             
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"下载所有文件失败: {e}")
             raise HTTPException(status_code=500, detail=f"下载所有文件失败: {str(e)}")
 
-    def get_file_info(self, file_id: str) -> Dict[str, Any]:
-        """获取文件信息"""
+    def _iter_archive(self, writer, files: Iterable[Dict[str, Any]],
+                      on_member: Optional[Callable[[str], None]] = None) -> Iterator[bytes]:
+        """并发预取成员并按顺序写入流式归档，内存受预取字节预算限制"""
+        fetcher = ArchiveMemberFetcher(self.service, self.credentials)
+        names = ArchiveNameAllocator()
+        added = 0
+        for member in fetcher.fetch(files):
+            file_info = member.file_info
+            file_name = file_info.get('path') or sanitize_path_component(file_info['name'])
+            # 首个分块到达后才写入成员头，打不开的文件直接跳过
+            if member.error is not None:
+                logger.warning(f"跳过文件 {file_name}: {member.error}")
+                continue
+            size = int(file_info['size']) if file_info.get('size') is not None else None
+            # 图片、视频、压缩包等已压缩内容直接存储
+            compression = zipfile.ZIP_STORED if is_compressed_mime_type(file_info.get('mimeType')) else None
+            # 同名文件追加序号，避免在归档中互相覆盖
+            member_name = names.allocate(file_name)
+            for data in writer.add_member(member_name, member.chunks(),
+                                          parse_drive_time(file_info.get('modifiedTime')),
+                                          size=size, compression=compression):
+                if data:
+                    yield data
+            added += 1
+            if on_member:
+                on_member(member_name)
+            logger.info(f"已添加到归档: {file_name}")
+        for data in writer.close():
+            if data:
+                yield data
+        logger.info(f"成功创建包含 {added} 个文件的压缩包")
+
+    def search_files(self, query: str, mode: str = 'auto', limit: int = 20, content: bool = False) -> Dict[str, Any]:
+        """在本地搜索索引中按文件名（以及已提取的内容）搜索"""
+        if not get_search_index_enabled():
+            raise HTTPException(status_code=400, detail="搜索索引未启用，请在配置中设置 search_index_enabled")
         try:
+            return search_index.search(query, mode, limit, content)
+            
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"搜索文件失败: {e}")
+            raise HTTPException(status_code=500, detail=f"搜索文件失败: {str(e)}")
+
+    def get_file_info(self, file_id: str, fields: str = FILE_INFO_FIELDS,
+                      max_staleness: Optional[float] = None) -> Dict[str, Any]:
+        """获取文件信息，fields 为已校验的逗号分隔字段，max_staleness 含义同 list_files"""
+        try:
+            file_info = metadata_mirror.get_file(file_id, fields.split(','), max_staleness)
+            if file_info is not None:
+                return file_info
+
             file_info = self.service.files().get(
                 fileId=file_id,
-                fields='id,name,size,mimeType,createdTime,modifiedTime,parents,webViewLink,webContentLink'
+                fields=fields
             ).execute()
             
             logger.info(f"获取文件信息成功: {file_info.get('name')}")
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+幂等键
+客户端超时重试时携带相同的 Idempotency-Key，已完成的请求直接返回第一次的响应，
+仍在执行的请求等待其完成，不会重复上传或重复修改
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Tuple, Callable, Awaitable
+
+from fastapi import HTTPException
+from starlette.responses import Response
+
+from common.logger import logger
+from service.drive_transfer import get_transfer_config
+
+DEFAULT_IDEMPOTENCY_DB_PATH = 'data/idempotency.db'
+DEFAULT_IDEMPOTENCY_TTL = 24 * 3600
+DEFAULT_IDEMPOTENCY_WAIT_TIMEOUT = 600
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+# 重放的响应带上该头，便于客户端区分
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    scope TEXT NOT NULL,
+    idempotency_key TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    status_code INTEGER NOT NULL,
+    media_type TEXT,
+    body BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (scope, idempotency_key)
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys (expires_at);
+"""
+
+
+def get_idempotency_db_path() -> str:
+    """幂等记录数据库路径"""
+    return get_transfer_config().get('idempotency_db_path', DEFAULT_IDEMPOTENCY_DB_PATH)
+
+
+def get_idempotency_ttl() -> int:
+    """已完成请求的响应保留时间（秒）"""
+    return int(get_transfer_config().get('idempotency_ttl', DEFAULT_IDEMPOTENCY_TTL))
+
+
+def get_idempotency_wait_timeout() -> float:
+    """重复请求等待进行中请求完成的最长时间（秒），超时返回 409"""
+    return float(get_transfer_config().get('idempotency_wait_timeout', DEFAULT_IDEMPOTENCY_WAIT_TIMEOUT))
+
+
+def request_fingerprint(*parts: Any) -> str:
+    """请求参数摘要，同一个幂等键用于不同参数的请求时拒绝执行"""
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    幂等键存储
+
+    已完成请求的响应保存在 SQLite 中，服务重启后仍可重放；进行中的请求只记录在进程内存中，
+    进程退出后即视为未执行，客户端重试时重新执行。5xx 响应不保存，允许客户端重试。
+    """
+
+    def __init__(self, db_path: Optional[str] = None, ttl: Optional[int] = None):
+        self.db_path = db_path or get_idempotency_db_path()
+        self.ttl = get_idempotency_ttl() if ttl is None else ttl
+        self._in_flight: Dict[Tuple[str, str], Tuple[str, asyncio.Future]] = {}
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _load(self, scope: str, key: str) -> Optional[Tuple[str, int, Optional[str], bytes]]:
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT fingerprint, status_code, media_type, body FROM idempotency_keys "
+                "WHERE scope = ? AND idempotency_key = ? AND expires_at > ?", (scope, key, time.time())
+            ).fetchone()
+
+    def _save(self, scope: str, key: str, fingerprint: str, response: Response):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO idempotency_keys (scope, idempotency_key, fingerprint, status_code, "
+                "media_type, body, created_at, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (scope, key, fingerprint, response.status_code, response.media_type, bytes(response.body),
+                 now, now + self.ttl)
+            )
+
+    @staticmethod
+    def _replay(stored: Tuple[str, int, Optional[str], bytes]) -> Response:
+        _, status_code, media_type, body = stored
+        return Response(content=body, status_code=status_code, media_type=media_type,
+                        headers={REPLAYED_HEADER: 'true'})
+
+    async def run(self, key: Optional[str], scope: str, fingerprint: str,
+                  operation: Callable[[], Awaitable[Response]]) -> Response:
+        """
+        按幂等键执行请求
+
+        :param key: 请求头 Idempotency-Key，为空时直接执行
+        :param scope: 接口与账户标识，不同接口或用户的同名键互不影响
+        :param fingerprint: request_fingerprint 生成的请求参数摘要
+        :param operation: 实际执行请求并返回响应的协程函数，响应需有完整的 body
+        """
+        if not key:
+            return await operation()
+        if len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key 长度不能超过 {MAX_IDEMPOTENCY_KEY_LENGTH}")
+
+        entry = (scope, key)
+        deadline = time.monotonic() + get_idempotency_wait_timeout()
+        while True:
+            stored = self._load(scope, key)
+            if stored is not None:
+                if stored[0] != fingerprint:
+                    raise HTTPException(status_code=422, detail="Idempotency-Key 已用于参数不同的请求")
+                logger.info(f"幂等键 {key} 命中，返回已完成请求的响应")
+                return self._replay(stored)
+
+            in_flight = self._in_flight.get(entry)
+            if in_flight is None:
+                break
+            if in_flight[0] != fingerprint:
+                raise HTTPException(status_code=422, detail="Idempotency-Key 已用于参数不同的请求")
+            remaining = deadline - time.monotonic()
+            logger.info(f"幂等键 {key} 对应的请求正在执行，等待其完成")
+            try:
+                # 进行中的请求失败时等待方也会醒来，重新检查后自行执行
+                await asyncio.wait_for(asyncio.shield(in_flight[1]), max(remaining, 0))
+            except asyncio.TimeoutError:
+                raise HTTPException(status_code=409, detail="相同 Idempotency-Key 的请求仍在执行，请稍后重试")
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[entry] = (fingerprint, future)
+        try:
+            try:
+                response = await operation()
+            except HTTPException as e:
+                if e.status_code >= 500:
+                    raise
+                # 参数错误等客户端错误同样保存，重试得到相同的结果
+                response = Response(content=json.dumps({'detail': e.detail}, ensure_ascii=False),
+                                    status_code=e.status_code, media_type='application/json', headers=e.headers)
+            if response.status_code < 500:
+                self._save(scope, key, fingerprint, response)
+            return response
+        finally:
+            self._in_flight.pop(entry, None)
+            future.set_result(None)
+
+    def purge_expired(self):
+        """删除过期的幂等记录"""
+        with self._connect() as conn:
+            purged = conn.execute("DELETE FROM idempotency_keys WHERE expires_at <= ?", (time.time(),)).rowcount
+        if purged:
+            logger.info(f"已清理 {purged} 条过期的幂等记录")
+
+
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+文件列表查询结果缓存
+按 (账户, 查询条件, 每页数量, 页面令牌, 字段) 缓存 files.list 的结果，相同查询短时间内重复请求时不再访问 Drive；
+同一查询并发未命中时只有一个请求访问 Drive，其余等待其结果。
+通过本服务上传文件时，按目标文件夹清除可能受影响的缓存
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Optional, Dict, Any, Tuple, FrozenSet, Callable
+
+from service.drive_transfer import get_transfer_config
+
+DEFAULT_LIST_CACHE_TTL = 10
+DEFAULT_LIST_CACHE_MAX_ENTRIES = 1000
+
+_QUOTED = re.compile(r"'((?:[^'\\]|\\.)*)'")
+_PARENT_CLAUSE = re.compile(r"'((?:[^'\\]|\\.)*)'\s+in\s+parents", re.IGNORECASE)
+_OR_NOT = re.compile(r"\b(or|not)\b", re.IGNORECASE)
+
+# 'root' 是根目录的别名，与根目录的真实 ID 对不上，写入根目录时清除该账户的全部缓存
+_ROOT_ALIAS = 'root'
+
+CacheKey = Tuple[str, str, int, str, str]
+
+
+def get_list_cache_ttl() -> float:
+    """列表缓存有效期（秒），0 表示不缓存"""
+    return float(get_transfer_config().get('list_cache_ttl', DEFAULT_LIST_CACHE_TTL))
+
+
+def get_list_cache_max_entries() -> int:
+    """列表缓存最多保存的查询结果数"""
+    return int(get_transfer_config().get('list_cache_max_entries', DEFAULT_LIST_CACHE_MAX_ENTRIES))
+
+
+def query_parents(query: Optional[str]) -> Optional[FrozenSet[str]]:
+    """
+    查询结果只可能包含哪些文件夹中的文件
+
+    只有用 and 连接且带有 'ID' in parents 的查询才能确定，其余返回 None，表示任何写入都可能影响结果
+    """
+    if not query:
+        return None
+    parents = frozenset(re.sub(r"\\(.)", r"\1", value) for value in _PARENT_CLAUSE.findall(query))
+    if not parents or _OR_NOT.search(_QUOTED.sub("''", query)):
+        return None
+    return parents
+
+
+class ListResultCache:
+    """带有效期的 LRU 列表缓存，不同账户的缓存互不共享"""
+
+    def __init__(self, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        self.ttl = get_list_cache_ttl() if ttl is None else ttl
+        self.max_entries = max_entries or get_list_cache_max_entries()
+        self._entries: 'OrderedDict[CacheKey, Tuple[float, Dict[str, Any], Optional[FrozenSet[str]]]]' = OrderedDict()
+        self._in_flight: Dict[CacheKey, Future] = {}
+        # 每次清除缓存时递增，查询期间发生写入的结果不再写入缓存
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, account: str, query: Optional[str], page_size: int, page_token: Optional[str],
+                    fields: str, loader: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        读取缓存的列表结果，未命中时调用 loader 访问 Drive
+
+        返回的结果在多个请求间共享，调用方不能修改
+        """
+        if self.ttl <= 0:
+            return loader()
+        key = (account, query or '', page_size, page_token or '', fields)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] >= time.monotonic():
+                self._entries.move_to_end(key)
+                return entry[1]
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+                generation = self._generations.get(account, 0)
+
+        if not leader:
+            # 与正在进行的相同查询共用结果，失败时抛出同样的异常
+            return future.result()
+
+        try:
+            result = loader()
+        except BaseException as e:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if self._generations.get(account, 0) == generation:
+                self._entries[key] = (time.monotonic() + self.ttl, result, query_parents(query))
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        future.set_result(result)
+        return result
+
+    def invalidate_parent(self, account: str, parent_id: Optional[str] = None):
+        """
+        清除写入 parent_id 文件夹可能影响的缓存
+
+        :param parent_id: 为空或为根目录别名时清除该账户的全部缓存
+        """
+        whole_account = not parent_id or parent_id == _ROOT_ALIAS
+        with self._lock:
+            self._generations[account] = self._generations.get(account, 0) + 1
+            for key, (_, _, parents) in list(self._entries.items()):
+                if key[0] == account and (whole_account or parents is None or parent_id in parents):
+                    del self._entries[key]
+
+
+list_cache = ListResultCache()
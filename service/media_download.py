@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+文件下载响应
+单一账户与多用户下载共用：命中本地缓存时发送缓存文件，否则从 Drive 流式转发，
+Range 请求映射为对 Drive 的区间请求，只拉取客户端需要的字节
+"""
+
+import uuid
+from typing import Optional, Dict, Any, List, Tuple, Iterator
+
+from fastapi import HTTPException
+from starlette.responses import StreamingResponse, FileResponse, Response
+
+from common.http_conditional import content_etag, last_modified, validator_headers, is_not_modified, \
+    if_range_matches, not_modified_response
+from common.http_range import parse_range_header, RangeNotSatisfiable
+from common.logger import logger
+from service.download_cache import download_cache
+from service.drive_transfer import stream_media, authorized_http, content_disposition, iter_media_chunks, \
+    use_parallel_download, get_num_retries, BackgroundChunkStream, DEFAULT_MIME_TYPE, DOWNLOAD_FILE_FIELDS
+from service.metadata_cache import metadata_cache, DEFAULT_ACCOUNT
+
+
+def _multipart_byteranges(http, uri: str, ranges: List[Tuple[int, int]], size: int, mime_type: str,
+                          boundary: str) -> Tuple[Iterator[bytes], int]:
+    """生成 multipart/byteranges 响应体，返回 (数据迭代器, 总长度)"""
+    part_headers = [
+        (f"--{boundary}\r\nContent-Type: {mime_type}\r\n"
+         f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode('latin-1')
+        for start, end in ranges
+    ]
+    closing = f"--{boundary}--\r\n".encode('latin-1')
+    content_length = sum(len(header) + end - start + 1 + 2 for header, (start, end) in zip(part_headers, ranges))
+    content_length += len(closing)
+
+    def body() -> Iterator[bytes]:
+        for header, (start, end) in zip(part_headers, ranges):
+            yield header
+            yield from iter_media_chunks(http, uri, start=start, end=end)
+            yield b'\r\n'
+        yield closing
+
+    return body(), content_length
+
+
+def _discard(speculative: Optional[BackgroundChunkStream]):
+    if speculative is not None:
+        speculative.close()
+
+
+def _worth_speculating(hint: Optional[Dict[str, Any]]) -> bool:
+    """
+    按上次看到的元数据判断是否值得预先拉取内容
+
+    只有确知文件较小（不走并行下载）且内容不在下载缓存中时才预先拉取；
+    没有提示时文件可能很大或已缓存，预先拉取多半白费，不冒这个险
+    """
+    if hint is None or hint.get('size') is None:
+        return False
+    size = int(hint['size'])
+    return not download_cache.contains(hint) and not use_parallel_download(0, size - 1)
+
+
+def download_file_response(service, credentials, file_id: str, account: str = DEFAULT_ACCOUNT,
+                           range_header: Optional[str] = None, if_range: Optional[str] = None,
+                           if_none_match: Optional[str] = None,
+                           if_modified_since: Optional[str] = None) -> Response:
+    """
+    下载文件：元数据请求与内容请求并发发出，省去一次往返
+
+    响应的长度、校验器、304 判断与下载缓存查找都以本次新取的元数据为准；
+    缓存的元数据只是提示，只有提示表明文件较小且未被下载缓存时才预先拉取内容，
+    因此同一文件的首次下载仍是先取元数据再取内容。
+    带 Range 或条件请求头时内容多半用不上（部分内容或 304），此时不预先拉取内容。
+    预先拉取的流队列只保留一个分块，文件在提示之后变大或被缓存而用不上时丢弃，
+    最多浪费两个分块（队列中一个、拉取线程手中一个）。
+
+    :param account: 账户标识，元数据缓存按账户隔离
+    """
+    speculative = None
+    hint = metadata_cache.get(account, file_id, allow_stale=True)
+    if not (range_header or if_none_match or if_modified_since) and _worth_speculating(hint):
+        uri = service.files().get_media(fileId=file_id).uri
+        speculative = BackgroundChunkStream(iter_media_chunks(authorized_http(credentials), uri), queue_size=1)
+    try:
+        file_info = service.files().get(fileId=file_id, fields=DOWNLOAD_FILE_FIELDS).execute(
+            num_retries=get_num_retries()
+        )
+    except Exception:
+        _discard(speculative)
+        raise
+    metadata_cache.put(account, file_id, file_info)
+
+    logger.info(f"开始下载文件: {file_info.get('name')} (ID: {file_id})")
+    return build_download_response(service, credentials, file_id, file_info, range_header, if_range,
+                                   if_none_match, if_modified_since, speculative)
+
+
+def build_download_response(service, credentials, file_id: str, file_info: Dict[str, Any],
+                            range_header: Optional[str] = None, if_range: Optional[str] = None,
+                            if_none_match: Optional[str] = None, if_modified_since: Optional[str] = None,
+                            speculative: Optional[BackgroundChunkStream] = None) -> Response:
+    """
+    构造文件下载响应
+
+    :param file_info: 文件元数据，即按 DOWNLOAD_FILE_FIELDS 获取的字段
+    :param range_header: 客户端的 Range 请求头
+    :param if_range: 客户端的 If-Range 请求头，与当前 ETag / Last-Modified 不一致时忽略 Range 返回完整内容
+    :param if_none_match: 客户端的 If-None-Match 请求头
+    :param if_modified_since: 客户端的 If-Modified-Since 请求头
+    :param speculative: 已提前开始拉取的完整内容流，用不上时关闭
+    """
+    try:
+        return _build_download_response(service, credentials, file_id, file_info, range_header, if_range,
+                                        if_none_match, if_modified_since, speculative)
+    except Exception:
+        _discard(speculative)
+        raise
+
+
+def _build_download_response(service, credentials, file_id: str, file_info: Dict[str, Any],
+                             range_header: Optional[str], if_range: Optional[str],
+                             if_none_match: Optional[str], if_modified_since: Optional[str],
+                             speculative: Optional[BackgroundChunkStream]) -> Response:
+    file_name = file_info.get('name')
+    mime_type = file_info.get('mimeType') or DEFAULT_MIME_TYPE
+    etag = content_etag(file_info)
+    modified = last_modified(file_info)
+    validators = validator_headers(etag, modified)
+
+    # 客户端持有的版本仍是最新时，只凭元数据返回 304，不拉取内容
+    if is_not_modified(if_none_match, if_modified_since, etag, modified):
+        logger.info(f"文件未修改，返回 304: {file_name} (ID: {file_id})")
+        _discard(speculative)
+        return not_modified_response(validators)
+
+    headers = {"Content-Disposition": content_disposition(file_name), "Accept-Ranges": "bytes", **validators}
+
+    # 相同内容已在本地缓存时直接发送缓存文件，Range / If-Range 由 FileResponse 处理
+    cached_path = download_cache.lookup(file_info)
+    if cached_path:
+        logger.info(f"命中下载缓存: {file_name} (ID: {file_id})")
+        _discard(speculative)
+        return FileResponse(cached_path, media_type=mime_type, headers=headers)
+
+    size = int(file_info['size']) if file_info.get('size') is not None else None
+    ranges = None
+    if range_header and size and if_range_matches(if_range, etag, modified):
+        try:
+            ranges = parse_range_header(range_header, size)
+        except RangeNotSatisfiable:
+            raise HTTPException(status_code=416, detail="请求的范围不可满足",
+                                headers={"Content-Range": f"bytes */{size}"})
+
+    if ranges is None:
+        end = size - 1 if size else None
+        tee = download_cache.tee(file_info)
+        if speculative is not None and not use_parallel_download(0, end):
+            # 直接沿用元数据请求期间已开始拉取的内容流
+            chunks = speculative.prime()
+            if tee is not None:
+                chunks = tee(iter(chunks))
+        else:
+            _discard(speculative)
+            # 后台线程分块拉取内容，经有界队列边下边发，同时写入下载缓存
+            chunks = stream_media(service, credentials, file_id, end=end, tee=tee)
+        if size is not None:
+            headers["Content-Length"] = str(size)
+        return StreamingResponse(chunks, media_type=mime_type, headers=headers)
+
+    _discard(speculative)
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        chunks = stream_media(service, credentials, file_id, start=start, end=end)
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        logger.info(f"区间下载文件: {file_name} (ID: {file_id}) bytes {start}-{end}/{size}")
+        return StreamingResponse(chunks, status_code=206, media_type=mime_type, headers=headers)
+
+    uri = service.files().get_media(fileId=file_id).uri
+    boundary = uuid.uuid4().hex
+    body, content_length = _multipart_byteranges(authorized_http(credentials), uri, ranges, size, mime_type, boundary)
+    chunks = BackgroundChunkStream(body).prime()
+    headers["Content-Length"] = str(content_length)
+    logger.info(f"多区间下载文件: {file_name} (ID: {file_id}) 共 {len(ranges)} 个区间")
+    return StreamingResponse(chunks, status_code=206, media_type=f"multipart/byteranges; boundary={boundary}",
+                             headers=headers)
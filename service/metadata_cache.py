@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+文件元数据缓存
+按 (账户, 文件ID) 缓存下载所需的元数据。缓存的内容只作为提示（例如判断是否值得预先拉取内容），
+响应头与条件请求判断始终以新取的元数据为准
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+from service.drive_transfer import get_transfer_config
+
+DEFAULT_METADATA_CACHE_TTL = 3600
+DEFAULT_METADATA_CACHE_MAX_ENTRIES = 10000
+
+# 单一账户服务使用的账户标识
+DEFAULT_ACCOUNT = 'default'
+
+
+def get_metadata_cache_ttl() -> float:
+    """元数据缓存有效期（秒），0 表示不缓存；缓存只作提示，过期条目在淘汰前仍可作为提示读取"""
+    return float(get_transfer_config().get('metadata_cache_ttl', DEFAULT_METADATA_CACHE_TTL))
+
+
+def get_metadata_cache_max_entries() -> int:
+    """元数据缓存最多保存的文件数"""
+    return int(get_transfer_config().get('metadata_cache_max_entries', DEFAULT_METADATA_CACHE_MAX_ENTRIES))
+
+
+def account_key(user_token: str) -> str:
+    """多用户模式下用令牌摘要区分账户，不在内存中保留令牌原文"""
+    return hashlib.sha256(user_token.encode('utf-8')).hexdigest()[:32]
+
+
+class FileMetadataCache:
+    """带有效期的 LRU 元数据缓存，不同账户的权限不同，缓存互不共享"""
+
+    def __init__(self, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        self.ttl = get_metadata_cache_ttl() if ttl is None else ttl
+        self.max_entries = max_entries or get_metadata_cache_max_entries()
+        self._entries: 'OrderedDict[Tuple[str, str], Tuple[float, Dict[str, Any]]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, account: str, file_id: str, allow_stale: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        读取缓存的元数据
+
+        :param allow_stale: 为 True 时也返回已过期的条目，只能作为提示使用，例如判断是否值得预先拉取内容
+        """
+        if self.ttl <= 0:
+            return None
+        key = (account, file_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, file_info = entry
+            # 过期条目保留到被 LRU 淘汰，供 allow_stale 读取
+            if expires_at < time.monotonic() and not allow_stale:
+                return None
+            self._entries.move_to_end(key)
+            return dict(file_info)
+
+    def put(self, account: str, file_id: str, file_info: Dict[str, Any]):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[(account, file_id)] = (time.monotonic() + self.ttl, dict(file_info))
+            self._entries.move_to_end((account, file_id))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, account: str, file_id: str):
+        with self._lock:
+            self._entries.pop((account, file_id), None)
+
+
+metadata_cache = FileMetadataCache()
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""
+Drive 元数据本地镜像
+首次同步列出全部文件写入数据库，之后由调度器定时调用 changes.list 增量更新，
+页面令牌持久化在数据库中，重启后从上次的位置继续。
+列表与文件信息接口指定 max_staleness 且镜像足够新时直接读镜像，省去 Drive 往返
+"""
+
+import json
+import re
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Optional, List, Dict, Any
+
+from fastapi import HTTPException
+from googleapiclient.errors import HttpError
+from sqlalchemy import or_
+from sqlalchemy.exc import SQLAlchemyError
+
+import common.sqlalchemy_pool as sqlalchemy_db
+from common.logger import logger
+from model.drive_mirror import DriveFileMirror, DriveMirrorState
+from service.drive_fields import FILE_INFO_FIELDS, project
+from service.drive_transfer import get_transfer_config, authorized_http, iter_file_pages, get_start_page_token, \
+    iter_change_pages, get_root_folder_id
+from service.metadata_cache import DEFAULT_ACCOUNT
+
+DEFAULT_METADATA_MIRROR_INTERVAL = 60
+
+# 镜像保存的字段，调用方请求的字段超出该范围时改为请求 Drive
+MIRROR_FILE_FIELDS = FILE_INFO_FIELDS + ',trashed'
+MIRROR_FIELD_NAMES = frozenset(MIRROR_FILE_FIELDS.split(','))
+MIRROR_PAGE_SIZE = 1000
+
+# 从镜像读取的列表返回的 next_page_token 带该前缀，后续分页继续读镜像
+MIRROR_PAGE_TOKEN_PREFIX = 'mirror:'
+
+# 令牌过期或无效时 Drive 返回的状态码，需要重新全量同步
+_EXPIRED_TOKEN_STATUS = (400, 404, 410)
+
+_AND_SEPARATOR = re.compile(r"\s+and\s+", re.IGNORECASE)
+_QUOTED = r"'((?:[^'\\]|\\.)*)'"
+_PARENT_CLAUSE = re.compile(rf"^{_QUOTED}\s+in\s+parents$", re.IGNORECASE)
+_COMPARE_CLAUSE = re.compile(rf"^(name|mimeType|modifiedTime)\s*(=|!=|<=|>=|<|>)\s*{_QUOTED}$")
+_CONTAINS_CLAUSE = re.compile(rf"^name\s+contains\s+{_QUOTED}$", re.IGNORECASE)
+_NOT_TRASHED_CLAUSE = re.compile(r"^trashed\s*=\s*false$", re.IGNORECASE)
+
+
+def get_metadata_mirror_enabled() -> bool:
+    """是否启用元数据镜像"""
+    return bool(get_transfer_config().get('metadata_mirror_enabled', False))
+
+
+def get_metadata_mirror_interval() -> int:
+    """增量同步的间隔（秒）"""
+    return int(get_transfer_config().get('metadata_mirror_interval', DEFAULT_METADATA_MIRROR_INTERVAL))
+
+
+def _unquote(value: str) -> str:
+    return re.sub(r"\\(.)", r"\1", value)
+
+
+def _escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _normalize_time(value: str) -> Optional[str]:
+    """把查询中的时间转换为 Drive 存储的格式，未带时区时按 UTC 处理"""
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc)
+    return parsed.strftime('%Y-%m-%dT%H:%M:%S.') + f'{parsed.microsecond // 1000:03d}Z'
+
+
+def _split_conjunction(query: str) -> List[str]:
+    """按引号外的 and 拆分查询条件"""
+    clauses, current, quoted, i = [], [], False, 0
+    while i < len(query):
+        char = query[i]
+        if quoted and char == '\\' and i + 1 < len(query):
+            current.append(query[i:i + 2])
+            i += 2
+            continue
+        if char == "'":
+            quoted = not quoted
+        elif not quoted:
+            match = _AND_SEPARATOR.match(query, i)
+            if match:
+                clauses.append(''.join(current).strip())
+                current = []
+                i = match.end()
+                continue
+        current.append(char)
+        i += 1
+    clauses.append(''.join(current).strip())
+    return clauses
+
+
+def translate_query(query: Optional[str], root_id: Optional[str] = None) -> Optional[list]:
+    """
+    把简单的 Drive 查询转换为镜像表的过滤条件，无法转换时返回 None
+
+    支持用 and 连接的：'ID' in parents、name / mimeType 的 = 与 !=、name contains、
+    modifiedTime 的比较以及 trashed = false（镜像中不保存回收站的文件）。
+    镜像中的父目录是真实 ID，'root' in parents 按 root_id 匹配，不知道 root_id 时无法转换
+    """
+    conditions = []
+    if not query or not query.strip():
+        return conditions
+    for clause in _split_conjunction(query.strip()):
+        if _NOT_TRASHED_CLAUSE.match(clause):
+            continue
+        match = _PARENT_CLAUSE.match(clause)
+        if match:
+            parent_id = _unquote(match.group(1))
+            if parent_id == 'root':
+                if not root_id:
+                    return None
+                parent_id = root_id
+            # Drive 已不允许一个文件有多个父目录，只按第一个父目录匹配
+            conditions.append(DriveFileMirror.parent_id == parent_id)
+            continue
+        match = _CONTAINS_CLAUSE.match(clause)
+        if match:
+            # 与 Drive 一致，按文件名中单词的前缀匹配
+            prefix = _escape_like(_unquote(match.group(1)))
+            conditions.append(or_(DriveFileMirror.name.like(f'{prefix}%', escape='\\'),
+                                  DriveFileMirror.name.like(f'% {prefix}%', escape='\\')))
+            continue
+        match = _COMPARE_CLAUSE.match(clause)
+        if not match:
+            return None
+        field, operator, value = match.group(1), match.group(2), _unquote(match.group(3))
+        if field == 'modifiedTime':
+            value = _normalize_time(value)
+            if value is None:
+                return None
+            column = DriveFileMirror.modified_time
+        elif operator in ('=', '!='):
+            column = DriveFileMirror.name if field == 'name' else DriveFileMirror.mime_type
+        else:
+            return None
+        conditions.append({
+            '=': column == value, '!=': column != value, '<': column < value,
+            '<=': column <= value, '>': column > value, '>=': column >= value
+        }[operator])
+    return conditions
+
+
+class MetadataMirror:
+    """单一账户的 Drive 元数据镜像"""
+
+    def __init__(self, account: str = DEFAULT_ACCOUNT):
+        self.account = account
+        self._tables_created = False
+
+    @contextmanager
+    def _session(self):
+        sqlalchemy_db.init_sqlalchemy_pool()
+        if not self._tables_created:
+            sqlalchemy_db.SQLAlchemyBase.metadata.create_all(
+                sqlalchemy_db.sqlalchemy_pool.engine, tables=[DriveFileMirror.__table__, DriveMirrorState.__table__]
+            )
+            self._tables_created = True
+        session = sqlalchemy_db.SQLAlchemySessionLocal()
+        try:
+            yield session
+            session.commit()
+        except BaseException:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def _record(self, file: Dict[str, Any]) -> DriveFileMirror:
+        parents = file.get('parents') or []
+        return DriveFileMirror(
+            account=self.account,
+            file_id=file['id'],
+            parent_id=parents[0] if parents else None,
+            name=file.get('name', ''),
+            mime_type=file.get('mimeType', ''),
+            size=int(file['size']) if file.get('size') else None,
+            modified_time=file.get('modifiedTime'),
+            data=json.dumps(file, ensure_ascii=False)
+        )
+
+    def sync(self, service, credentials):
+        """同步一次：尚无页面令牌时全量同步，否则拉取令牌之后的变更，由调度器定时调用"""
+        http = authorized_http(credentials)
+        try:
+            with self._session() as session:
+                state = session.get(DriveMirrorState, self.account)
+                page_token = state.page_token if state else None
+            if page_token:
+                try:
+                    self._sync_changes(service, http, page_token)
+                    return
+                except HttpError as e:
+                    if e.resp.status not in _EXPIRED_TOKEN_STATUS:
+                        raise
+                    logger.warning(f"元数据镜像的页面令牌已失效，重新全量同步: {e}")
+            self._full_sync(service, http)
+        except Exception as e:
+            logger.error(f"同步元数据镜像失败: {e}")
+
+    def _full_sync(self, service, http):
+        # 先取变更起点再列出文件，列出期间发生的变更会在下次增量同步时重放
+        start_token = get_start_page_token(service, http)
+        root_id = get_root_folder_id(service, http)
+        with self._session() as session:
+            # 重建期间镜像视为不可用
+            session.query(DriveMirrorState).filter(DriveMirrorState.account == self.account).delete()
+            session.query(DriveFileMirror).filter(DriveFileMirror.account == self.account).delete()
+
+        count = 0
+        for page in iter_file_pages(service, http, 'trashed = false', MIRROR_PAGE_SIZE, MIRROR_FILE_FIELDS):
+            files = page.get('files', [])
+            with self._session() as session:
+                for file in files:
+                    session.merge(self._record(file))
+            count += len(files)
+
+        with self._session() as session:
+            session.merge(DriveMirrorState(account=self.account, page_token=start_token, synced_at=time.time(),
+                                           root_id=root_id))
+        logger.info(f"元数据镜像全量同步完成，共 {count} 个文件")
+
+    def _sync_changes(self, service, http, page_token: str):
+        changed = 0
+        for result in iter_change_pages(service, http, page_token, MIRROR_PAGE_SIZE, MIRROR_FILE_FIELDS):
+            next_token = result.get('nextPageToken')
+            new_start_token = result.get('newStartPageToken')
+            with self._session() as session:
+                for change in result.get('changes', []):
+                    if change.get('changeType', 'file') != 'file':
+                        continue
+                    file = change.get('file')
+                    if change.get('removed') or not file or file.get('trashed'):
+                        session.query(DriveFileMirror).filter(DriveFileMirror.account == self.account,
+                                                              DriveFileMirror.file_id == change['fileId']).delete()
+                    else:
+                        session.merge(self._record(file))
+                    changed += 1
+                # 每页处理完即保存令牌，中途失败时下次从该页继续
+                state = session.get(DriveMirrorState, self.account) or DriveMirrorState(account=self.account)
+                state.page_token = next_token or new_start_token
+                if new_start_token:
+                    state.synced_at = time.time()
+                session.merge(state)
+        if changed:
+            logger.info(f"元数据镜像增量同步完成，处理 {changed} 条变更")
+
+    def synced_at(self) -> Optional[float]:
+        """最近一次追平 Drive 变更的时间，镜像未启用或尚未完成同步时为 None"""
+        if not get_metadata_mirror_enabled():
+            return None
+        try:
+            with self._session() as session:
+                state = session.get(DriveMirrorState, self.account)
+                return state.synced_at if state else None
+        except SQLAlchemyError as e:
+            logger.warning(f"读取元数据镜像状态失败: {e}")
+            return None
+
+    def _root_id(self) -> Optional[str]:
+        with self._session() as session:
+            state = session.get(DriveMirrorState, self.account)
+            return state.root_id if state else None
+
+    def _fresh_synced_at(self, max_staleness: Optional[float]) -> Optional[float]:
+        if max_staleness is None:
+            return None
+        synced_at = self.synced_at()
+        if synced_at is None or time.time() - synced_at > max_staleness:
+            return None
+        return synced_at
+
+    def list_files(self, query: Optional[str], page_size: int, page_token: Optional[str], names: List[str],
+                   max_staleness: Optional[float]) -> Optional[Dict[str, Any]]:
+        """
+        从镜像读取文件列表，镜像不够新、查询无法转换或字段超出镜像范围时返回 None，由调用方请求 Drive
+
+        带镜像页面令牌的请求始终读镜像，保证同一次翻页的数据来源一致
+        """
+        if page_token and page_token.startswith(MIRROR_PAGE_TOKEN_PREFIX):
+            offset = page_token[len(MIRROR_PAGE_TOKEN_PREFIX):]
+            if not offset.isdigit() or not get_metadata_mirror_enabled():
+                raise HTTPException(status_code=400, detail="page_token 无效")
+            offset = int(offset)
+            synced_at = self.synced_at()
+        else:
+            synced_at = None if page_token else self._fresh_synced_at(max_staleness)
+            if synced_at is None:
+                return None
+            offset = 0
+
+        conditions = translate_query(query, self._root_id())
+        if conditions is None or not MIRROR_FIELD_NAMES.issuperset(names):
+            if offset:
+                raise HTTPException(status_code=400, detail="镜像分页的查询条件或字段无效")
+            return None
+
+        with self._session() as session:
+            rows = session.query(DriveFileMirror.data).filter(
+                DriveFileMirror.account == self.account, *conditions
+            ).order_by(DriveFileMirror.modified_time.desc(), DriveFileMirror.file_id) \
+                .offset(offset).limit(page_size + 1).all()
+
+        files = [project(json.loads(row.data), names) for row in rows[:page_size]]
+        logger.info(f"从元数据镜像找到 {len(files)} 个文件")
+        return {
+            'files': files,
+            'count': len(files),
+            'next_page_token': f'{MIRROR_PAGE_TOKEN_PREFIX}{offset + page_size}' if len(rows) > page_size else None,
+            'message': f'成功获取 {len(files)} 个文件',
+            'source': 'mirror',
+            'synced_at': synced_at
+        }
+
+    def get_file(self, file_id: str, names: List[str], max_staleness: Optional[float]) -> Optional[Dict[str, Any]]:
+        """从镜像读取单个文件的元数据，不满足条件或镜像中没有该文件时返回 None"""
+        if not MIRROR_FIELD_NAMES.issuperset(names) or self._fresh_synced_at(max_staleness) is None:
+            return None
+        with self._session() as session:
+            row = session.get(DriveFileMirror, (self.account, file_id))
+            data = row.data if row else None
+        return project(json.loads(data), names) if data else None
+
+
+metadata_mirror = MetadataMirror()
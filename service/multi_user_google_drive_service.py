@@ -4,20 +4,23 @@
 支持每个用户使用自己的 Google Drive 账户
 """
 
-import os
-import io
-import zipfile
-from typing import Optional, List, Dict, Any
+from typing import Optional, Dict, Any, Iterator
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from fastapi import HTTPException, UploadFile
-from starlette.responses import StreamingResponse
+from starlette.responses import Response
 
 from common.config_loader import GLOBAL_CONFIG
 from common.logger import logger
+from service.drive_transfer import upload_stream, authorized_http, create_upload_session, LIST_FILE_FIELDS, \
+    iter_file_listing
+from service.drive_fields import parse_fields
+from service.media_download import download_file_response
+from service.list_cache import list_cache
+from service.metadata_cache import account_key
+from service.upload_session import confirm_upload_session
 
 
 class MultiUserGoogleDriveService:
@@ -62,29 +65,14 @@ class MultiUserGoogleDriveService:
             # 创建用户专属服务
             service, creds = self._create_service_from_token(user_token)
             
-            # 创建临时文件
-            temp_file_path = f"/tmp/{file.filename}"
-            with open(temp_file_path, "wb") as temp_file:
-                content = file.file.read()
-                temp_file.write(content)
-            
             # 准备文件元数据
             file_metadata = {'name': file.filename}
             if parent_folder_id:
                 file_metadata['parents'] = [parent_folder_id]
             
-            # 创建媒体上传对象
-            media = MediaFileUpload(temp_file_path, mimetype=file.content_type)
-            
-            # 上传文件到用户的 Drive
-            uploaded_file = service.files().create(
-                body=file_metadata,
-                media_body=media,
-                fields='id,name,size,mimeType,createdTime'
-            ).execute()
-            
-            # 清理临时文件
-            os.remove(temp_file_path)
+            # 分块流式上传到用户的 Drive
+            uploaded_file = upload_stream(service, file.file, file_metadata, file.content_type)
+            list_cache.invalidate_parent(account_key(user_token), parent_folder_id)
             
             logger.info(f"文件上传到用户 Drive 成功: {uploaded_file.get('name')}")
             
@@ -97,73 +85,111 @@ class MultiUserGoogleDriveService:
                 'message': '文件上传到您的 Google Drive 成功'
             }
             
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"上传文件到用户 Drive 失败: {e}")
-            if os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
             raise HTTPException(status_code=500, detail=f"上传文件失败: {str(e)}")
     
-    def download_file(self, file_id: str, user_token: str) -> StreamingResponse:
-        """从用户的 Google Drive 下载文件"""
+    def create_upload_session(self, user_token: str, file_name: str, size: Optional[int] = None,
+                              mime_type: Optional[str] = None, parent_folder_id: Optional[str] = None,
+                              origin: Optional[str] = None) -> Dict[str, Any]:
+        """在用户的 Google Drive 创建可续传上传会话，客户端拿到会话地址后直接上传"""
         try:
             # 创建用户专属服务
             service, creds = self._create_service_from_token(user_token)
             
-            # 获取文件信息
-            file_info = service.files().get(fileId=file_id, fields='name,mimeType,size').execute()
-            file_name = file_info.get('name')
-            mime_type = file_info.get('mimeType')
+            file_metadata = {'name': file_name}
+            if parent_folder_id:
+                file_metadata['parents'] = [parent_folder_id]
             
-            # 下载文件内容
-            request = service.files().get_media(fileId=file_id)
-            file_io = io.BytesIO()
-            downloader = MediaIoBaseDownload(file_io, request)
+            session_uri = create_upload_session(authorized_http(creds), file_metadata, mime_type, size, origin)
             
-            done = False
-            while done is False:
-                status, done = downloader.next_chunk()
+            logger.info(f"已在用户 Drive 创建上传会话: {file_name}")
             
-            file_io.seek(0)
+            return {
+                'session_uri': session_uri,
+                'name': file_name,
+                'parents': file_metadata.get('parents'),
+                'message': '上传会话创建成功，请直接向 session_uri 上传文件内容'
+            }
             
-            logger.info(f"从用户 Drive 下载文件成功: {file_name}")
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"在用户 Drive 创建上传会话失败: {e}")
+            raise HTTPException(status_code=500, detail=f"创建上传会话失败: {str(e)}")
+    
+    def complete_upload_session(self, user_token: str, session_uri: str, size: Optional[int] = None) -> Dict[str, Any]:
+        """客户端直传完成后确认上传结果"""
+        result = confirm_upload_session(session_uri, size)
+        if result['status'] == 'complete':
+            # 会话地址中不含目标文件夹，清除该用户的全部列表缓存
+            list_cache.invalidate_parent(account_key(user_token))
+        return result
+    
+    def download_file(self, file_id: str, user_token: str, range_header: Optional[str] = None,
+                      if_range: Optional[str] = None, if_none_match: Optional[str] = None,
+                      if_modified_since: Optional[str] = None) -> Response:
+        """从用户的 Google Drive 下载文件，支持 Range 区间请求与条件请求"""
+        try:
+            # 创建用户专属服务
+            service, creds = self._create_service_from_token(user_token)
             
-            return StreamingResponse(
-                io.BytesIO(file_io.read()),
-                media_type=mime_type or 'application/octet-stream',
-                headers={
-                    "Content-Disposition": f"attachment; filename={file_name}",
-                    "Content-Length": str(len(file_io.getvalue()))
-                }
-            )
+            return download_file_response(service, creds, file_id, account_key(user_token),
+                                          range_header, if_range, if_none_match, if_modified_since)
             
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"从用户 Drive 下载文件失败: {e}")
             raise HTTPException(status_code=500, detail=f"下载文件失败: {str(e)}")
     
-    def list_files(self, user_token: str, query: Optional[str] = None, page_size: int = 100) -> Dict[str, Any]:
+    def list_files(self, user_token: str, query: Optional[str] = None, page_size: int = 100,
+                   page_token: Optional[str] = None, fields: Optional[str] = None) -> Dict[str, Any]:
         """列出用户 Google Drive 中的文件"""
+        list_fields = ','.join(parse_fields(fields, LIST_FILE_FIELDS))
         try:
-            # 创建用户专属服务
-            service, creds = self._create_service_from_token(user_token)
-            
-            # 执行文件列表请求
-            results = service.files().list(
-                q=query if query else "",
-                pageSize=page_size,
-                fields="nextPageToken, files(id,name,size,mimeType,createdTime,modifiedTime,parents)"
-            ).execute()
-            
-            files = results.get('files', [])
-            
-            logger.info(f"获取用户 Drive 文件列表成功，共 {len(files)} 个文件")
+            def load() -> Dict[str, Any]:
+                # 创建用户专属服务
+                service, creds = self._create_service_from_token(user_token)
+                
+                # 执行文件列表请求
+                results = service.files().list(
+                    q=query if query else "",
+                    pageSize=page_size,
+                    pageToken=page_token,
+                    fields=f"nextPageToken, files({list_fields})"
+                ).execute()
+                
+                files = results.get('files', [])
+                
+                logger.info(f"获取用户 Drive 文件列表成功，共 {len(files)} 个文件")
+                
+                return {
+                    'files': files,
+                    'count': len(files),
+                    'next_page_token': results.get('nextPageToken'),
+                    'message': f'成功获取您的 Google Drive 中的 {len(files)} 个文件'
+                }
             
-            return {
-                'files': files,
-                'count': len(files),
-                'next_page_token': results.get('nextPageToken'),
-                'message': f'成功获取您的 Google Drive 中的 {len(files)} 个文件'
-            }
+            return list_cache.get_or_load(account_key(user_token), query, page_size, page_token, list_fields, load)
             
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"获取用户 Drive 文件列表失败: {e}")
+            raise HTTPException(status_code=500, detail=f"列出文件失败: {str(e)}")
+    
+    def stream_files(self, user_token: str, query: Optional[str] = None, page_size: int = 1000,
+                     page_token: Optional[str] = None, fields: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """在服务端翻完用户 Drive 的全部分页，逐个产出文件"""
+        list_fields = ','.join(parse_fields(fields, LIST_FILE_FIELDS))
+        try:
+            service, creds = self._create_service_from_token(user_token)
+            return iter_file_listing(service, authorized_http(creds), query, page_size, list_fields, page_token)
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"获取用户 Drive 文件列表失败: {e}")
             raise HTTPException(status_code=500, detail=f"列出文件失败: {str(e)}")
@@ -0,0 +1,445 @@
+# -*- coding: utf-8 -*-
+"""
+本地文件名搜索索引
+在内存中为文件名建立单词、前缀与三元组索引，支持前缀、子串、模糊和综合排序查询，
+可选提取小体积文本与 PDF 文件的内容一并索引。
+首次刷新列出全部文件，之后由调度器定时拉取 changes.list 增量更新
+"""
+
+import bisect
+import io
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from typing import Optional, List, Dict, Any, Set, Iterable
+
+from fastapi import HTTPException
+from googleapiclient.errors import HttpError
+
+from common.logger import logger
+from service.drive_transfer import get_transfer_config, get_num_retries, authorized_http, iter_file_pages, \
+    get_start_page_token, iter_change_pages
+
+DEFAULT_SEARCH_INDEX_INTERVAL = 60
+DEFAULT_SEARCH_INDEX_CONTENT_MAX_BYTES = 0
+
+SEARCH_FILE_FIELDS = 'id,name,mimeType,size,modifiedTime,parents,md5Checksum,trashed'
+SEARCH_PAGE_SIZE = 1000
+
+SEARCH_MODES = ('auto', 'prefix', 'substring', 'fuzzy')
+
+# 单词匹配的得分，综合排序时取每个搜索词的最高分再求平均
+_EXACT_SCORE = 1.0
+_PREFIX_SCORE = 0.8
+_SUBSTRING_SCORE = 0.6
+_FUZZY_SCORE = 0.5
+_CONTENT_SCORE = 0.3
+# 整个文件名与搜索词完全相同或以其开头时的加分
+_FULL_NAME_BONUS = 0.5
+_NAME_PREFIX_BONUS = 0.2
+
+# 模糊匹配要求的三元组相似度下限
+_FUZZY_THRESHOLD = 0.3
+# 一个搜索词最多展开的前缀单词数，避免单个字母匹配整个词表
+_MAX_PREFIX_EXPANSION = 2000
+
+_TEXT_MIME_TYPES = ('application/json', 'application/xml', 'application/javascript')
+_PDF_MIME_TYPE = 'application/pdf'
+_EXPIRED_TOKEN_STATUS = (400, 404, 410)
+
+
+def get_search_index_enabled() -> bool:
+    """是否启用搜索索引"""
+    return bool(get_transfer_config().get('search_index_enabled', False))
+
+
+def get_search_index_interval() -> int:
+    """增量刷新间隔（秒）"""
+    return int(get_transfer_config().get('search_index_interval', DEFAULT_SEARCH_INDEX_INTERVAL))
+
+
+def get_search_index_content_max_bytes() -> int:
+    """提取内容的文件大小上限（字节），0 表示只索引文件名"""
+    return int(get_transfer_config().get('search_index_content_max_bytes', DEFAULT_SEARCH_INDEX_CONTENT_MAX_BYTES))
+
+
+def normalize(text: str) -> str:
+    """全角转半角并忽略大小写"""
+    return unicodedata.normalize('NFKC', text).casefold()
+
+
+def tokenize(text: str) -> List[str]:
+    """按非字母数字字符切分单词，下划线也视为分隔符"""
+    return re.findall(r'[^\W_]+', text)
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _word_trigrams(word: str) -> Set[str]:
+    """单词前后补空格后的三元组，使词首相同的单词更相似"""
+    return _trigrams(f'  {word} ')
+
+
+def _is_content_indexable(file: Dict[str, Any], max_bytes: int) -> bool:
+    mime_type = file.get('mimeType', '')
+    if not (mime_type.startswith('text/') or mime_type in _TEXT_MIME_TYPES or mime_type == _PDF_MIME_TYPE):
+        return False
+    return bool(file.get('size')) and int(file['size']) <= max_bytes
+
+
+def extract_text(data: bytes, mime_type: str) -> Optional[str]:
+    """提取文件中的文字，PDF 只能取出使用单字节编码字体的文字"""
+    if mime_type == _PDF_MIME_TYPE:
+        try:
+            import pikepdf
+        except ImportError:
+            return None
+        parts = []
+        with pikepdf.open(io.BytesIO(data)) as pdf:
+            for page in pdf.pages:
+                for operands, _ in pikepdf.parse_content_stream(page, 'Tj TJ \' "'):
+                    for operand in operands:
+                        items = operand if isinstance(operand, pikepdf.Array) else [operand]
+                        parts.extend(bytes(item).decode('latin-1') for item in items
+                                     if isinstance(item, pikepdf.String))
+                parts.append(' ')
+        return ''.join(parts)
+    text = data.decode('utf-8', errors='ignore')
+    if mime_type == 'text/html':
+        from bs4 import BeautifulSoup
+        text = BeautifulSoup(text, 'html.parser').get_text(' ')
+    return text
+
+
+class _Document:
+    __slots__ = ('file', 'name', 'tokens', 'trigrams', 'terms', 'content_md5')
+
+    def __init__(self, file: Dict[str, Any]):
+        self.terms: Set[str] = set()
+        self.content_md5: Optional[str] = None
+        self.set_file(file)
+
+    def set_file(self, file: Dict[str, Any]):
+        self.file = file
+        self.name = normalize(file['name'])
+        self.tokens = set(tokenize(self.name))
+        self.trigrams = _trigrams(self.name)
+
+
+class SearchIndex:
+    """单一账户的内存搜索索引"""
+
+    def __init__(self):
+        self._docs: Dict[str, _Document] = {}
+        # 文件名三元组 -> 文件ID，用于子串匹配
+        self._name_trigrams: Dict[str, Set[str]] = {}
+        # 文件名单词 -> 文件ID，以及有序的单词表，用于前缀匹配
+        self._token_files: Dict[str, Set[str]] = {}
+        self._sorted_tokens: Optional[List[str]] = []
+        # 重建索引时大量新增单词，逐个插入有序表代价过高，改为查询时整体排序
+        self._bulk_loading = False
+        # 单词三元组 -> 单词，用于模糊匹配
+        self._token_trigrams: Dict[str, Set[str]] = {}
+        # 内容单词 -> 文件ID
+        self._content_terms: Dict[str, Set[str]] = {}
+        self._pending_content: Set[str] = set()
+        self._page_token: Optional[str] = None
+        self.synced_at: Optional[float] = None
+        self._lock = threading.RLock()
+
+    def _add_token(self, token: str, file_id: str):
+        files = self._token_files.get(token)
+        if files is None:
+            files = self._token_files[token] = set()
+            if self._bulk_loading:
+                self._sorted_tokens = None
+            elif self._sorted_tokens is not None:
+                bisect.insort(self._sorted_tokens, token)
+            for trigram in _word_trigrams(token):
+                self._token_trigrams.setdefault(trigram, set()).add(token)
+        files.add(file_id)
+
+    def _remove_token(self, token: str, file_id: str):
+        files = self._token_files.get(token)
+        if files is None:
+            return
+        files.discard(file_id)
+        if files:
+            return
+        del self._token_files[token]
+        if self._sorted_tokens is not None:
+            del self._sorted_tokens[bisect.bisect_left(self._sorted_tokens, token)]
+        for trigram in _word_trigrams(token):
+            tokens = self._token_trigrams.get(trigram)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._token_trigrams[trigram]
+
+    @staticmethod
+    def _discard(postings: Dict[str, Set[str]], keys: Iterable[str], file_id: str):
+        for key in keys:
+            files = postings.get(key)
+            if files is not None:
+                files.discard(file_id)
+                if not files:
+                    del postings[key]
+
+    def _set_terms(self, doc: _Document, terms: Set[str]):
+        file_id = doc.file['id']
+        self._discard(self._content_terms, doc.terms - terms, file_id)
+        for term in terms - doc.terms:
+            self._content_terms.setdefault(term, set()).add(file_id)
+        doc.terms = terms
+
+    def _index_name(self, doc: _Document):
+        file_id = doc.file['id']
+        for trigram in doc.trigrams:
+            self._name_trigrams.setdefault(trigram, set()).add(file_id)
+        for token in doc.tokens:
+            self._add_token(token, file_id)
+
+    def _unindex_name(self, doc: _Document):
+        file_id = doc.file['id']
+        self._discard(self._name_trigrams, doc.trigrams, file_id)
+        for token in doc.tokens:
+            self._remove_token(token, file_id)
+
+    def remove(self, file_id: str):
+        with self._lock:
+            doc = self._docs.pop(file_id, None)
+            self._pending_content.discard(file_id)
+            if doc is not None:
+                self._unindex_name(doc)
+                self._discard(self._content_terms, doc.terms, file_id)
+
+    def upsert(self, file: Dict[str, Any]):
+        """写入或更新一个文件，只带部分字段时与已有的元数据合并"""
+        file_id = file.get('id')
+        if not file_id:
+            return
+        if file.get('trashed'):
+            self.remove(file_id)
+            return
+        with self._lock:
+            doc = self._docs.get(file_id)
+            merged = dict(doc.file if doc else {}, **file)
+            merged.pop('trashed', None)
+            if not merged.get('name'):
+                return
+            if doc is None:
+                doc = self._docs[file_id] = _Document(merged)
+                self._index_name(doc)
+            elif merged['name'] == doc.file['name']:
+                doc.file = merged
+            else:
+                self._unindex_name(doc)
+                doc.set_file(merged)
+                self._index_name(doc)
+
+            max_bytes = get_search_index_content_max_bytes()
+            if max_bytes > 0 and _is_content_indexable(merged, max_bytes) \
+                    and doc.content_md5 != merged.get('md5Checksum'):
+                self._pending_content.add(file_id)
+
+    def add_files(self, files: Iterable[Dict[str, Any]]):
+        """写入同步得到的文件"""
+        for file in files:
+            self.upsert(file)
+
+    def refresh(self, service, credentials):
+        """刷新一次：尚无变更起点时列出全部文件重建索引，否则拉取变更，由调度器定时调用"""
+        http = authorized_http(credentials)
+        try:
+            if self._page_token:
+                try:
+                    self._apply_changes(service, http)
+                except HttpError as e:
+                    if e.resp.status not in _EXPIRED_TOKEN_STATUS:
+                        raise
+                    logger.warning(f"搜索索引的页面令牌已失效，重新建立索引: {e}")
+                    self._page_token = None
+            if not self._page_token:
+                self._rebuild(service, http)
+            self._index_contents(service, http)
+        except Exception as e:
+            logger.error(f"刷新搜索索引失败: {e}")
+
+    def _rebuild(self, service, http):
+        start_token = get_start_page_token(service, http)
+        seen = set()
+        self._bulk_loading = True
+        try:
+            for page in iter_file_pages(service, http, 'trashed = false', SEARCH_PAGE_SIZE, SEARCH_FILE_FIELDS):
+                files = page.get('files', [])
+                self.add_files(files)
+                seen.update(file['id'] for file in files)
+        finally:
+            self._bulk_loading = False
+        with self._lock:
+            self._sorted_tokens = sorted(self._token_files)
+            stale = [file_id for file_id in self._docs if file_id not in seen]
+        for file_id in stale:
+            self.remove(file_id)
+        self._page_token = start_token
+        self.synced_at = time.time()
+        logger.info(f"搜索索引建立完成，共 {len(seen)} 个文件")
+
+    def _apply_changes(self, service, http):
+        changed = 0
+        for result in iter_change_pages(service, http, self._page_token, SEARCH_PAGE_SIZE, SEARCH_FILE_FIELDS):
+            for change in result.get('changes', []):
+                if change.get('changeType', 'file') != 'file':
+                    continue
+                file = change.get('file')
+                if change.get('removed') or not file:
+                    self.remove(change['fileId'])
+                else:
+                    self.upsert(file)
+                changed += 1
+            self._page_token = result.get('nextPageToken') or result.get('newStartPageToken')
+        self.synced_at = time.time()
+        if changed:
+            logger.info(f"搜索索引增量更新完成，处理 {changed} 条变更")
+
+    def _index_contents(self, service, http):
+        while True:
+            with self._lock:
+                if not self._pending_content:
+                    return
+                file_id = self._pending_content.pop()
+                doc = self._docs.get(file_id)
+                if doc is None:
+                    continue
+                file = dict(doc.file)
+            try:
+                data = service.files().get_media(fileId=file_id).execute(http=http, num_retries=get_num_retries())
+                text = extract_text(data, file.get('mimeType', ''))
+            except Exception as e:
+                logger.warning(f"提取文件内容失败: {file.get('name')} ({file_id}): {e}")
+                text = None
+            with self._lock:
+                doc = self._docs.get(file_id)
+                if doc is None:
+                    continue
+                self._set_terms(doc, set(tokenize(normalize(text))) if text else set())
+                doc.content_md5 = file.get('md5Checksum')
+
+    def _match_tokens(self, word: str, fuzzy: bool) -> Dict[str, float]:
+        """与搜索词相同、以其开头或（fuzzy 时）相似的文件名单词及得分"""
+        scores = {}
+        sorted_tokens = self._sorted_tokens
+        if sorted_tokens is None:
+            sorted_tokens = sorted(self._token_files)
+            if not self._bulk_loading:
+                self._sorted_tokens = sorted_tokens
+        start = bisect.bisect_left(sorted_tokens, word)
+        for token in sorted_tokens[start:start + _MAX_PREFIX_EXPANSION]:
+            if not token.startswith(word):
+                break
+            scores[token] = _EXACT_SCORE if token == word else _PREFIX_SCORE
+        if fuzzy and len(word) >= 3:
+            word_trigrams = _word_trigrams(word)
+            shared = Counter()
+            for trigram in word_trigrams:
+                shared.update(self._token_trigrams.get(trigram, ()))
+            for token, count in shared.items():
+                # 相似度不超过 count / len(word_trigrams)，提前排除
+                if token in scores or count < _FUZZY_THRESHOLD * len(word_trigrams):
+                    continue
+                similarity = count / (len(word_trigrams) + len(_word_trigrams(token)) - count)
+                if similarity >= _FUZZY_THRESHOLD:
+                    scores[token] = _FUZZY_SCORE * similarity
+        return scores
+
+    def _match_substring(self, text: str) -> Set[str]:
+        """文件名中包含 text 的文件"""
+        if len(text) < 3:
+            return {file_id for file_id, doc in self._docs.items() if text in doc.name}
+        postings = sorted((self._name_trigrams.get(trigram, set()) for trigram in _trigrams(text)), key=len)
+        candidates = set.intersection(*postings) if postings else set()
+        return {file_id for file_id in candidates if text in self._docs[file_id].name}
+
+    def _match_word(self, word: str, mode: str, content: bool) -> Dict[str, float]:
+        """单个搜索词命中的文件及得分"""
+        scores: Dict[str, float] = {}
+
+        def add(file_ids: Iterable[str], score: float):
+            for file_id in file_ids:
+                if score > scores.get(file_id, 0):
+                    scores[file_id] = score
+
+        if mode != 'substring':
+            for token, score in self._match_tokens(word, fuzzy=mode in ('auto', 'fuzzy')).items():
+                add(self._token_files[token], score)
+        # 中文等不以空格分词的文字整段是一个单词，短搜索词也需要按子串匹配
+        if mode == 'substring' or mode == 'auto' and (len(word) >= 3 or not word.isascii()):
+            add(self._match_substring(word), _SUBSTRING_SCORE)
+        if content:
+            add(self._content_terms.get(word, ()), _CONTENT_SCORE)
+        return scores
+
+    def search(self, query: str, mode: str = 'auto', limit: int = 20, content: bool = False) -> Dict[str, Any]:
+        """
+        搜索文件名
+
+        :param mode: auto 综合前缀、子串与模糊匹配排序；prefix 只匹配单词前缀；
+                     substring 只匹配子串；fuzzy 匹配单词前缀与相似单词
+        :param content: 为 True 时也匹配已提取的文件内容
+        """
+        if mode not in SEARCH_MODES:
+            raise HTTPException(status_code=400, detail=f"不支持的搜索方式: {mode}，可选: {', '.join(SEARCH_MODES)}")
+        text = normalize(query).strip()
+        words = tokenize(text)
+        if not words:
+            raise HTTPException(status_code=400, detail="搜索词不能为空")
+
+        started = time.perf_counter()
+        with self._lock:
+            if mode == 'substring':
+                # 子串匹配按整个搜索词匹配，可以跨越单词边界
+                totals = {file_id: _SUBSTRING_SCORE for file_id in self._match_substring(text)}
+            else:
+                totals = None
+                for word in words:
+                    scores = self._match_word(word, mode, content)
+                    if totals is None:
+                        totals = scores
+                    else:
+                        # 每个搜索词都要命中
+                        totals = {file_id: totals[file_id] + score for file_id, score in scores.items()
+                                  if file_id in totals}
+                    if not totals:
+                        break
+                totals = {file_id: score / len(words) for file_id, score in (totals or {}).items()}
+
+            ranked = []
+            for file_id, score in totals.items():
+                doc = self._docs[file_id]
+                if doc.name == text:
+                    score += _FULL_NAME_BONUS
+                elif doc.name.startswith(text):
+                    score += _NAME_PREFIX_BONUS
+                ranked.append((-score, len(doc.name), doc.name, file_id))
+            ranked.sort()
+            files = [dict(self._docs[file_id].file, score=round(-score * 100, 1))
+                     for score, _, _, file_id in ranked[:limit]]
+            indexed_files = len(self._docs)
+
+        logger.info(f"搜索 '{query}' ({mode}) 命中 {len(ranked)} 个文件，"
+                    f"耗时 {(time.perf_counter() - started) * 1000:.1f} ms")
+        return {
+            'files': files,
+            'count': len(files),
+            'total': len(ranked),
+            'indexed_files': indexed_files,
+            'synced_at': self.synced_at,
+            'message': f'找到 {len(ranked)} 个匹配的文件'
+        }
+
+
+search_index = SearchIndex()
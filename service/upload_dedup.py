@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+上传去重
+按目标文件夹维护已有文件的 (大小, md5Checksum) 索引，上传前先按大小预筛，
+只有存在同样大小的文件时才需要在上传前计算 MD5
+"""
+
+import threading
+import time
+from typing import Optional, Dict, Any, List, IO, Tuple
+
+from common.logger import logger
+from service.drive_transfer import get_transfer_config, get_num_retries, md5_of_stream
+
+DEFAULT_DEDUP_INDEX_TTL = 300
+DEDUP_FILE_FIELDS = 'id,name,size,mimeType,createdTime,md5Checksum'
+
+
+def get_dedup_index_ttl() -> float:
+    """文件夹索引的有效期（秒），过期后重新列出文件夹"""
+    return float(get_transfer_config().get('dedup_index_ttl', DEFAULT_DEDUP_INDEX_TTL))
+
+
+class _FolderIndex:
+    def __init__(self, files: List[Dict[str, Any]]):
+        self.loaded_at = time.monotonic()
+        self.by_size: Dict[int, List[Dict[str, Any]]] = {}
+        for file_info in files:
+            self.add(file_info)
+
+    def add(self, file_info: Dict[str, Any]):
+        if file_info.get('size') is None or not file_info.get('md5Checksum'):
+            return
+        self.by_size.setdefault(int(file_info['size']), []).append(file_info)
+
+    def remove(self, file_id: str):
+        for candidates in self.by_size.values():
+            candidates[:] = [f for f in candidates if f['id'] != file_id]
+
+
+class FolderChecksumIndex:
+    """各文件夹已有文件的校验和索引，索引只是提示，命中后会向 Drive 确认文件仍然存在"""
+
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = get_dedup_index_ttl() if ttl is None else ttl
+        self._folders: Dict[str, _FolderIndex] = {}
+        self._lock = threading.Lock()
+
+    def _load(self, service, folder_id: str) -> _FolderIndex:
+        files = []
+        page_token = None
+        while True:
+            results = service.files().list(
+                q=f"'{folder_id}' in parents and trashed = false",
+                pageSize=1000,
+                pageToken=page_token,
+                fields=f"nextPageToken, files({DEDUP_FILE_FIELDS})"
+            ).execute(num_retries=get_num_retries())
+            files.extend(results.get('files', []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+        logger.info(f"已建立文件夹 {folder_id} 的去重索引，共 {len(files)} 个文件")
+        return _FolderIndex(files)
+
+    def _folder(self, service, folder_id: str) -> _FolderIndex:
+        with self._lock:
+            index = self._folders.get(folder_id)
+        if index is None or time.monotonic() - index.loaded_at > self.ttl:
+            index = self._load(service, folder_id)
+            with self._lock:
+                self._folders[folder_id] = index
+        return index
+
+    def find_duplicate(self, service, folder_id: str, fd: IO[bytes],
+                       size: int) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        查找文件夹中内容相同的文件，返回 (已有文件, fd 的 MD5)
+
+        没有同样大小的文件时不读取 fd，返回 (None, None)；否则计算 fd 的 MD5 比对，
+        未命中时调用方可直接复用返回的 MD5，不必在上传时再算一遍。
+        """
+        index = self._folder(service, folder_id)
+        with self._lock:
+            candidates = list(index.by_size.get(size, []))
+        if not candidates:
+            return None, None
+
+        md5 = md5_of_stream(fd)
+        for candidate in candidates:
+            if candidate['md5Checksum'] != md5:
+                continue
+            # 索引可能已过时，确认文件仍在该文件夹且未被删除
+            try:
+                current = service.files().get(
+                    fileId=candidate['id'], fields=f"{DEDUP_FILE_FIELDS},parents,trashed"
+                ).execute(num_retries=get_num_retries())
+            except Exception as e:
+                logger.warning(f"确认重复文件 {candidate['id']} 失败，已从索引移除: {e}")
+                current = None
+            # 'root' 是别名，返回的 parents 中是根目录的真实 ID
+            in_folder = folder_id == 'root' or folder_id in current.get('parents', []) if current else False
+            if in_folder and not current.get('trashed') and current.get('md5Checksum') == md5:
+                return current, md5
+            with self._lock:
+                index.remove(candidate['id'])
+        return None, md5
+
+    def add(self, folder_id: str, file_info: Dict[str, Any]):
+        """上传成功后把新文件加入已加载的索引"""
+        with self._lock:
+            index = self._folders.get(folder_id)
+            if index is not None:
+                index.add(file_info)
+
+
+folder_checksum_index = FolderChecksumIndex()
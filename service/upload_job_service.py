@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""
+异步上传任务队列
+请求只把文件落到本地暂存目录并在 SQLite 中登记任务，立即返回任务ID；
+后台工作线程按队列上传到 Drive，失败按指数退避重试，
+服务重启后从可续传会话已提交的位置继续上传
+"""
+
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List
+
+from fastapi import HTTPException, UploadFile
+from googleapiclient.errors import HttpError
+
+from common.logger import logger
+from service.drive_transfer import get_transfer_config, authorized_http, create_upload_session, \
+    query_upload_session, push_upload_session, get_stream_size
+from service.google_drive_service import google_drive_service
+from service.list_cache import list_cache
+from service.metadata_cache import DEFAULT_ACCOUNT
+
+DEFAULT_UPLOAD_JOB_DIR = 'data/upload_jobs'
+DEFAULT_UPLOAD_JOB_WORKERS = 2
+DEFAULT_UPLOAD_JOB_MAX_ATTEMPTS = 5
+DEFAULT_UPLOAD_JOB_RETRY_DELAY = 5
+DEFAULT_UPLOAD_JOB_MAX_AGE = 7 * 24 * 3600
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+
+# 空闲工作线程检查到期重试任务的间隔（秒）
+_IDLE_POLL_INTERVAL = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS upload_jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    mime_type TEXT,
+    file_metadata TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    bytes_uploaded INTEGER NOT NULL DEFAULT 0,
+    session_uri TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    error TEXT,
+    result TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_upload_jobs_queue ON upload_jobs (status, next_attempt_at);
+"""
+
+
+def get_upload_job_dir() -> str:
+    """上传任务数据库与暂存文件的存放目录"""
+    return get_transfer_config().get('upload_job_dir', DEFAULT_UPLOAD_JOB_DIR)
+
+
+def get_upload_job_workers() -> int:
+    """同时执行上传任务的工作线程数"""
+    return max(1, int(get_transfer_config().get('upload_job_workers', DEFAULT_UPLOAD_JOB_WORKERS)))
+
+
+def get_upload_job_max_attempts() -> int:
+    """单个任务最多尝试的次数，超过后标记为失败"""
+    return max(1, int(get_transfer_config().get('upload_job_max_attempts', DEFAULT_UPLOAD_JOB_MAX_ATTEMPTS)))
+
+
+def get_upload_job_retry_delay() -> float:
+    """首次重试前的等待时间（秒），之后每次翻倍"""
+    return float(get_transfer_config().get('upload_job_retry_delay', DEFAULT_UPLOAD_JOB_RETRY_DELAY))
+
+
+def get_upload_job_max_age() -> int:
+    """已结束任务记录的保留时间（秒）"""
+    return int(get_transfer_config().get('upload_job_max_age', DEFAULT_UPLOAD_JOB_MAX_AGE))
+
+
+class UploadJobService:
+    """持久化的上传任务队列，任务状态保存在 <dir>/jobs.db，文件暂存在 <dir>/staging"""
+
+    def __init__(self, job_dir: Optional[str] = None):
+        self.job_dir = job_dir or get_upload_job_dir()
+        self._db_path = os.path.join(self.job_dir, 'jobs.db')
+        self._staging_dir = os.path.join(self.job_dir, 'staging')
+        # 认领任务需要先查后改，同一进程内串行执行
+        self._claim_lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+        self._workers: List[threading.Thread] = []
+        os.makedirs(self._staging_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+        self._recover()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self._db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _staging_path(self, job_id: str) -> str:
+        return os.path.join(self._staging_dir, job_id)
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _recover(self):
+        """上次退出时仍在执行的任务重新排队，保留会话地址以便续传；清理没有任务记录的暂存文件"""
+        with self._connect() as conn:
+            recovered = conn.execute(
+                "UPDATE upload_jobs SET status = ?, next_attempt_at = ? WHERE status = ?",
+                (JOB_PENDING, time.time(), JOB_RUNNING)
+            ).rowcount
+            active = {row['job_id'] for row in conn.execute(
+                "SELECT job_id FROM upload_jobs WHERE status IN (?, ?)", (JOB_PENDING, JOB_RUNNING)
+            )}
+        for entry in os.listdir(self._staging_dir):
+            if entry not in active:
+                self._remove_file(os.path.join(self._staging_dir, entry))
+        logger.info(f"上传任务队列已加载，待执行 {len(active)} 个，其中 {recovered} 个为中断后恢复")
+
+    def start(self):
+        """启动工作线程"""
+        self._stopping.clear()
+        for index in range(get_upload_job_workers()):
+            worker = threading.Thread(target=self._work, name=f'upload-job-{index}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self):
+        """通知工作线程退出，正在上传的任务在当前分块完成后退回队列，下次启动时续传；进程被强制终止时由 _recover 恢复"""
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        self._workers.clear()
+
+    def create_job(self, file: UploadFile, parent_folder_id: Optional[str] = None) -> Dict[str, Any]:
+        """把上传文件落盘并登记任务"""
+        # 父文件夹校验在登记前完成，服务账号未配置文件夹时直接返回 400
+        file_metadata = google_drive_service._build_file_metadata(file.filename, parent_folder_id)
+        job_id = uuid.uuid4().hex
+        staging_path = self._staging_path(job_id)
+        tmp_path = f"{staging_path}.tmp"
+        try:
+            file.file.seek(0)
+            with open(tmp_path, 'wb') as f:
+                shutil.copyfileobj(file.file, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, staging_path)
+            size = os.path.getsize(staging_path)
+
+            now = time.time()
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT INTO upload_jobs (job_id, status, file_name, mime_type, file_metadata, size, "
+                    "next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, JOB_PENDING, file.filename, file.content_type,
+                     json.dumps(file_metadata, ensure_ascii=False), size, now, now)
+                )
+        except Exception:
+            self._remove_file(tmp_path)
+            self._remove_file(staging_path)
+            raise
+
+        with self._wakeup:
+            self._wakeup.notify()
+        logger.info(f"已创建上传任务 {job_id}: {file.filename} ({size} 字节)")
+        return self.get_job(job_id)
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        """取出一个到期的待执行任务并标记为 running"""
+        with self._claim_lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM upload_jobs WHERE status = ? AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT 1", (JOB_PENDING, time.time())
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE upload_jobs SET status = ?, attempts = attempts + 1, started_at = COALESCE(started_at, ?) "
+                "WHERE job_id = ?", (JOB_RUNNING, time.time(), row['job_id'])
+            )
+        job = dict(row)
+        job['attempts'] += 1
+        return job
+
+    def _update(self, job_id: str, **fields):
+        assignments = ', '.join(f"{key} = ?" for key in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE upload_jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+
+    def _idle_timeout(self) -> float:
+        """空闲时等到最近一个待重试任务到期，最长 _IDLE_POLL_INTERVAL 秒"""
+        try:
+            with self._connect() as conn:
+                next_attempt_at = conn.execute(
+                    "SELECT MIN(next_attempt_at) FROM upload_jobs WHERE status = ?", (JOB_PENDING,)
+                ).fetchone()[0]
+        except sqlite3.Error:
+            return _IDLE_POLL_INTERVAL
+        if next_attempt_at is None:
+            return _IDLE_POLL_INTERVAL
+        return min(_IDLE_POLL_INTERVAL, max(0.0, next_attempt_at - time.time()))
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                job = self._claim()
+            except Exception as e:
+                logger.error(f"读取上传任务队列失败: {e}")
+                job = None
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(self._idle_timeout())
+                continue
+            self._run_job(job)
+
+    def _run_job(self, job: Dict[str, Any]):
+        job_id = job['job_id']
+        try:
+            uploaded_file = self._upload(job)
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            if self._stopping.is_set():
+                # 服务关闭打断的上传不计入尝试次数，下次启动后立即续传
+                self._update(job_id, status=JOB_PENDING, attempts=job['attempts'] - 1, next_attempt_at=time.time())
+            elif job['attempts'] >= get_upload_job_max_attempts():
+                logger.error(f"上传任务 {job_id} 失败，已达到最大尝试次数: {detail}")
+                self._remove_file(self._staging_path(job_id))
+                self._update(job_id, status=JOB_FAILED, error=detail, finished_at=time.time())
+            else:
+                delay = get_upload_job_retry_delay() * 2 ** (job['attempts'] - 1)
+                logger.warning(f"上传任务 {job_id} 第 {job['attempts']} 次尝试失败，{delay:.0f} 秒后重试: {detail}")
+                self._update(job_id, status=JOB_PENDING, error=detail, next_attempt_at=time.time() + delay)
+            return
+
+        self._remove_file(self._staging_path(job_id))
+        list_cache.invalidate_parent(DEFAULT_ACCOUNT, json.loads(job['file_metadata']).get('parents', [None])[0])
+        self._update(job_id, status=JOB_COMPLETED, bytes_uploaded=job['size'], error=None,
+                     result=json.dumps(google_drive_service._upload_result(uploaded_file), ensure_ascii=False),
+                     finished_at=time.time())
+        logger.info(f"上传任务 {job_id} 完成: {uploaded_file.get('name')} (ID: {uploaded_file.get('id')})")
+
+    def _upload(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """已有会话时先查询 Drive 已提交的字节数，从该位置续传；会话失效则重新创建"""
+        job_id = job['job_id']
+        session_uri = job['session_uri']
+        offset = 0
+        if session_uri:
+            try:
+                status = query_upload_session(session_uri, job['size'])
+            except HttpError as e:
+                if e.resp.status not in (404, 410):
+                    raise
+                logger.warning(f"上传任务 {job_id} 的会话已失效，重新上传")
+                session_uri = None
+            else:
+                if status['complete']:
+                    return status['file']
+                offset = status['committed_bytes']
+                logger.info(f"上传任务 {job_id} 从第 {offset} 字节继续上传")
+
+        if not session_uri:
+            file_metadata = json.loads(job['file_metadata'])
+            session_uri = create_upload_session(authorized_http(google_drive_service.credentials), file_metadata,
+                                                job['mime_type'], job['size'])
+            # 会话地址先落库，进程在上传中途退出时据此续传
+            self._update(job_id, session_uri=session_uri, bytes_uploaded=0)
+
+        def on_progress(committed: int):
+            self._update(job_id, bytes_uploaded=committed)
+            if self._stopping.is_set():
+                raise InterruptedError('服务正在关闭')
+
+        with open(self._staging_path(job_id), 'rb') as f:
+            if get_stream_size(f) != job['size']:
+                raise RuntimeError('暂存文件大小与任务记录不一致')
+            return push_upload_session(session_uri, f, job['size'], offset, on_progress=on_progress)
+
+    @staticmethod
+    def _public(row: Dict[str, Any]) -> Dict[str, Any]:
+        job = {key: row[key] for key in ('job_id', 'status', 'file_name', 'size', 'bytes_uploaded',
+                                         'attempts', 'error', 'created_at', 'started_at', 'finished_at')}
+        job['progress'] = round(row['bytes_uploaded'] / row['size'] * 100, 1) if row['size'] else \
+            (100.0 if row['status'] == JOB_COMPLETED else 0.0)
+        job['data'] = json.loads(row['result']) if row['result'] else None
+        return job
+
+    def get_job(self, job_id: str) -> Dict[str, Any]:
+        """查询任务状态与进度"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM upload_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise HTTPException(status_code=404, detail="上传任务不存在")
+        return self._public(dict(row))
+
+    def list_jobs(self, status: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """按创建时间倒序列出任务"""
+        sql = "SELECT * FROM upload_jobs"
+        params: list = []
+        if status:
+            sql += " WHERE status = ?"
+            params.append(status)
+        sql += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        with self._connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [self._public(dict(row)) for row in rows]
+
+    def purge_finished_jobs(self):
+        """删除超过保留时间的已结束任务记录"""
+        with self._connect() as conn:
+            purged = conn.execute(
+                "DELETE FROM upload_jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (JOB_COMPLETED, JOB_FAILED, time.time() - get_upload_job_max_age())
+            ).rowcount
+        if purged:
+            logger.info(f"已清理 {purged} 条过期的上传任务记录")
+
+
+upload_job_service = UploadJobService()
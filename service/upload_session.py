@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+客户端直传 Drive 的上传会话确认
+单一账户与多用户服务共用
+"""
+
+from typing import Optional, Dict, Any
+
+from fastapi import HTTPException
+from googleapiclient.errors import HttpError
+
+from common.logger import logger
+from service.drive_transfer import is_upload_session_uri, query_upload_session
+
+
+def confirm_upload_session(session_uri: str, size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    查询会话状态确认直传结果
+
+    :param session_uri: 创建会话时返回的地址
+    :param size: 文件总大小，已知时一并校验
+    """
+    if not is_upload_session_uri(session_uri):
+        raise HTTPException(status_code=400, detail="session_uri 不是有效的 Drive 上传会话地址")
+    try:
+        status = query_upload_session(session_uri, size)
+    except HttpError as e:
+        # 会话过期（约一周）或已被取消
+        if e.resp.status in (404, 410):
+            raise HTTPException(status_code=410, detail="上传会话已失效，请重新创建")
+        logger.error(f"查询上传会话失败: {e}")
+        raise HTTPException(status_code=502, detail=f"查询上传会话失败: {str(e)}")
+
+    if not status['complete']:
+        logger.info(f"上传会话尚未完成，已提交 {status['committed_bytes']} 字节")
+        return {
+            'status': 'incomplete',
+            'committed_bytes': status['committed_bytes'],
+            'message': '文件尚未上传完成，可从 committed_bytes 处继续上传'
+        }
+
+    uploaded_file = status['file']
+    logger.info(f"直传文件上传成功: {uploaded_file.get('name')} (ID: {uploaded_file.get('id')})")
+    return {
+        'status': 'complete',
+        'file_id': uploaded_file.get('id'),
+        'name': uploaded_file.get('name'),
+        'size': uploaded_file.get('size'),
+        'mime_type': uploaded_file.get('mimeType'),
+        'created_time': uploaded_file.get('createdTime'),
+        'message': '文件上传成功'
+    }
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+从 URL 拉取文件上传到 Drive
+远程内容以 httpx 流式读取，凑满一个分块就写入 Drive 可续传会话，
+内存中最多保留一个未提交的分块；源站断开时用 Range 从已接收位置继续，
+Drive 写入失败时查询会话已提交的位置后重发。
+源站地址及每一跳重定向都先解析并校验，拒绝内网、回环、链路本地等非公网地址，连接固定到校验过的地址
+"""
+
+import asyncio
+import ipaddress
+import os
+import random
+import re
+import socket
+from typing import Optional, Dict, Any, Tuple, List
+from urllib.parse import urlparse, unquote, urljoin
+
+import httplib2
+import httpx
+from fastapi import HTTPException
+from googleapiclient.errors import HttpError
+from googleapiclient.http import build_http
+
+from common.logger import logger
+from common.utils import DOWNLOAD_HEADERS, guess_extension, media_type_of
+from service.drive_transfer import get_transfer_config, get_num_retries, get_upload_chunk_size, \
+    authorized_http, create_upload_session, put_session_chunk, query_upload_session, RETRYABLE_STATUS
+
+DEFAULT_URL_UPLOAD_TIMEOUT = 300
+DEFAULT_URL_UPLOAD_MAX_REDIRECTS = 5
+
+
+def get_url_upload_timeout() -> float:
+    """从源站读取数据的超时时间（秒）"""
+    return float(get_transfer_config().get('url_upload_timeout', DEFAULT_URL_UPLOAD_TIMEOUT))
+
+
+def get_url_upload_max_redirects() -> int:
+    """拉取源站时最多跟随的重定向次数"""
+    return int(get_transfer_config().get('url_upload_max_redirects', DEFAULT_URL_UPLOAD_MAX_REDIRECTS))
+
+
+def get_url_upload_allow_private() -> bool:
+    """是否允许拉取内网等非公网地址，默认不允许"""
+    return bool(get_transfer_config().get('url_upload_allow_private', False))
+
+
+class SourceChangedError(Exception):
+    """续传时源站内容已变化或不支持 Range，已上传的部分无法拼接"""
+
+
+def _file_name_from_response(url: str, response: httpx.Response) -> Optional[str]:
+    """优先取 Content-Disposition 中的文件名，其次取 URL（重定向后的地址）路径的最后一段"""
+    disposition = response.headers.get('Content-Disposition', '')
+    match = re.search(r"filename\*=UTF-8''([^;]+)", disposition, re.IGNORECASE) \
+        or re.search(r'filename="?([^";]+)"?', disposition, re.IGNORECASE)
+    if match:
+        return os.path.basename(unquote(match.group(1).strip()))
+    return os.path.basename(unquote(urlparse(url).path)) or None
+
+
+def _total_size(response: httpx.Response) -> Optional[int]:
+    """源文件总大小，未给出 Content-Length 时视为未知"""
+    length = response.headers.get('Content-Length')
+    return int(length) if length and length.isdigit() else None
+
+
+class _DriveSessionWriter:
+    """
+    把任意长度的数据流写入 Drive 可续传会话
+
+    数据攒到一个分块（256 KiB 整数倍）才发送，Drive 未确认的部分保留在缓冲区中重发。
+    """
+
+    def __init__(self, session_uri: str, total: Optional[int]):
+        self.session_uri = session_uri
+        self.total = total
+        self.committed = 0
+        self.file: Optional[Dict[str, Any]] = None
+        self._buffer = bytearray()
+        self._chunk_size = get_upload_chunk_size()
+        self._http = build_http()
+
+    @property
+    def received(self) -> int:
+        return self.committed + len(self._buffer)
+
+    async def write(self, data: bytes):
+        self._buffer += data
+        while len(self._buffer) >= self._chunk_size:
+            await self._send(self._chunk_size, None)
+
+    async def close(self) -> Dict[str, Any]:
+        """发送剩余数据并给出总大小，返回 Drive 文件元数据"""
+        total = self.received
+        await self._send(len(self._buffer), total)
+        while self.file is None:
+            if not self._buffer:
+                raise RuntimeError(f"上传会话未完成，Drive 已确认全部 {total} 字节")
+            await self._send(len(self._buffer), total)
+        return self.file
+
+    async def _send(self, length: int, total: Optional[int]):
+        num_retries = get_num_retries()
+        for attempt in range(num_retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(random.random() * 2 ** attempt)
+            try:
+                status = await asyncio.to_thread(put_session_chunk, self._http, self.session_uri,
+                                                 bytes(self._buffer[:length]), self.committed, total)
+            except (OSError, httplib2.HttpLib2Error, HttpError) as e:
+                if isinstance(e, HttpError) and e.resp.status not in RETRYABLE_STATUS or attempt == num_retries:
+                    raise
+                logger.warning(f"写入上传会话失败，准备重试 ({attempt + 1}/{num_retries}): {e}")
+                try:
+                    # 连接中断时不确定 Drive 收到了多少，以会话记录的已提交位置为准
+                    status = await asyncio.to_thread(query_upload_session, self.session_uri, total, self._http)
+                except (OSError, httplib2.HttpLib2Error, HttpError) as query_error:
+                    logger.warning(f"查询上传会话失败: {query_error}")
+                    continue
+                self._advance(status)
+                continue
+            self._advance(status)
+            return
+
+    def _advance(self, status: Dict[str, Any]):
+        if status['complete']:
+            self.file = status['file']
+            self._buffer.clear()
+            return
+        committed = status['committed_bytes']
+        if committed < self.committed or committed > self.received:
+            raise RuntimeError(f"上传会话已提交位置异常: {committed}")
+        del self._buffer[:committed - self.committed]
+        self.committed = committed
+
+
+async def _resolve_addresses(host: str, port: int) -> List[str]:
+    """解析主机名得到的全部地址"""
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return [info[4][0] for info in infos]
+
+
+def _is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    return ip.is_global and not ip.is_multicast
+
+
+async def _pinned_request(client: httpx.AsyncClient, url: str, headers: Dict[str, str]) -> httpx.Request:
+    """
+    构造直连校验过地址的请求
+
+    主机名解析出的任一地址不是公网地址时拒绝，避免借助多个解析结果绕过校验；
+    请求发往解析出的 IP，Host 头与 TLS SNI 仍使用原主机名，连接时不会再次解析。
+    """
+    target = httpx.URL(url)
+    if target.scheme not in ('http', 'https') or not target.host:
+        raise HTTPException(status_code=400, detail="只支持 http/https 地址")
+    port = target.port or (443 if target.scheme == 'https' else 80)
+    try:
+        addresses = await _resolve_addresses(target.host, port)
+    except (OSError, UnicodeError) as e:
+        raise HTTPException(status_code=502, detail=f"无法解析源站地址 {target.host}: {e}")
+    if not addresses:
+        raise HTTPException(status_code=502, detail=f"无法解析源站地址 {target.host}")
+    if not get_url_upload_allow_private() and not all(_is_public_address(address) for address in addresses):
+        raise HTTPException(status_code=400, detail=f"不允许访问非公网地址: {target.host}")
+    headers = dict(headers, Host=target.netloc.decode('ascii'))
+    return client.build_request('GET', target.copy_with(host=addresses[0]), headers=headers,
+                                extensions={'sni_hostname': target.host})
+
+
+async def _send_guarded(client: httpx.AsyncClient, url: str,
+                        headers: Dict[str, str]) -> Tuple[httpx.Response, str]:
+    """逐跳跟随重定向并校验每一跳的地址，返回 (响应, 最终地址)"""
+    for _ in range(get_url_upload_max_redirects() + 1):
+        response = await client.send(await _pinned_request(client, url, headers), stream=True)
+        location = response.headers.get('Location')
+        if not (response.is_redirect and location):
+            return response, url
+        await response.aclose()
+        url = urljoin(url, location)
+    raise HTTPException(status_code=502, detail="源站重定向次数过多")
+
+
+async def _open_source(client: httpx.AsyncClient, url: str, offset: int = 0,
+                       validator: Optional[str] = None) -> Tuple[httpx.Response, str]:
+    """
+    请求源站，offset 大于 0 时带 Range 从该位置续传，并用 If-Range 确保内容未变
+
+    只接受未压缩编码的内容：压缩后的字节既不是文件内容，也无法按文件偏移续传。
+    :return: (响应, 重定向后的最终地址)
+    """
+    headers = dict(DOWNLOAD_HEADERS, **{'Accept-Encoding': 'identity'})
+    if offset:
+        headers['Range'] = f'bytes={offset}-'
+        if validator:
+            headers['If-Range'] = validator
+    response, url = await _send_guarded(client, url, headers)
+    try:
+        response.raise_for_status()
+        encoding = response.headers.get('Content-Encoding', 'identity').strip().lower()
+        if encoding not in ('', 'identity'):
+            raise HTTPException(status_code=502, detail=f"源站返回了压缩编码的内容（{encoding}），无法上传")
+        if offset:
+            content_range = response.headers.get('Content-Range', '')
+            if response.status_code != 206 or not content_range.startswith(f'bytes {offset}-'):
+                raise SourceChangedError('源站不支持从断点续传或内容已变化')
+    except Exception:
+        await response.aclose()
+        raise
+    return response, url
+
+
+async def upload_from_url(credentials, url: str, file_metadata: Dict[str, Any]) -> Tuple[Dict[str, Any], str]:
+    """
+    拉取 URL 内容并上传到 Drive
+
+    :param file_metadata: Drive 文件元数据，未给出 name 时按响应头或 URL 推断
+    :return: (Drive 文件元数据, 源站 Content-Type)
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.netloc:
+        raise HTTPException(status_code=400, detail="只支持 http/https 地址")
+
+    num_retries = get_num_retries()
+    timeout = httpx.Timeout(get_url_upload_timeout(), connect=30)
+    # 重定向由 _send_guarded 逐跳校验后跟随
+    async with httpx.AsyncClient(follow_redirects=False, timeout=timeout) as client:
+        try:
+            response, final_url = await _open_source(client, url)
+        except httpx.HTTPStatusError as e:
+            raise HTTPException(status_code=502, detail=f"源站返回 {e.response.status_code}")
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=502, detail=f"无法访问源站: {e}")
+
+        content_type = response.headers.get('Content-Type') or 'application/octet-stream'
+        total = _total_size(response)
+        # 只有强校验器才能用于 If-Range
+        etag = response.headers.get('ETag')
+        validator = etag if etag and not etag.startswith('W/') else response.headers.get('Last-Modified')
+
+        file_metadata = dict(file_metadata)
+        if not file_metadata.get('name'):
+            name = _file_name_from_response(final_url, response) or 'download'
+            file_metadata['name'] = name if os.path.splitext(name)[1] else name + guess_extension(content_type)
+
+        try:
+            session_uri = await asyncio.to_thread(create_upload_session, authorized_http(credentials),
+                                                  file_metadata, media_type_of(content_type), total)
+        except BaseException:
+            await response.aclose()
+            raise
+        writer = _DriveSessionWriter(session_uri, total)
+        logger.info(f"开始从 URL 上传: {url} -> {file_metadata['name']} (大小: {total or '未知'})")
+
+        attempt = 0
+        try:
+            while True:
+                try:
+                    if response is None:
+                        response, _ = await _open_source(client, url, writer.received, validator)
+                    async for data in response.aiter_raw():
+                        await writer.write(data)
+                    break
+                except SourceChangedError as e:
+                    raise HTTPException(status_code=502, detail=str(e))
+                except (httpx.HTTPError, httpx.StreamError) as e:
+                    if response is not None:
+                        await response.aclose()
+                        response = None
+                    attempt += 1
+                    if attempt > num_retries:
+                        raise HTTPException(status_code=502, detail=f"从源站读取数据失败: {e}")
+                    logger.warning(f"源站连接中断，从第 {writer.received} 字节续传 ({attempt}/{num_retries}): {e}")
+                    await asyncio.sleep(random.random() * 2 ** attempt)
+        finally:
+            if response is not None:
+                await response.aclose()
+
+        if total is not None and writer.received != total:
+            raise HTTPException(status_code=502, detail=f"源站数据不完整: {writer.received}/{total} 字节")
+        uploaded_file = await writer.close()
+    logger.info(f"从 URL 上传完成: {uploaded_file.get('name')} (ID: {uploaded_file.get('id')})")
+    return uploaded_file, content_type
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+测试公共夹具
+测试完全离线运行，Drive 请求由 StubHttp 交给各测试提供的处理函数应答。
+测试使用仓库自带的 config/config.yaml，运行期数据目录与数据库改到临时目录，
+并写入一个未过期的假 OAuth 令牌，使全局服务实例在导入时无需联网即可初始化
+"""
+
+import atexit
+import json
+import os
+import shutil
+import tempfile
+
+os.environ.setdefault('SVC_ENV', 'config')
+
+import pytest
+from googleapiclient.discovery import build
+
+from common.config_loader import GLOBAL_CONFIG
+from tests.drive_stub import StubHttp
+
+_RUNTIME_DIR = tempfile.mkdtemp(prefix='google-drive-helper-tests-')
+atexit.register(shutil.rmtree, _RUNTIME_DIR, True)
+
+_TOKEN_PATH = os.path.join(_RUNTIME_DIR, 'token.json')
+with open(_TOKEN_PATH, 'w', encoding='utf-8') as f:
+    json.dump({'token': 'test', 'refresh_token': 'test', 'client_id': 'test', 'client_secret': 'test',
+               'token_uri': 'https://oauth2.googleapis.com/token', 'expiry': '2099-01-01T00:00:00Z'}, f)
+
+GLOBAL_CONFIG.setdefault('google_drive', {}).update({
+    'auth_method': 'oauth',
+    'token_path': _TOKEN_PATH,
+    'archive_job_dir': os.path.join(_RUNTIME_DIR, 'archive_jobs'),
+    'download_cache_dir': os.path.join(_RUNTIME_DIR, 'download_cache'),
+    'upload_job_dir': os.path.join(_RUNTIME_DIR, 'upload_jobs'),
+    'idempotency_db_path': os.path.join(_RUNTIME_DIR, 'idempotency.db'),
+})
+GLOBAL_CONFIG['sqlalchemy'] = {'url': f"sqlite:///{os.path.join(_RUNTIME_DIR, 'local.db')}"}
+
+
+@pytest.fixture
+def transfer_config(monkeypatch):
+    """临时修改 google_drive 配置，测试结束后恢复"""
+    section = GLOBAL_CONFIG.setdefault('google_drive', {})
+
+    def set_config(**values):
+        for key, value in values.items():
+            monkeypatch.setitem(section, key, value)
+
+    return set_config
+
+
+@pytest.fixture
+def drive_service():
+    """用 StubHttp 构建离线的 Drive 服务对象，返回 (service, http)"""
+    def make(handler):
+        http = StubHttp(handler)
+        return build('drive', 'v3', http=http, static_discovery=True), http
+
+    return make
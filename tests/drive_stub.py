@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+离线 Drive 桩
+替代 httplib2.Http，配合 build('drive', 'v3', http=...) 在测试中模拟 Drive API
+"""
+
+import json
+
+import httplib2
+
+
+class StubHttp:
+    """
+    替代 httplib2.Http，记录每个请求
+
+    handler(method, uri, headers, body) 返回 (状态码, 响应体, 响应头)，响应体为 dict/list 时按 JSON 编码
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = []
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        if hasattr(body, 'read'):
+            body = body.read()
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.requests.append((method, uri, headers, body))
+        status, content, response_headers = self.handler(method, uri, headers, body)
+        if isinstance(content, (dict, list)):
+            content = json.dumps(content).encode('utf-8')
+        return httplib2.Response(dict({'status': str(status)}, **(response_headers or {}))), content
+
+
+def media_handler(content: bytes, ignore_range: bool = False):
+    """按 Range 请求头返回 content 对应区间的处理函数，模拟 files.get_media"""
+    def handle(method, uri, headers, body):
+        range_header = headers.get('range')
+        if not range_header or ignore_range:
+            return 200, content, None
+        start, _, end = range_header.split('=', 1)[1].partition('-')
+        start, end = int(start), min(int(end) if end else len(content) - 1, len(content) - 1)
+        if start >= len(content):
+            return 416, b'', {'content-range': f'bytes */{len(content)}'}
+        return 206, content[start:end + 1], {'content-range': f'bytes {start}-{end}/{len(content)}'}
+
+    return handle
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""归档成员并发预取：乱序完成时仍按输入顺序输出，单个成员失败不影响其他成员"""
+
+import os
+import random
+import time
+from urllib.parse import urlparse
+
+import pytest
+
+import service.archive_fetcher as archive_fetcher
+from service.archive_fetcher import ArchiveMemberFetcher
+from tests.drive_stub import StubHttp, media_handler
+
+CONTENTS = {f'f{index}': os.urandom(random.randint(0, 5000)) for index in range(12)}
+
+
+def handle(method, uri, headers, body):
+    file_id = urlparse(uri).path.rsplit('/', 1)[-1]
+    if file_id == 'missing':
+        return 404, {'error': {'code': 404, 'message': 'not found'}}, None
+    # 前面的成员更慢，迫使后面的成员先下载完成
+    time.sleep(0.02 * (12 - int(file_id[1:])) / 12)
+    return media_handler(CONTENTS[file_id])(method, uri, headers, body)
+
+
+@pytest.fixture
+def fetcher(drive_service, transfer_config, monkeypatch):
+    transfer_config(download_chunk_size=1000, num_retries=0)
+    service, _ = drive_service(handle)
+    monkeypatch.setattr(archive_fetcher, 'authorized_http', lambda credentials: StubHttp(handle))
+
+    def make(**kwargs):
+        return ArchiveMemberFetcher(service, None, **kwargs)
+
+    return make
+
+
+def test_members_are_emitted_in_input_order(fetcher):
+    files = [{'id': file_id} for file_id in CONTENTS]
+    results = [(member.file_info['id'], b''.join(member.chunks()))
+               for member in fetcher(concurrency=4).fetch(files)]
+    assert results == list(CONTENTS.items())
+
+
+def test_small_prefetch_budget_does_not_deadlock(fetcher):
+    files = [{'id': file_id} for file_id in CONTENTS]
+    members = fetcher(concurrency=4, prefetch_bytes=1500).fetch(files)
+    assert [b''.join(member.chunks()) for member in members] == list(CONTENTS.values())
+
+
+def test_failed_member_is_reported_and_others_continue(fetcher):
+    files = [{'id': 'f0'}, {'id': 'missing'}, {'id': 'f1'}]
+    members = [(member.file_info['id'], member.error, member.error or b''.join(member.chunks()))
+               for member in fetcher(concurrency=2).fetch(files)]
+    assert members[0] == ('f0', None, CONTENTS['f0'])
+    assert members[1][0] == 'missing' and members[1][1] is not None
+    assert members[2] == ('f1', None, CONTENTS['f1'])
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""后台归档任务：独立执行器调度、产物落盘与失败处理"""
+
+import os
+
+import pytest
+from fastapi import HTTPException
+
+from common.scheduler import scheduler
+from service.archive_job_service import ArchiveJobService, ARCHIVE_JOB_EXECUTOR, JOB_COMPLETED, JOB_FAILED
+from service.google_drive_service import google_drive_service
+
+
+class StubWriter:
+    extension = 'zip'
+    media_type = 'application/zip'
+
+
+@pytest.fixture
+def jobs(tmp_path):
+    service = ArchiveJobService(job_dir=str(tmp_path))
+    yield service
+    for job_id in list(service._jobs):
+        if scheduler.get_job(f"archive-job-{job_id}"):
+            scheduler.remove_job(f"archive-job-{job_id}")
+
+
+def test_jobs_run_on_dedicated_executor(jobs):
+    job = jobs.create_job(query="name contains 'report'")
+    scheduled = scheduler.get_job(f"archive-job-{job['job_id']}")
+    assert scheduled.executor == ARCHIVE_JOB_EXECUTOR
+    assert job['status'] == 'pending'
+
+
+def test_create_job_rejects_unknown_format(jobs):
+    with pytest.raises(HTTPException) as error:
+        jobs.create_job(archive_format='rar')
+    assert error.value.status_code == 400
+
+
+def test_run_job_writes_artifact(jobs, monkeypatch):
+    def open_archive(query, compression_level, archive_format, folder_id, on_member):
+        def archive():
+            for name in ('a.txt', 'b.txt'):
+                yield name.encode()
+                on_member(name)
+        return StubWriter(), archive()
+
+    monkeypatch.setattr(google_drive_service, 'open_archive', open_archive)
+    job_id = jobs.create_job()['job_id']
+    jobs._run_job(job_id)
+
+    job = jobs.get_job(job_id)
+    assert job['status'] == JOB_COMPLETED
+    assert job['files_added'] == 2 and job['size'] == len(b'a.txtb.txt')
+    response = jobs.get_artifact_response(job_id)
+    with open(response.path, 'rb') as f:
+        assert f.read() == b'a.txtb.txt'
+
+
+def test_failed_job_removes_partial_artifact(jobs, monkeypatch):
+    def open_archive(*args, **kwargs):
+        def archive():
+            yield b'partial'
+            raise IOError('drive went away')
+        return StubWriter(), archive()
+
+    monkeypatch.setattr(google_drive_service, 'open_archive', open_archive)
+    job_id = jobs.create_job()['job_id']
+    jobs._run_job(job_id)
+
+    job = jobs.get_job(job_id)
+    assert job['status'] == JOB_FAILED and 'drive went away' in job['error']
+    assert [entry for entry in os.listdir(jobs.job_dir) if not entry.endswith('.json')] == []
+    with pytest.raises(HTTPException) as error:
+        jobs.get_artifact_response(job_id)
+    assert error.value.status_code == 409
+
+
+def test_unfinished_jobs_fail_after_restart(jobs):
+    job_id = jobs.create_job()['job_id']
+    restarted = ArchiveJobService(job_dir=jobs.job_dir)
+    assert restarted.get_job(job_id)['status'] == JOB_FAILED
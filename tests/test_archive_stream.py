@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""流式归档写入器：输出的归档能被标准库完整读回"""
+
+import calendar
+import io
+import os
+import tarfile
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytest
+import zstandard
+
+from common.archive_stream import ZipStreamWriter, create_archive_writer, deflate_block, is_compressed_mime_type
+
+
+def build_archive(writer, members):
+    """members 为 (名称, 内容, 声明的大小) 列表，内容按 1000 字节分块写入"""
+    output = io.BytesIO()
+    for name, content, size in members:
+        chunks = (content[i:i + 1000] for i in range(0, len(content), 1000))
+        for data in writer.add_member(name, chunks, datetime(2025, 1, 2, 3, 4, 6), size):
+            output.write(data)
+    for data in writer.close():
+        output.write(data)
+    return output.getvalue()
+
+
+MEMBERS = [
+    ('a.txt', b'hello world\n' * 500, 6000),
+    ('目录/中文.bin', os.urandom(3000), 3000),
+    ('empty.txt', b'', 0),
+]
+
+
+@pytest.mark.parametrize('compression', [zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED])
+def test_zip_round_trip(compression):
+    data = build_archive(ZipStreamWriter(compression=compression), MEMBERS)
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == [name for name, _, _ in MEMBERS]
+        for name, content, _ in MEMBERS:
+            assert archive.read(name) == content
+            info = archive.getinfo(name)
+            assert info.compress_type == compression
+            assert info.date_time == (2025, 1, 2, 3, 4, 6)
+
+
+def test_zip_emits_header_before_reading_member():
+    consumed = []
+
+    def chunks():
+        for index in range(3):
+            consumed.append(index)
+            yield b'x' * 10
+
+    member = ZipStreamWriter().add_member('a.txt', chunks(), size=30)
+    assert next(member).startswith(b'PK\x03\x04')
+    assert consumed == []
+
+
+def test_deflate_blocks_concatenate_into_valid_stream():
+    blocks = [os.urandom(100) + b'a' * 5000, b'b' * 3000, os.urandom(10)]
+    stream = b''.join(deflate_block(block, 6) for block in blocks) + \
+        zlib.compressobj(0, zlib.DEFLATED, -zlib.MAX_WBITS).flush(zlib.Z_FINISH)
+    assert zlib.decompress(stream, -zlib.MAX_WBITS) == b''.join(blocks)
+
+
+def test_zip_parallel_deflate_matches_serial_content():
+    members = [('a.txt', b'hello world\n' * 5000, 60000), ('b.bin', os.urandom(7000), 7000)]
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        data = build_archive(ZipStreamWriter(executor=executor, max_pending=2), members)
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        for name, content, _ in members:
+            assert archive.read(name) == content
+            assert archive.getinfo(name).compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_zip_member_compression_override():
+    writer = ZipStreamWriter()
+    output = b''.join(writer.add_member('photo.jpg', [b'x' * 100], size=100, compression=zipfile.ZIP_STORED))
+    output += b''.join(writer.close())
+    with zipfile.ZipFile(io.BytesIO(output)) as archive:
+        assert archive.getinfo('photo.jpg').compress_type == zipfile.ZIP_STORED
+        assert archive.read('photo.jpg') == b'x' * 100
+
+
+@pytest.mark.parametrize('mime_type, expected', [
+    ('image/jpeg', True),
+    ('video/mp4', True),
+    ('application/zip', True),
+    ('application/vnd.openxmlformats-officedocument.wordprocessingml.document', True),
+    ('image/svg+xml', False),
+    ('text/plain', False),
+    (None, False),
+])
+def test_is_compressed_mime_type(mime_type, expected):
+    assert is_compressed_mime_type(mime_type) is expected
+
+
+def test_zip64_forced_round_trip():
+    data = build_archive(create_archive_writer('zip64'), MEMBERS)
+    assert b'PK\x06\x06' in data and b'PK\x06\x07' in data
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        assert [archive.read(name) for name, _, _ in MEMBERS] == [content for _, content, _ in MEMBERS]
+
+
+def test_zip_member_of_unknown_size_uses_zip64_entry():
+    content = os.urandom(2500)
+    data = build_archive(ZipStreamWriter(), [('unknown.bin', content, None)])
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.read('unknown.bin') == content
+        assert archive.getinfo('unknown.bin').extract_version >= 45
+
+
+def test_zip_with_more_than_65535_members_uses_zip64_end_record():
+    writer = ZipStreamWriter(compression=zipfile.ZIP_STORED)
+    output = io.BytesIO()
+    for index in range(65536):
+        for data in writer.add_member(f'{index}', [b''], size=0):
+            output.write(data)
+    for data in writer.close():
+        output.write(data)
+    with zipfile.ZipFile(output) as archive:
+        assert len(archive.infolist()) == 65536
+
+
+@pytest.mark.parametrize('archive_format', ['tar', 'tar.gz', 'tar.zst'])
+def test_tar_round_trip(archive_format):
+    writer = create_archive_writer(archive_format, 3)
+    data = build_archive(writer, MEMBERS)
+    assert writer.extension == archive_format
+
+    if archive_format == 'tar.zst':
+        data = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)).read()
+    with tarfile.open(fileobj=io.BytesIO(data), mode='r:*') as archive:
+        assert archive.getnames() == [name for name, _, _ in MEMBERS]
+        for name, content, _ in MEMBERS:
+            assert archive.extractfile(name).read() == content
+            assert archive.getmember(name).mtime == calendar.timegm((2025, 1, 2, 3, 4, 6, 0, 0, 0))
+
+
+def test_tar_requires_member_size():
+    with pytest.raises(ValueError):
+        list(create_archive_writer('tar').add_member('a.txt', [b'x']))
+
+
+@pytest.mark.parametrize('chunks', [[b'x' * 5], [b'x' * 3], [b'x' * 3, b'x' * 3]])
+def test_tar_rejects_size_mismatch(chunks):
+    with pytest.raises(IOError):
+        list(create_archive_writer('tar').add_member('a.txt', chunks, size=4))
+
+
+def test_create_archive_writer_rejects_unknown_format():
+    with pytest.raises(ValueError):
+        create_archive_writer('rar')
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""批量上传：有界并发、按完成顺序输出结果、单个文件失败不影响其他文件"""
+
+import io
+import re
+import threading
+
+import pytest
+from fastapi import HTTPException, UploadFile
+from starlette.datastructures import Headers
+
+import service.google_drive_service as google_drive_module
+from service.google_drive_service import google_drive_service
+from tests.drive_stub import StubHttp
+
+
+class UploadHandler:
+    """记录同时进行的上传数，文件名为 bad.txt 的上传返回错误"""
+
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+        self.parents = []
+        self.lock = threading.Lock()
+
+    def __call__(self, method, uri, headers, body):
+        name = re.search(rb'"name": "([^"]*)"', body).group(1).decode()
+        self.parents.append(re.search(rb'"parents": \["([^"]*)"\]', body).group(1).decode())
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        threading.Event().wait(0.05)
+        with self.lock:
+            self.active -= 1
+        if name == 'bad.txt':
+            return 403, {'error': {'code': 403, 'message': 'quota exceeded'}}, None
+        return 200, {'id': f'id-{name}', 'name': name, 'size': '5', 'mimeType': 'text/plain'}, None
+
+
+def upload_file(name: str) -> UploadFile:
+    return UploadFile(io.BytesIO(b'hello'), filename=name, headers=Headers({'content-type': 'text/plain'}))
+
+
+@pytest.fixture
+def handler(drive_service, transfer_config, monkeypatch):
+    transfer_config(batch_upload_concurrency=2, num_retries=0)
+    handler = UploadHandler()
+    service, _ = drive_service(handler)
+    monkeypatch.setattr(google_drive_service, 'service', service)
+    monkeypatch.setattr(google_drive_module, 'authorized_http', lambda credentials: StubHttp(handler))
+    return handler
+
+
+def test_batch_upload_reports_each_file(handler):
+    names = ['a.txt', 'bad.txt', 'c.txt', 'd.txt', 'e.txt']
+    results = list(google_drive_service.upload_files([upload_file(name) for name in names], 'folder'))
+
+    assert sorted(result['index'] for result in results) == list(range(len(names)))
+    by_name = {result['name']: result for result in results}
+    assert not by_name['bad.txt']['success'] and 'quota exceeded' in by_name['bad.txt']['error']
+    assert all(by_name[name]['success'] and by_name[name]['data']['file_id'] == f'id-{name}'
+               for name in names if name != 'bad.txt')
+    assert handler.parents == ['folder'] * len(names)
+    assert handler.peak <= 2
+
+
+def test_batch_upload_checks_parent_before_streaming(handler, transfer_config):
+    transfer_config(auth_method='service_account', default_folder_id=None)
+    with pytest.raises(HTTPException) as error:
+        google_drive_service.upload_files([upload_file('a.txt')])
+    assert error.value.status_code == 400
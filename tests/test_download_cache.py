@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""按 md5Checksum 寻址的下载缓存：默认关闭、校验后写入、LRU 淘汰与重启恢复"""
+
+import hashlib
+import os
+
+import pytest
+
+from service.download_cache import DownloadCache, get_download_cache_enabled
+
+
+def file_info(content: bytes):
+    return {'md5Checksum': hashlib.md5(content).hexdigest(), 'size': str(len(content)),
+            'modifiedTime': '2025-01-01T00:00:00.000Z'}
+
+
+def download(cache: DownloadCache, content: bytes, info=None):
+    tee = cache.tee(info or file_info(content))
+    return b''.join(tee(iter([content[:10], content[10:]])))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DownloadCache(cache_dir=str(tmp_path), max_bytes=250, enabled=True)
+
+
+def test_disabled_by_default():
+    assert get_download_cache_enabled() is False
+
+
+def test_disabled_cache_never_stores(tmp_path):
+    cache = DownloadCache(cache_dir=str(tmp_path), enabled=False)
+    assert cache.tee(file_info(b'x' * 100)) is None
+    assert cache.lookup(file_info(b'x' * 100)) is None
+
+
+def test_complete_download_is_cached(cache):
+    content = os.urandom(100)
+    assert cache.lookup(file_info(content)) is None
+    assert download(cache, content) == content
+
+    path = cache.lookup(file_info(content))
+    with open(path, 'rb') as f:
+        assert f.read() == content
+
+
+def test_mismatched_content_is_not_cached(cache):
+    content = os.urandom(100)
+    assert download(cache, content, file_info(os.urandom(100))) == content
+    assert cache.lookup(file_info(content)) is None
+    assert os.listdir(os.path.join(cache.cache_dir, 'tmp')) == []
+
+
+def test_interrupted_download_is_not_cached(cache):
+    content = os.urandom(100)
+    chunks = cache.tee(file_info(content))(iter([content[:50], content[50:]]))
+    next(chunks)
+    chunks.close()
+    assert cache.lookup(file_info(content)) is None
+    assert os.listdir(os.path.join(cache.cache_dir, 'tmp')) == []
+
+
+def test_uncacheable_files(cache):
+    # 原生 Google 文档没有 md5Checksum，超过缓存上限的文件也不缓存
+    assert cache.tee({'size': '10'}) is None
+    assert cache.tee(file_info(b'x' * 300)) is None
+
+
+def test_least_recently_used_is_evicted(cache):
+    first, second, third = os.urandom(100), os.urandom(100), os.urandom(100)
+    download(cache, first)
+    download(cache, second)
+    cache.lookup(file_info(first))
+    download(cache, third)
+
+    assert cache.contains(file_info(first))
+    assert not cache.contains(file_info(second))
+    assert cache.contains(file_info(third))
+
+
+def test_entries_survive_restart(cache):
+    content = os.urandom(100)
+    download(cache, content)
+    restarted = DownloadCache(cache_dir=cache.cache_dir, max_bytes=250, enabled=True)
+    assert restarted.contains(file_info(content))
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""fields 参数：字段校验、校验头字段补全、结果投影与传给 Drive 的 fields"""
+
+import threading
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+from fastapi import HTTPException
+
+import service.google_drive_service as google_drive_module
+from service.drive_fields import parse_fields, with_validator_fields, project, FILE_INFO_FIELDS
+from service.google_drive_service import google_drive_service
+from tests.drive_stub import StubHttp
+
+
+@pytest.mark.parametrize('fields, expected', [
+    (None, FILE_INFO_FIELDS.split(',')),
+    ('name', ['name']),
+    (' id , name,id ,', ['id', 'name']),
+])
+def test_parse_fields(fields, expected):
+    assert parse_fields(fields, FILE_INFO_FIELDS) == expected
+
+
+@pytest.mark.parametrize('fields', ['', ' , ', 'name,permissions', 'files(id)', 'owners/emailAddress'])
+def test_parse_fields_rejects_invalid(fields):
+    with pytest.raises(HTTPException) as error:
+        parse_fields(fields, FILE_INFO_FIELDS)
+    assert error.value.status_code == 400
+
+
+def test_with_validator_fields_adds_missing_fields_once():
+    assert with_validator_fields(['name', 'version']) == 'name,version,id,modifiedTime'
+
+
+def test_project_keeps_only_selected_fields():
+    file_info = {'id': 'f1', 'name': 'a.txt', 'version': '3'}
+    assert project(file_info, ['name', 'size']) == {'name': 'a.txt'}
+
+
+def test_list_files_requests_only_selected_fields(drive_service, monkeypatch):
+    def handle(method, uri, headers, body):
+        return 200, {'files': [{'name': 'a.txt', 'id': 'f1'}]}, None
+
+    service, _ = drive_service(handle)
+    http = StubHttp(handle)
+    monkeypatch.setattr(google_drive_service, 'service', service)
+    monkeypatch.setattr(google_drive_service, '_local', threading.local())
+    monkeypatch.setattr(google_drive_module, 'authorized_http', lambda credentials: http)
+
+    result = google_drive_service.list_files(fields='name,id', use_cache=False)
+
+    assert result['files'] == [{'name': 'a.txt', 'id': 'f1'}]
+    assert parse_qs(urlparse(http.requests[0][1]).query)['fields'] == ['nextPageToken, files(name,id)']
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""上传与下载传输：可续传会话的分块与已提交位置、按 Range 分块下载、多连接并行下载与有界下载队列"""
+
+import io
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+import service.drive_transfer as drive_transfer
+from service.drive_transfer import UPLOAD_CHUNK_ALIGNMENT, get_upload_chunk_size, put_session_chunk, \
+    push_upload_session, query_upload_session, upload_stream, iter_media_chunks, BackgroundChunkStream, \
+    iter_media_parallel, use_parallel_download, stream_media
+from tests.drive_stub import StubHttp, media_handler
+
+SESSION_URI = 'https://www.googleapis.com/upload/drive/v3/files?uploadType=resumable&upload_id=s1'
+
+
+class UploadSession:
+    """
+    模拟 Drive 可续传会话
+
+    :param commit_limit: 单次 PUT 最多提交的字节数，用来模拟 Drive 只确认了部分分块
+    """
+
+    def __init__(self, commit_limit=None):
+        self.data = bytearray()
+        self.commit_limit = commit_limit
+        self.created = None
+
+    def __call__(self, method, uri, headers, body):
+        if method == 'POST':
+            self.created = json.loads(body)
+            return 200, b'', {'location': SESSION_URI}
+        content_range = headers['content-range']
+        match = re.match(r'bytes (\d+)-(\d+)/(\*|\d+)$', content_range)
+        if match:
+            assert int(match.group(1)) == len(self.data), '分块必须从已提交位置开始'
+            body = body or b''
+            assert int(match.group(2)) - int(match.group(1)) + 1 == len(body)
+            self.data += body[:self.commit_limit] if self.commit_limit else body
+            total = match.group(3)
+        else:
+            total = re.match(r'bytes \*/(\*|\d+)$', content_range).group(1)
+        if total != '*' and int(total) == len(self.data):
+            return 200, {'id': 'f1', 'name': (self.created or {}).get('name'), 'size': total}, None
+        return 308, b'', {'range': f'bytes=0-{len(self.data) - 1}'} if self.data else None
+
+
+def test_upload_chunk_size_is_aligned(transfer_config):
+    transfer_config(upload_chunk_size=UPLOAD_CHUNK_ALIGNMENT * 3 + 1000)
+    assert get_upload_chunk_size() == UPLOAD_CHUNK_ALIGNMENT * 3
+    transfer_config(upload_chunk_size=1)
+    assert get_upload_chunk_size() == UPLOAD_CHUNK_ALIGNMENT
+
+
+def test_put_session_chunk_reports_committed_bytes():
+    session = UploadSession()
+    http = StubHttp(session)
+
+    status = put_session_chunk(http, SESSION_URI, b'a' * 10, 0)
+    assert status == {'complete': False, 'committed_bytes': 10}
+    assert http.requests[-1][2]['content-range'] == 'bytes 0-9/*'
+
+    status = put_session_chunk(http, SESSION_URI, b'b' * 5, 10, 15)
+    assert status['complete'] and status['file']['id'] == 'f1'
+    assert http.requests[-1][2]['content-range'] == 'bytes 10-14/15'
+
+
+def test_query_upload_session_without_committed_bytes():
+    http = StubHttp(UploadSession())
+    assert query_upload_session(SESSION_URI, 100, http) == {'complete': False, 'committed_bytes': 0}
+    assert http.requests[-1][2]['content-range'] == 'bytes */100'
+    assert http.requests[-1][2]['content-length'] == '0'
+
+
+def test_put_session_chunk_raises_on_error():
+    http = StubHttp(lambda method, uri, headers, body: (404, {'error': {'message': 'gone'}}, None))
+    with pytest.raises(HttpError):
+        put_session_chunk(http, SESSION_URI, b'x', 0, 1)
+
+
+def test_push_upload_session_resends_uncommitted_bytes(transfer_config):
+    transfer_config(upload_chunk_size=UPLOAD_CHUNK_ALIGNMENT)
+    data = os.urandom(UPLOAD_CHUNK_ALIGNMENT * 2 + 123)
+    # Drive 每次只确认 100 KiB，剩余部分必须从确认位置重新发送
+    session = UploadSession(commit_limit=100 * 1024)
+    progress = []
+
+    uploaded = push_upload_session(SESSION_URI, io.BytesIO(data), len(data), on_progress=progress.append,
+                                   http=StubHttp(session))
+
+    assert uploaded['id'] == 'f1'
+    assert bytes(session.data) == data
+    assert progress == sorted(progress) and progress[0] == 100 * 1024
+
+
+def test_push_upload_session_resumes_from_offset(transfer_config):
+    transfer_config(upload_chunk_size=UPLOAD_CHUNK_ALIGNMENT)
+    data = os.urandom(UPLOAD_CHUNK_ALIGNMENT + 10)
+    session = UploadSession()
+    session.data += data[:UPLOAD_CHUNK_ALIGNMENT]
+    http = StubHttp(session)
+
+    offset = query_upload_session(SESSION_URI, len(data), http)['committed_bytes']
+    push_upload_session(SESSION_URI, io.BytesIO(data), len(data), offset=offset, http=http)
+
+    assert offset == UPLOAD_CHUNK_ALIGNMENT
+    assert bytes(session.data) == data
+    assert http.requests[-1][2]['content-range'] == f'bytes {UPLOAD_CHUNK_ALIGNMENT}-{len(data) - 1}/{len(data)}'
+
+
+def test_upload_stream_uses_resumable_session_above_threshold(drive_service, transfer_config):
+    transfer_config(upload_chunk_size=UPLOAD_CHUNK_ALIGNMENT, resumable_threshold=UPLOAD_CHUNK_ALIGNMENT)
+    data = os.urandom(UPLOAD_CHUNK_ALIGNMENT * 2 + 1)
+    session = UploadSession()
+    service, http = drive_service(session)
+
+    uploaded = upload_stream(service, io.BytesIO(data), {'name': 'big.bin'}, None)
+
+    assert uploaded['name'] == 'big.bin'
+    assert bytes(session.data) == data
+    assert parse_qs(urlparse(http.requests[0][1]).query)['uploadType'] == ['resumable']
+    assert [method for method, *_ in http.requests] == ['POST', 'PUT', 'PUT', 'PUT']
+
+
+MEDIA_URI = 'https://www.googleapis.com/drive/v3/files/f1?alt=media'
+
+
+def test_iter_media_chunks_requests_ranges():
+    data = os.urandom(2500)
+    http = StubHttp(media_handler(data))
+
+    chunks = list(iter_media_chunks(http, MEDIA_URI, chunk_size=1000))
+
+    assert [len(chunk) for chunk in chunks] == [1000, 1000, 500]
+    assert b''.join(chunks) == data
+    assert [headers['range'] for _, _, headers, _ in http.requests] == \
+        ['bytes=0-999', 'bytes=1000-1999', 'bytes=2000-2999']
+
+
+def test_iter_media_chunks_partial_range():
+    data = os.urandom(2500)
+    chunks = list(iter_media_chunks(StubHttp(media_handler(data)), MEDIA_URI, chunk_size=1000, start=900, end=1100))
+    assert b''.join(chunks) == data[900:1101]
+
+
+def test_iter_media_chunks_empty_file():
+    assert list(iter_media_chunks(StubHttp(media_handler(b'')), MEDIA_URI, chunk_size=1000)) == []
+
+
+def test_iter_media_chunks_server_ignores_range():
+    data = os.urandom(2500)
+    http = StubHttp(media_handler(data, ignore_range=True))
+    assert b''.join(iter_media_chunks(http, MEDIA_URI, chunk_size=1000, start=10, end=19)) == data[10:20]
+    assert len(http.requests) == 1
+
+
+def test_background_chunk_stream_is_bounded():
+    produced = []
+    release = threading.Event()
+
+    def chunks():
+        for index in range(20):
+            produced.append(index)
+            yield bytes([index])
+        release.set()
+
+    stream = BackgroundChunkStream(chunks(), queue_size=2).prime()
+    time.sleep(0.2)
+    # 一个分块已被取出，队列中两个，生产者最多再持有一个
+    assert len(produced) <= 4
+    assert b''.join(stream) == bytes(range(20))
+    assert release.is_set()
+
+
+def test_background_chunk_stream_raises_producer_error():
+    def chunks():
+        raise HttpError(httplib2.Response({'status': '403'}), b'forbidden')
+        yield b''
+
+    with pytest.raises(HttpError):
+        BackgroundChunkStream(chunks()).prime()
+
+
+def test_iter_media_parallel_yields_parts_in_order(transfer_config, monkeypatch):
+    transfer_config(download_chunk_size=300, num_retries=0)
+    data = os.urandom(10000)
+    handler = media_handler(data)
+    clients = []
+
+    def authorized_http(credentials):
+        # 每个取数线程各用一个连接
+        clients.append(StubHttp(handler))
+        return clients[-1]
+
+    monkeypatch.setattr(drive_transfer, 'authorized_http', authorized_http)
+    parts = list(iter_media_parallel(None, MEDIA_URI, 100, 9099, connections=3, part_size=1000))
+
+    assert [len(part) for part in parts] == [1000] * 9
+    assert b''.join(parts) == data[100:9100]
+    assert 1 <= len(clients) <= 3
+    # 每个 1000 字节的区间按 300 字节分块拉取 4 次
+    assert sum(len(client.requests) for client in clients) == 9 * 4
+
+
+def test_iter_media_parallel_bounds_buffered_parts(transfer_config, monkeypatch):
+    transfer_config(download_chunk_size=1000, num_retries=0)
+    data = os.urandom(20000)
+    handler = media_handler(data)
+    requested = []
+
+    def record(method, uri, headers, body):
+        requested.append(headers['range'])
+        return handler(method, uri, headers, body)
+
+    monkeypatch.setattr(drive_transfer, 'authorized_http', lambda credentials: StubHttp(record))
+    parts = iter_media_parallel(None, MEDIA_URI, 0, len(data) - 1, connections=3, part_size=1000)
+    assert next(parts) == data[:1000]
+    time.sleep(0.2)
+    # 调用方持有一个区间时，正在拉取和已拉取未产出的区间最多 connections 个
+    assert len(requested) <= 1 + 3
+    assert b''.join(parts) == data[1000:]
+
+
+def test_parallel_stream_keeps_one_part_queued(transfer_config, monkeypatch, drive_service):
+    transfer_config(download_chunk_size=1000, num_retries=0, parallel_download_connections=2,
+                    parallel_download_threshold=1000, parallel_download_part_size=1000)
+    data = os.urandom(20000)
+    requested = []
+
+    def record(method, uri, headers, body):
+        requested.append(headers['range'])
+        return media_handler(data)(method, uri, headers, body)
+
+    service, _ = drive_service(record)
+    monkeypatch.setattr(drive_transfer, 'authorized_http', lambda credentials: StubHttp(record))
+    stream = stream_media(service, None, 'f1', end=len(data) - 1)
+    time.sleep(0.2)
+    # 队列中一个区间、生产者手中一个区间、窗口中 connections 个区间
+    assert len(requested) <= 1 + 1 + 2
+    assert b''.join(stream) == data
+
+
+def test_iter_media_parallel_raises_part_error(transfer_config, monkeypatch):
+    transfer_config(download_chunk_size=1000, num_retries=0)
+    data = os.urandom(5000)
+
+    def handler(method, uri, headers, body):
+        if headers['range'].startswith('bytes=2000-'):
+            return 403, {'error': {'code': 403, 'message': 'forbidden'}}, None
+        return media_handler(data)(method, uri, headers, body)
+
+    monkeypatch.setattr(drive_transfer, 'authorized_http', lambda credentials: StubHttp(handler))
+    parts = iter_media_parallel(None, MEDIA_URI, 0, 4999, connections=2, part_size=1000)
+    assert next(parts) == data[:1000]
+    assert next(parts) == data[1000:2000]
+    with pytest.raises(HttpError):
+        next(parts)
+
+
+def test_use_parallel_download(transfer_config):
+    transfer_config(parallel_download_connections=4, parallel_download_threshold=1000)
+    assert use_parallel_download(0, 1000)
+    assert not use_parallel_download(0, 999)
+    assert not use_parallel_download(0, None)
+    transfer_config(parallel_download_connections=1)
+    assert not use_parallel_download(0, 10 ** 9)
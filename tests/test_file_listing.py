@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""分页遍历文件列表与自动翻页的逐项输出"""
+
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+from googleapiclient.errors import HttpError
+
+from service.drive_transfer import iter_file_pages, iter_file_listing
+
+FILES = [{'id': f'f{index}', 'name': f'{index}.txt'} for index in range(25)]
+
+
+class ListHandler:
+    """按 pageSize 分页返回 FILES，页面令牌为下一页的起始下标；fail_at 指定的页返回错误"""
+
+    def __init__(self, fail_at=None):
+        self.fail_at = fail_at
+
+    def __call__(self, method, uri, headers, body):
+        params = parse_qs(urlparse(uri).query)
+        start = int(params.get('pageToken', ['0'])[0])
+        size = int(params['pageSize'][0])
+        if start == self.fail_at:
+            return 400, {'error': {'code': 400, 'message': 'bad page'}}, None
+        page = {'files': FILES[start:start + size]}
+        if start + size < len(FILES):
+            page['nextPageToken'] = str(start + size)
+        return 200, page, None
+
+
+def test_iter_file_pages_follows_next_page_token(drive_service):
+    service, http = drive_service(ListHandler())
+    pages = list(iter_file_pages(service, http, "trashed = false", page_size=10))
+
+    assert [len(page['files']) for page in pages] == [10, 10, 5]
+    assert [file for page in pages for file in page['files']] == FILES
+    assert [parse_qs(urlparse(uri).query).get('pageToken') for _, uri, _, _ in http.requests] == \
+        [None, ['10'], ['20']]
+
+
+def test_iter_file_pages_is_lazy(drive_service):
+    service, http = drive_service(ListHandler())
+    pages = iter_file_pages(service, http, page_size=10)
+    assert http.requests == []
+    next(pages)
+    assert len(http.requests) == 1
+
+
+def test_iter_file_pages_starts_from_page_token(drive_service):
+    service, http = drive_service(ListHandler())
+    pages = list(iter_file_pages(service, http, page_size=10, page_token='20'))
+    assert pages == [{'files': FILES[20:]}]
+
+
+def test_iter_file_pages_raises_on_error(drive_service, transfer_config):
+    transfer_config(num_retries=0)
+    service, http = drive_service(ListHandler(fail_at=10))
+    pages = iter_file_pages(service, http, page_size=10)
+    next(pages)
+    with pytest.raises(HttpError):
+        next(pages)
+
+
+def test_iter_file_listing_ends_with_done_trailer(drive_service):
+    service, _ = drive_service(ListHandler())
+    items = list(iter_file_listing(service, None, page_size=10))
+    assert items[:-1] == FILES
+    assert items[-1] == {'done': True, 'count': len(FILES)}
+
+
+def test_iter_file_listing_reports_failed_page_token(drive_service, transfer_config):
+    transfer_config(num_retries=0)
+    service, _ = drive_service(ListHandler(fail_at=20))
+    items = list(iter_file_listing(service, None, page_size=10))
+    assert items[:-1] == FILES[:20]
+    trailer = items[-1]
+    assert trailer['page_token'] == '20' and trailer['count'] == 20 and 'bad page' in trailer['error']
+
+    # 客户端带失败页的令牌继续
+    service, _ = drive_service(ListHandler())
+    assert list(iter_file_listing(service, None, page_size=10, page_token=trailer['page_token']))[:-1] == FILES[20:]
+
+
+def test_iter_file_listing_raises_first_page_error(drive_service, transfer_config):
+    transfer_config(num_retries=0)
+    service, _ = drive_service(ListHandler(fail_at=0))
+    with pytest.raises(HttpError):
+        iter_file_listing(service, None, page_size=10)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""文件夹树并行遍历与归档路径分配"""
+
+import re
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+from fastapi import HTTPException
+from googleapiclient.errors import HttpError
+
+import service.folder_walker as folder_walker
+from service.folder_walker import FolderTreeWalker, ArchiveNameAllocator, sanitize_path_component, FOLDER_MIME_TYPE
+from service.google_drive_service import google_drive_service
+from tests.drive_stub import StubHttp
+
+# 文件夹 ID -> 子项，shared 同时挂在 root 与 a 下，b 的内容分两页返回
+TREE = {
+    'root': [
+        {'id': 'a', 'name': 'a', 'mimeType': FOLDER_MIME_TYPE},
+        {'id': 'shared', 'name': 'shared', 'mimeType': FOLDER_MIME_TYPE},
+        {'id': 'f1', 'name': 'top.txt', 'mimeType': 'text/plain'},
+    ],
+    'a': [
+        {'id': 'b', 'name': 'b/c', 'mimeType': FOLDER_MIME_TYPE},
+        {'id': 'shared', 'name': 'shared', 'mimeType': FOLDER_MIME_TYPE},
+        {'id': 'f2', 'name': '..', 'mimeType': 'text/plain'},
+    ],
+    'b': [{'id': f'b{index}', 'name': f'{index}.txt', 'mimeType': 'text/plain'} for index in range(3)],
+    'shared': [{'id': 'f3', 'name': 'inner.txt', 'mimeType': 'text/plain'}],
+}
+
+
+def handle(method, uri, headers, body):
+    params = parse_qs(urlparse(uri).query)
+    folder_id = re.match(r"'([^']+)' in parents", params['q'][0]).group(1)
+    if folder_id == 'broken':
+        return 500, {'error': {'code': 500, 'message': 'boom'}}, None
+    children = TREE[folder_id]
+    if folder_id == 'b':
+        start = int(params.get('pageToken', ['0'])[0])
+        page = {'files': children[start:start + 2]}
+        if start + 2 < len(children):
+            page['nextPageToken'] = str(start + 2)
+        return 200, page, None
+    return 200, {'files': children}, None
+
+
+@pytest.fixture
+def walker(drive_service, transfer_config, monkeypatch):
+    transfer_config(num_retries=0)
+    service, _ = drive_service(handle)
+    monkeypatch.setattr(folder_walker, 'authorized_http', lambda credentials: StubHttp(handle))
+    return FolderTreeWalker(service, None, concurrency=3)
+
+
+def test_walk_yields_every_file_once_with_relative_paths(walker):
+    items = list(walker.walk('root'))
+    paths = {item['id']: item['path'] for item in items}
+    assert len(items) == len(paths)
+    # shared 先从哪个父文件夹发现取决于线程调度，但只遍历一次
+    assert paths.pop('f3') in ('shared/inner.txt', 'a/shared/inner.txt')
+    assert paths == {
+        'f1': 'top.txt',
+        'f2': 'a/_',
+        'b0': 'a/b_c/0.txt',
+        'b1': 'a/b_c/1.txt',
+        'b2': 'a/b_c/2.txt',
+    }
+
+
+def test_walk_raises_when_a_subfolder_fails_to_list(walker, monkeypatch):
+    monkeypatch.setitem(TREE, 'a', TREE['a'] + [{'id': 'broken', 'name': 'broken', 'mimeType': FOLDER_MIME_TYPE}])
+    # 不能跳过失败的子树，否则归档会悄悄缺少整个目录
+    with pytest.raises(HttpError) as error:
+        list(walker.walk('root'))
+    assert error.value.resp.status == 500
+
+
+def test_walk_raises_when_root_fails_to_list(walker):
+    files = walker.walk('broken')
+    with pytest.raises(HttpError):
+        next(files)
+
+
+def test_archive_of_broken_folder_reports_drive_error(drive_service, transfer_config, monkeypatch):
+    transfer_config(num_retries=0)
+    service, _ = drive_service(handle)
+    monkeypatch.setattr(google_drive_service, 'service', service)
+    monkeypatch.setattr(folder_walker, 'authorized_http', lambda credentials: StubHttp(handle))
+    with pytest.raises(HTTPException) as error:
+        google_drive_service.download_all_files(folder_id='broken')
+    assert error.value.status_code == 500 and 'boom' in error.value.detail
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('a/b', 'a_b'),
+    ('a\\b', 'a_b'),
+    ('..', '_'),
+    ('  ', '_'),
+    (None, '_'),
+    ('报告.pdf', '报告.pdf'),
+])
+def test_sanitize_path_component(name, expected):
+    assert sanitize_path_component(name) == expected
+
+
+def test_archive_name_allocator_numbers_duplicates():
+    allocator = ArchiveNameAllocator()
+    assert [allocator.allocate(path) for path in
+            ['a/report.pdf', 'a/report.pdf', 'a/report.pdf', 'a/README', 'a/README', 'b/report.pdf']] == \
+        ['a/report.pdf', 'a/report (1).pdf', 'a/report (2).pdf', 'a/README', 'a/README (1)', 'b/report.pdf']
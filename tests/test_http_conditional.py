@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""ETag / Last-Modified 校验器与条件请求判断"""
+
+from datetime import datetime, timezone
+
+import pytest
+
+from common.http_conditional import content_etag, metadata_etag, last_modified, validator_headers, \
+    is_not_modified, if_range_matches, not_modified_response
+from service.media_download import build_download_response
+
+MODIFIED = datetime(2025, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+HTTP_DATE = 'Thu, 02 Jan 2025 03:04:05 GMT'
+
+
+def test_content_etag_prefers_md5():
+    assert content_etag({'md5Checksum': 'abc', 'version': '7'}) == '"abc"'
+    assert content_etag({'version': '7'}) == '"v7"'
+    assert content_etag({}) is None
+
+
+def test_metadata_etag_uses_version():
+    assert metadata_etag({'id': 'f1', 'version': '7'}) == '"f1-v7"'
+    assert metadata_etag({'id': 'f1'}) is None
+
+
+def test_last_modified_truncates_to_seconds():
+    assert last_modified({'modifiedTime': '2025-01-02T03:04:05.678Z'}) == MODIFIED
+    assert last_modified({'modifiedTime': 'yesterday'}) is None
+    assert last_modified({}) is None
+
+
+def test_validator_headers():
+    assert validator_headers('"abc"', MODIFIED) == {'ETag': '"abc"', 'Last-Modified': HTTP_DATE}
+    assert validator_headers(None, None) == {}
+
+
+@pytest.mark.parametrize('if_none_match, if_modified_since, expected', [
+    ('"abc"', None, True),
+    ('W/"abc"', None, True),
+    ('"old", "abc"', None, True),
+    ('*', None, True),
+    ('"old"', None, False),
+    (None, HTTP_DATE, True),
+    (None, 'Fri, 03 Jan 2025 00:00:00 GMT', True),
+    (None, 'Wed, 01 Jan 2025 00:00:00 GMT', False),
+    (None, 'not a date', False),
+    # 同时携带时只看 If-None-Match
+    ('"old"', HTTP_DATE, False),
+    (None, None, False),
+])
+def test_is_not_modified(if_none_match, if_modified_since, expected):
+    assert is_not_modified(if_none_match, if_modified_since, '"abc"', MODIFIED) is expected
+
+
+@pytest.mark.parametrize('if_range, expected', [
+    (None, True),
+    ('"abc"', True),
+    ('"old"', False),
+    ('W/"abc"', False),
+    (HTTP_DATE, True),
+    ('Fri, 03 Jan 2025 00:00:00 GMT', False),
+    ('not a date', False),
+])
+def test_if_range_matches(if_range, expected):
+    assert if_range_matches(if_range, '"abc"', MODIFIED) is expected
+
+
+def test_not_modified_response_has_no_body():
+    response = not_modified_response({'ETag': '"abc"'})
+    assert response.status_code == 304
+    assert response.body == b''
+    assert response.headers['etag'] == '"abc"'
+
+
+def test_download_returns_304_without_fetching_content(drive_service):
+    service, http = drive_service(lambda method, uri, headers, body: pytest.fail('不应拉取内容'))
+    file_info = {'name': 'a.txt', 'size': '10', 'md5Checksum': 'abc', 'modifiedTime': '2025-01-02T03:04:05Z'}
+    response = build_download_response(service, None, 'f1', file_info, if_none_match='"abc"')
+    assert response.status_code == 304
+    assert response.headers['last-modified'] == HTTP_DATE
+    assert http.requests == []
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Range 请求头解析与区间下载响应"""
+
+import asyncio
+import os
+
+import pytest
+from fastapi import HTTPException
+
+import service.drive_transfer as drive_transfer
+import service.media_download as media_download
+from common.http_range import parse_range_header, RangeNotSatisfiable, MAX_RANGES
+from tests.drive_stub import StubHttp, media_handler
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-499', [(0, 499)]),
+    ('bytes=500-', [(500, 999)]),
+    ('bytes=-200', [(800, 999)]),
+    ('bytes=-2000', [(0, 999)]),
+    ('bytes=900-5000', [(900, 999)]),
+    ('bytes=0-99, 200-299', [(0, 99), (200, 299)]),
+    # 重叠与相邻的区间合并，按起始位置排序
+    ('bytes=200-299,0-99,50-150,300-310', [(0, 150), (200, 310)]),
+    ('BYTES = 0-0', [(0, 0)]),
+    # 不可满足的区间被忽略
+    ('bytes=0-9,2000-3000', [(0, 9)]),
+    ('bytes=-0,0-9', [(0, 9)]),
+])
+def test_parse_range_header(header, expected):
+    assert parse_range_header(header, 1000) == expected
+
+
+@pytest.mark.parametrize('header', [
+    None,
+    '',
+    'items=0-9',
+    'bytes=',
+    'bytes=abc',
+    'bytes=9-0',
+    'bytes=-',
+    'bytes=1-2-3',
+    ','.join(['bytes=0-0'] + [f'{i * 10}-{i * 10}' for i in range(1, MAX_RANGES + 1)]),
+])
+def test_invalid_range_header_means_full_content(header):
+    assert parse_range_header(header, 1000) is None
+
+
+@pytest.mark.parametrize('header', ['bytes=1000-', 'bytes=5000-6000', 'bytes=-0'])
+def test_unsatisfiable_range(header):
+    with pytest.raises(RangeNotSatisfiable) as error:
+        parse_range_header(header, 1000)
+    assert error.value.size == 1000
+
+
+CONTENT = os.urandom(10000)
+FILE_INFO = {'name': 'a.bin', 'mimeType': 'application/octet-stream', 'size': str(len(CONTENT)),
+             'md5Checksum': '0' * 32, 'modifiedTime': '2025-01-01T00:00:00.000Z', 'version': '3'}
+
+
+def read_body(response) -> bytes:
+    async def consume():
+        return b''.join([chunk async for chunk in response.body_iterator])
+    return asyncio.run(consume())
+
+
+@pytest.fixture
+def download(drive_service, transfer_config, monkeypatch):
+    transfer_config(download_chunk_size=4096, num_retries=0)
+    handler = media_handler(CONTENT)
+    service, _ = drive_service(handler)
+    for module in (drive_transfer, media_download):
+        monkeypatch.setattr(module, 'authorized_http', lambda credentials: StubHttp(handler))
+
+    def respond(range_header=None, if_range=None):
+        return media_download.build_download_response(service, None, 'f1', dict(FILE_INFO), range_header, if_range)
+
+    return respond
+
+
+def test_single_range_returns_206(download):
+    response = download('bytes=100-5099')
+    assert response.status_code == 206
+    assert response.headers['content-range'] == f'bytes 100-5099/{len(CONTENT)}'
+    assert response.headers['content-length'] == '5000'
+    assert read_body(response) == CONTENT[100:5100]
+
+
+def test_multiple_ranges_return_multipart_byteranges(download):
+    response = download('bytes=0-9,-10')
+    body = read_body(response)
+    boundary = response.headers['content-type'].split('boundary=')[1]
+    assert response.status_code == 206
+    assert int(response.headers['content-length']) == len(body)
+    parts = body.split(f'--{boundary}'.encode())
+    assert parts[0] == b'' and parts[-1] == b'--\r\n'
+    assert parts[1].endswith(b'\r\n\r\n' + CONTENT[:10] + b'\r\n')
+    assert f'Content-Range: bytes {len(CONTENT) - 10}-{len(CONTENT) - 1}/{len(CONTENT)}'.encode() in parts[2]
+    assert parts[2].endswith(CONTENT[-10:] + b'\r\n')
+
+
+def test_unsatisfiable_range_returns_416(download):
+    with pytest.raises(HTTPException) as error:
+        download(f'bytes={len(CONTENT)}-')
+    assert error.value.status_code == 416
+    assert error.value.headers['Content-Range'] == f'bytes */{len(CONTENT)}'
+
+
+def test_range_with_stale_if_range_returns_full_content(download):
+    response = download('bytes=0-9', if_range='"stale"')
+    assert response.status_code == 200
+    assert read_body(response) == CONTENT
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""幂等键：重放已完成请求、拒绝参数不同的重用、并发请求只执行一次、5xx 不保存"""
+
+import asyncio
+import json
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from starlette.responses import JSONResponse
+
+import router.google_drive_router as google_drive_router
+from service.google_drive_service import google_drive_service
+from service.idempotency import IdempotencyStore, request_fingerprint, REPLAYED_HEADER
+
+
+@pytest.fixture
+def store(tmp_path):
+    return IdempotencyStore(db_path=str(tmp_path / 'idempotency.db'), ttl=60)
+
+
+class Operation:
+    """记录执行次数的请求处理函数"""
+
+    def __init__(self, status_code=200, error=None, delay=0):
+        self.calls = 0
+        self.status_code = status_code
+        self.error = error
+        self.delay = delay
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return JSONResponse({'call': self.calls}, status_code=self.status_code)
+
+
+def run(store, operation, key='k1', fingerprint=None):
+    return asyncio.run(store.run(key, 'scope', fingerprint or request_fingerprint('a.txt', 5), operation))
+
+
+def test_completed_request_is_replayed(store):
+    operation = Operation()
+    first = run(store, operation)
+    second = run(store, operation)
+
+    assert operation.calls == 1
+    assert json.loads(second.body) == json.loads(first.body) == {'call': 1}
+    assert second.headers[REPLAYED_HEADER] == 'true'
+    assert REPLAYED_HEADER.lower() not in first.headers
+
+
+def test_replay_survives_restart(store):
+    run(store, Operation())
+    operation = Operation()
+    restarted = IdempotencyStore(db_path=store.db_path, ttl=60)
+    assert run(restarted, operation).headers[REPLAYED_HEADER] == 'true'
+    assert operation.calls == 0
+
+
+def test_reused_key_with_different_parameters_is_rejected(store):
+    run(store, Operation())
+    with pytest.raises(HTTPException) as error:
+        run(store, Operation(), fingerprint=request_fingerprint('b.txt', 5))
+    assert error.value.status_code == 422
+
+
+def test_without_key_always_executes(store):
+    operation = Operation()
+    run(store, operation, key=None)
+    run(store, operation, key=None)
+    assert operation.calls == 2
+
+
+def test_server_errors_are_not_stored(store):
+    with pytest.raises(HTTPException):
+        run(store, Operation(error=HTTPException(status_code=503, detail='unavailable')))
+    run(store, Operation(status_code=500))
+    operation = Operation()
+    assert run(store, operation).status_code == 200 and operation.calls == 1
+
+
+def test_client_errors_are_stored(store):
+    run(store, Operation(error=HTTPException(status_code=400, detail='bad request')))
+    operation = Operation()
+    response = run(store, operation)
+    assert response.status_code == 400 and json.loads(response.body) == {'detail': 'bad request'}
+    assert operation.calls == 0
+
+
+def test_concurrent_requests_execute_once(store):
+    operation = Operation(delay=0.1)
+
+    async def both():
+        fingerprint = request_fingerprint('a.txt', 5)
+        return await asyncio.gather(store.run('k1', 'scope', fingerprint, operation),
+                                    store.run('k1', 'scope', fingerprint, operation))
+
+    first, second = asyncio.run(both())
+    assert operation.calls == 1
+    assert json.loads(first.body) == json.loads(second.body)
+
+
+def test_upload_endpoint_replays_and_runs_off_event_loop(store, monkeypatch):
+    calls = []
+
+    def upload_file(file, parent_folder_id, dedup):
+        # 阻塞的上传调用在线程池中执行，不占用事件循环
+        with pytest.raises(RuntimeError):
+            asyncio.get_running_loop()
+        calls.append(file.filename)
+        return {'file_id': 'f1', 'name': file.filename}
+
+    monkeypatch.setattr(google_drive_router, 'idempotency_store', store)
+    monkeypatch.setattr(google_drive_service, 'upload_file', upload_file)
+    app = FastAPI()
+    app.include_router(google_drive_router.router)
+
+    with TestClient(app) as client:
+        responses = [client.post('/google-drive/upload', files={'file': ('a.txt', b'hello')},
+                                 headers={'Idempotency-Key': 'k1'}) for _ in range(2)]
+
+    assert [response.json()['data']['file_id'] for response in responses] == ['f1', 'f1']
+    assert responses[1].headers[REPLAYED_HEADER] == 'true'
+    assert calls == ['a.txt']
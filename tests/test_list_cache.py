@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""列表缓存：命中与过期、并发未命中只加载一次、按文件夹清除与查询期间写入的处理"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import service.google_drive_service as google_drive_module
+import service.list_cache as list_cache_module
+from service.google_drive_service import google_drive_service
+from service.list_cache import ListResultCache, query_parents
+from tests.drive_stub import StubHttp
+
+FIELDS = 'id,name'
+
+
+class Loader:
+    """记录调用次数的加载函数，started 在开始加载时置位，release 置位后才返回"""
+
+    def __init__(self, blocking=False, error=None):
+        self.calls = 0
+        self.error = error
+        self.started = threading.Event()
+        self.release = threading.Event()
+        if not blocking:
+            self.release.set()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if self.error:
+            raise self.error
+        return {'files': [], 'call': self.calls}
+
+
+def load(cache, loader, query="'folder' in parents", account='a'):
+    return cache.get_or_load(account, query, 100, None, FIELDS, loader)
+
+
+@pytest.mark.parametrize('query, expected', [
+    (None, None),
+    ("name = 'a'", None),
+    ("'folder' in parents", {'folder'}),
+    ("'a' in parents and 'b' in parents and trashed = false", {'a', 'b'}),
+    ("'a' in parents or name = 'x'", None),
+    ("not 'a' in parents", None),
+    ("'a' in parents and name = 'this or that'", {'a'}),
+    ("'it\\'s' in parents", {"it's"}),
+])
+def test_query_parents(query, expected):
+    assert query_parents(query) == (frozenset(expected) if expected is not None else None)
+
+
+def test_results_are_cached_until_expiry(monkeypatch):
+    cache = ListResultCache(ttl=10)
+    loader = Loader()
+    now = [1000.0]
+    monkeypatch.setattr(list_cache_module.time, 'monotonic', lambda: now[0])
+
+    assert load(cache, loader) is load(cache, loader)
+    assert loader.calls == 1
+    # 不同账户、查询互不共享
+    load(cache, loader, account='b')
+    load(cache, loader, query="'other' in parents")
+    assert loader.calls == 3
+
+    now[0] += 11
+    load(cache, loader)
+    assert loader.calls == 4
+
+
+def test_concurrent_misses_load_once():
+    cache = ListResultCache(ttl=10)
+    loader = Loader(blocking=True)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(load, cache, loader) for _ in range(4)]
+        assert loader.started.wait(5)
+        time.sleep(0.1)
+        loader.release.set()
+        results = [future.result() for future in futures]
+    assert loader.calls == 1
+    assert all(result is results[0] for result in results)
+
+
+def test_concurrent_waiters_share_failure():
+    cache = ListResultCache(ttl=10)
+    loader = Loader(blocking=True, error=RuntimeError('drive error'))
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(load, cache, loader)
+        assert loader.started.wait(5)
+        waiter = executor.submit(load, cache, loader)
+        time.sleep(0.1)
+        loader.release.set()
+        for future in (leader, waiter):
+            with pytest.raises(RuntimeError):
+                future.result()
+    assert loader.calls == 1
+    # 失败的结果不缓存
+    loader.error = None
+    load(cache, loader)
+    assert loader.calls == 2
+
+
+def test_invalidate_parent_clears_affected_entries():
+    cache = ListResultCache(ttl=10)
+    loader = Loader()
+    for query in ("'folder' in parents", "'other' in parents", "name contains 'x'"):
+        load(cache, loader, query=query)
+        load(cache, loader, query=query, account='b')
+    assert loader.calls == 6
+
+    cache.invalidate_parent('a', 'folder')
+    for query in ("'folder' in parents", "'other' in parents", "name contains 'x'"):
+        load(cache, loader, query=query)
+        load(cache, loader, query=query, account='b')
+    # 只有账户 a 中 folder 与无法确定文件夹的查询需要重新加载
+    assert loader.calls == 8
+
+    cache.invalidate_parent('a')
+    load(cache, loader, query="'other' in parents")
+    assert loader.calls == 9
+
+
+def test_write_during_load_is_not_cached():
+    cache = ListResultCache(ttl=10)
+    loader = Loader(blocking=True)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(load, cache, loader)
+        assert loader.started.wait(5)
+        cache.invalidate_parent('a', 'folder')
+        loader.release.set()
+        future.result()
+    load(cache, loader)
+    assert loader.calls == 2
+
+
+def test_disabled_cache_always_loads():
+    cache = ListResultCache(ttl=0)
+    loader = Loader()
+    load(cache, loader)
+    load(cache, loader)
+    assert loader.calls == 2
+
+
+def test_list_files_without_cache_bypasses_cache_and_mirror(drive_service, monkeypatch):
+    def handle(method, uri, headers, body):
+        return 200, {'files': [{'id': 'f1'}]}, None
+
+    service, _ = drive_service(handle)
+    http = StubHttp(handle)
+    monkeypatch.setattr(google_drive_service, 'service', service)
+    monkeypatch.setattr(google_drive_service, '_local', threading.local())
+    monkeypatch.setattr(google_drive_module, 'authorized_http', lambda credentials: http)
+    monkeypatch.setattr(google_drive_module.list_cache, 'get_or_load', lambda *args: pytest.fail('不应读取列表缓存'))
+    monkeypatch.setattr(google_drive_module.metadata_mirror, 'list_files', lambda *args: pytest.fail('不应读取镜像'))
+
+    for _ in range(2):
+        assert google_drive_service.list_files(page_size=1, use_cache=False)['count'] == 1
+    assert len(http.requests) == 2
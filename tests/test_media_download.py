@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""下载时元数据与内容请求并发：缓存的元数据只作提示，响应始终以新取的元数据为准"""
+
+import asyncio
+import hashlib
+import os
+
+import pytest
+
+import service.drive_transfer as drive_transfer
+import service.media_download as media_download
+from service.metadata_cache import FileMetadataCache, get_metadata_cache_ttl
+from tests.drive_stub import StubHttp, media_handler
+
+CONTENT = os.urandom(3000)
+FILE_INFO = {'name': 'a.bin', 'mimeType': 'application/octet-stream', 'size': str(len(CONTENT)),
+             'md5Checksum': hashlib.md5(CONTENT).hexdigest(), 'modifiedTime': '2025-01-01T00:00:00.000Z',
+             'version': '3'}
+STALE_INFO = dict(FILE_INFO, md5Checksum='0' * 32, size='10', version='2')
+
+
+def handle(method, uri, headers, body):
+    if 'alt=media' in uri:
+        return media_handler(CONTENT)(method, uri, headers, body)
+    return 200, FILE_INFO, None
+
+
+def read_body(response) -> bytes:
+    async def consume():
+        return b''.join([chunk async for chunk in response.body_iterator])
+    return asyncio.run(consume())
+
+
+@pytest.fixture
+def download(drive_service, transfer_config, monkeypatch):
+    transfer_config(download_chunk_size=1000, num_retries=0)
+    service, http = drive_service(handle)
+    media = StubHttp(handle)
+    for module in (drive_transfer, media_download):
+        monkeypatch.setattr(module, 'authorized_http', lambda credentials: media)
+    cache = FileMetadataCache(ttl=60)
+    monkeypatch.setattr(media_download, 'metadata_cache', cache)
+    speculated = []
+
+    def speculate(chunks, queue_size=None):
+        speculated.append(queue_size)
+        return drive_transfer.BackgroundChunkStream(chunks, queue_size=queue_size)
+
+    monkeypatch.setattr(media_download, 'BackgroundChunkStream', speculate)
+
+    def respond(**kwargs):
+        return media_download.download_file_response(service, None, 'f1', **kwargs)
+
+    respond.cache, respond.http, respond.media, respond.speculated = cache, http, media, speculated
+    return respond
+
+
+def metadata_requests(http):
+    return [uri for _, uri, _, _ in http.requests if 'alt=media' not in uri]
+
+
+def test_metadata_cache_enabled_by_default():
+    assert get_metadata_cache_ttl() > 0
+    cache = FileMetadataCache()
+    cache.put('default', 'f1', FILE_INFO)
+    assert cache.get('default', 'f1', allow_stale=True) == FILE_INFO
+    assert FileMetadataCache(ttl=0).get('default', 'f1', allow_stale=True) is None
+
+
+def test_first_download_does_not_speculate(download):
+    # 没有提示时文件可能很大或已缓存，先取元数据再取内容
+    response = download()
+    assert response.status_code == 200
+    assert response.headers['etag'] == f'"{FILE_INFO["md5Checksum"]}"'
+    assert read_body(response) == CONTENT
+    assert download.speculated == []
+    assert len(metadata_requests(download.http)) == 1
+    assert download.cache.get('default', 'f1') == FILE_INFO
+
+
+def test_small_hint_fetches_metadata_and_content_concurrently(download):
+    download.cache.put('default', 'f1', FILE_INFO)
+    response = download()
+    assert response.headers['content-length'] == str(len(CONTENT))
+    assert read_body(response) == CONTENT
+    assert len(metadata_requests(download.http)) == 1
+    # 内容由预先拉取的流提供，从 0 开始分块，队列只保留一个分块
+    assert download.speculated == [1]
+    assert download.media.requests[0][2]['range'] == 'bytes=0-999'
+
+
+def test_large_hint_does_not_speculate(download, transfer_config):
+    transfer_config(parallel_download_connections=4, parallel_download_threshold=len(CONTENT) - 1)
+    download.cache.put('default', 'f1', FILE_INFO)
+    response = download()
+    assert download.speculated == []
+    assert read_body(response) == CONTENT
+
+
+def test_cached_content_hint_does_not_speculate(download, monkeypatch):
+    monkeypatch.setattr(media_download.download_cache, 'contains', lambda file_info: True)
+    download.cache.put('default', 'f1', FILE_INFO)
+    download(range_header=None)
+    assert download.speculated == []
+
+
+def test_cached_metadata_is_revalidated(download):
+    download.cache.put('default', 'f1', STALE_INFO)
+    response = download()
+    assert len(metadata_requests(download.http)) == 1
+    assert response.headers['etag'] == f'"{FILE_INFO["md5Checksum"]}"'
+    assert response.headers['content-length'] == str(len(CONTENT))
+    assert read_body(response) == CONTENT
+    assert download.cache.get('default', 'f1') == FILE_INFO
+
+
+def test_stale_cached_etag_does_not_produce_304(download):
+    download.cache.put('default', 'f1', STALE_INFO)
+    response = download(if_none_match=f'"{STALE_INFO["md5Checksum"]}"')
+    assert response.status_code == 200
+    assert read_body(response) == CONTENT
+
+
+def test_current_etag_produces_304_without_content(download):
+    response = download(if_none_match=f'"{FILE_INFO["md5Checksum"]}"')
+    assert response.status_code == 304
+    assert download.media.requests == []
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""元数据镜像：查询转换、全量与增量同步、按新鲜度读取镜像"""
+
+import uuid
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+import service.metadata_mirror as metadata_mirror_module
+from service.metadata_mirror import MetadataMirror, translate_query, MIRROR_PAGE_TOKEN_PREFIX
+from tests.drive_stub import StubHttp
+
+
+@pytest.mark.parametrize('query, count', [
+    (None, 0),
+    ('', 0),
+    ('trashed = false', 0),
+    ("'folder' in parents and trashed = false", 1),
+    ("name = 'a and b.txt' and mimeType != 'application/pdf'", 2),
+    ("name contains 'rep' and modifiedTime > '2025-01-01T00:00:00'", 2),
+    ("name = 'it\\'s.txt'", 1),
+    ("'root' in parents and trashed = false", 1),
+])
+def test_translate_supported_queries(query, count):
+    assert len(translate_query(query, root_id='root-id')) == count
+
+
+@pytest.mark.parametrize('query', [
+    "fullText contains 'x'",
+    "name = 'a' or name = 'b'",
+    "name < 'b'",
+    "modifiedTime > 'yesterday'",
+    "starred = true",
+    # 不知道根目录的真实 ID 时无法按别名匹配
+    "'root' in parents",
+])
+def test_translate_unsupported_queries(query):
+    assert translate_query(query) is None
+
+
+def drive_file(file_id, name, parent='folder', modified='2025-01-01T00:00:00.000Z'):
+    return {'id': file_id, 'name': name, 'mimeType': 'text/plain', 'parents': [parent], 'modifiedTime': modified,
+            'size': '1', 'version': '1'}
+
+
+class ChangesHandler:
+    """files.list 返回 files，changes.list 按页面令牌返回 changes 中对应的页"""
+
+    def __init__(self, files, changes=None):
+        self.files = files
+        self.changes = changes or {}
+        self.change_tokens = []
+
+    def __call__(self, method, uri, headers, body):
+        parsed = urlparse(uri)
+        params = parse_qs(parsed.query)
+        if parsed.path.endswith('/changes/startPageToken'):
+            return 200, {'startPageToken': '1'}, None
+        if parsed.path.endswith('/changes'):
+            token = params['pageToken'][0]
+            self.change_tokens.append(token)
+            if token not in self.changes:
+                return 404, {'error': {'code': 404, 'message': 'invalid page token'}}, None
+            return 200, self.changes[token], None
+        if parsed.path.endswith('/files/root'):
+            return 200, {'id': 'root-id'}, None
+        return 200, {'files': self.files}, None
+
+
+@pytest.fixture
+def mirror(drive_service, transfer_config, monkeypatch):
+    """每个测试使用独立账户的镜像，返回 (镜像, 同步函数)"""
+    transfer_config(metadata_mirror_enabled=True, num_retries=0)
+    mirror = MetadataMirror(account=uuid.uuid4().hex)
+
+    def sync(handler):
+        service, _ = drive_service(handler)
+        monkeypatch.setattr(metadata_mirror_module, 'authorized_http', lambda credentials: StubHttp(handler))
+        mirror.sync(service, None)
+
+    return mirror, sync
+
+
+def list_names(mirror, query=None, page_size=100, page_token=None):
+    result = mirror.list_files(query, page_size, page_token, ['name'], max_staleness=60)
+    return result and [file['name'] for file in result['files']]
+
+
+def test_full_sync_then_query_mirror(mirror):
+    mirror, sync = mirror
+    assert list_names(mirror) is None
+    sync(ChangesHandler([
+        drive_file('f1', 'report 2024.pdf', modified='2025-01-01T00:00:00.000Z'),
+        drive_file('f2', 'notes.txt', modified='2025-02-01T00:00:00.000Z'),
+        drive_file('f3', 'other.txt', parent='elsewhere'),
+    ]))
+
+    assert list_names(mirror) == ['notes.txt', 'report 2024.pdf', 'other.txt']
+    assert list_names(mirror, "'folder' in parents and trashed = false") == ['notes.txt', 'report 2024.pdf']
+    assert list_names(mirror, "name contains '2024'") == ['report 2024.pdf']
+    assert list_names(mirror, "modifiedTime >= '2025-01-15T00:00:00Z'") == ['notes.txt']
+    # 无法转换的查询与超出镜像范围的字段交给 Drive
+    assert list_names(mirror, "fullText contains 'x'") is None
+    assert mirror.list_files(None, 10, None, ['thumbnailLink'], max_staleness=60) is None
+    assert mirror.get_file('f2', ['id', 'name'], max_staleness=60) == {'id': 'f2', 'name': 'notes.txt'}
+
+
+def test_root_alias_matches_real_root_id(mirror):
+    mirror, sync = mirror
+    sync(ChangesHandler([drive_file('f1', 'top.txt', parent='root-id'), drive_file('f2', 'nested.txt')]))
+    assert list_names(mirror, "'root' in parents and trashed = false") == ['top.txt']
+    assert list_names(mirror, "'root-id' in parents") == ['top.txt']
+
+
+def test_mirror_pages_use_mirror_tokens(mirror):
+    mirror, sync = mirror
+    sync(ChangesHandler([drive_file(f'f{index}', f'{index}.txt') for index in range(5)]))
+    first = mirror.list_files(None, 2, None, ['id'], max_staleness=60)
+    assert first['next_page_token'] == f'{MIRROR_PAGE_TOKEN_PREFIX}2'
+    # 镜像令牌的后续页始终读镜像
+    rest = mirror.list_files(None, 10, first['next_page_token'], ['id'], max_staleness=None)
+    assert len(first['files']) + len(rest['files']) == 5 and rest['next_page_token'] is None
+
+
+def test_incremental_sync_applies_changes(mirror):
+    mirror, sync = mirror
+    sync(ChangesHandler([drive_file('f1', 'a.txt'), drive_file('f2', 'b.txt'), drive_file('f3', 'c.txt')]))
+
+    handler = ChangesHandler([], {
+        '1': {'nextPageToken': '2', 'changes': [
+            {'changeType': 'file', 'fileId': 'f1', 'file': drive_file('f1', 'renamed.txt')},
+            {'changeType': 'file', 'fileId': 'f2', 'removed': True},
+        ]},
+        '2': {'newStartPageToken': '3', 'changes': [
+            {'changeType': 'file', 'fileId': 'f3', 'file': dict(drive_file('f3', 'c.txt'), trashed=True)},
+            {'changeType': 'file', 'fileId': 'f4', 'file': drive_file('f4', 'new.txt')},
+        ]},
+    })
+    sync(handler)
+
+    assert handler.change_tokens == ['1', '2']
+    assert sorted(list_names(mirror)) == ['new.txt', 'renamed.txt']
+
+    # 下次从保存的新起点继续
+    handler = ChangesHandler([], {'3': {'newStartPageToken': '3', 'changes': []}})
+    sync(handler)
+    assert handler.change_tokens == ['3']
+
+
+def test_expired_page_token_triggers_full_sync(mirror):
+    mirror, sync = mirror
+    sync(ChangesHandler([drive_file('f1', 'a.txt')]))
+    handler = ChangesHandler([drive_file('f9', 'fresh.txt')])
+    sync(handler)
+    assert handler.change_tokens == ['1']
+    assert list_names(mirror) == ['fresh.txt']
+
+
+def test_stale_mirror_is_not_used(mirror, monkeypatch):
+    mirror, sync = mirror
+    sync(ChangesHandler([drive_file('f1', 'a.txt')]))
+    synced_at = mirror.synced_at()
+    monkeypatch.setattr(metadata_mirror_module.time, 'time', lambda: synced_at + 120)
+    assert list_names(mirror) is None
+    assert mirror.list_files(None, 10, None, ['name'], max_staleness=None) is None
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""接口层：阻塞的 Drive 调用在线程池中执行，不占用事件循环"""
+
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.responses import Response
+
+import router.google_drive_router as google_drive_router
+import router.multi_user_router as multi_user_router
+from service.google_drive_service import google_drive_service
+from service.multi_user_google_drive_service import multi_user_google_drive_service
+
+
+def off_event_loop(result):
+    """返回一个断言自己不在事件循环线程中执行的替身函数，调用参数记录在其 calls 属性中"""
+    def blocking_call(*args, **kwargs):
+        with pytest.raises(RuntimeError):
+            asyncio.get_running_loop()
+        blocking_call.calls.append(args)
+        return result
+
+    blocking_call.calls = []
+    return blocking_call
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(google_drive_router.router)
+    app.include_router(multi_user_router.router)
+    with TestClient(app) as client:
+        yield client
+
+
+def test_download_runs_off_event_loop(client, monkeypatch):
+    download_file = off_event_loop(Response(b'hello'))
+    monkeypatch.setattr(google_drive_service, 'download_file', download_file)
+    response = client.get('/google-drive/download/f1', headers={'Range': 'bytes=0-1'})
+    assert response.content == b'hello'
+    assert download_file.calls == [('f1', 'bytes=0-1', None, None, None)]
+
+
+def test_multi_user_download_runs_off_event_loop(client, monkeypatch):
+    download_file = off_event_loop(Response(b'hello'))
+    monkeypatch.setattr(multi_user_google_drive_service, 'download_file', download_file)
+    response = client.get('/multi-user/download/f1', headers={'X-User-Token': '{}'})
+    assert response.content == b'hello'
+    assert download_file.calls == [('f1', '{}', None, None, None, None)]
+
+
+def test_download_all_runs_off_event_loop(client, monkeypatch):
+    download_all_files = off_event_loop(Response(b'archive'))
+    monkeypatch.setattr(google_drive_service, 'download_all_files', download_all_files)
+    response = client.get('/google-drive/download-all', params={'folder_id': 'folder', 'format': 'tar'})
+    assert response.content == b'archive'
+    assert download_all_files.calls == [(None, None, 'tar', 'folder')]
+
+
+def test_streamed_list_runs_off_event_loop(client, monkeypatch):
+    stream_files = off_event_loop(iter([{'id': 'f1'}, {'done': True, 'count': 1}]))
+    monkeypatch.setattr(google_drive_service, 'stream_files', stream_files)
+    response = client.get('/google-drive/list', params={'stream': 'true', 'page_size': 10})
+    assert response.text.splitlines() == ['{"id": "f1"}', '{"done": true, "count": 1}']
+    assert stream_files.calls == [(None, 10, None, None)]
+
+
+def test_multi_user_streamed_list_runs_off_event_loop(client, monkeypatch):
+    stream_files = off_event_loop(iter([{'done': True, 'count': 0}]))
+    monkeypatch.setattr(multi_user_google_drive_service, 'stream_files', stream_files)
+    response = client.get('/multi-user/list', params={'stream': 'true'}, headers={'X-User-Token': '{}'})
+    assert response.text.splitlines() == ['{"done": true, "count": 0}']
+    assert len(stream_files.calls) == 1
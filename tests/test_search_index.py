@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""本地搜索索引：各搜索方式与排序、更新与删除、重建与增量刷新、内容索引"""
+
+import threading
+import uuid
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+from fastapi import HTTPException
+
+import service.google_drive_service as google_drive_module
+import service.search_index as search_index_module
+from service.google_drive_service import google_drive_service
+from service.search_index import SearchIndex
+from tests.drive_stub import StubHttp
+
+FILES = [
+    {'id': 'f1', 'name': 'Quarterly_Report 2024.pdf', 'mimeType': 'application/pdf'},
+    {'id': 'f2', 'name': 'report.txt', 'mimeType': 'text/plain'},
+    {'id': 'f3', 'name': 'reporting-tools.xlsx', 'mimeType': 'application/vnd.ms-excel'},
+    {'id': 'f4', 'name': '年度报告.docx', 'mimeType': 'application/msword'},
+    {'id': 'f5', 'name': 'ＲＥＡＤＭＥ.md', 'mimeType': 'text/markdown'},
+]
+
+
+@pytest.fixture
+def index():
+    index = SearchIndex()
+    index.add_files(FILES)
+    return index
+
+
+def ids(result):
+    return [file['id'] for file in result['files']]
+
+
+def test_auto_ranks_exact_match_first(index):
+    result = index.search('report')
+    assert ids(result)[0] == 'f2' and set(ids(result)) == {'f1', 'f2', 'f3'}
+    assert result['files'][0]['score'] > result['files'][1]['score']
+
+
+def test_prefix_mode(index):
+    assert set(ids(index.search('repo', mode='prefix'))) == {'f1', 'f2', 'f3'}
+    assert ids(index.search('port', mode='prefix')) == []
+
+
+def test_substring_mode_crosses_word_boundaries(index):
+    assert ids(index.search('t 20', mode='substring')) == ['f1']
+    assert set(ids(index.search('port', mode='substring'))) == {'f1', 'f2', 'f3'}
+
+
+def test_fuzzy_mode_tolerates_typos(index):
+    assert 'f1' in ids(index.search('quartely', mode='fuzzy'))
+    assert ids(index.search('quartely', mode='prefix')) == []
+
+
+def test_every_word_must_match(index):
+    assert ids(index.search('report 2024')) == ['f1']
+
+
+def test_chinese_and_fullwidth_names(index):
+    assert ids(index.search('报告')) == ['f4']
+    assert ids(index.search('readme')) == ['f5']
+
+
+def test_invalid_search(index):
+    for query, mode in (('report', 'regex'), ('  ', 'auto'), ('__', 'auto')):
+        with pytest.raises(HTTPException) as error:
+            index.search(query, mode=mode)
+        assert error.value.status_code == 400
+
+
+def test_upsert_renames_and_trashed_files_are_removed(index):
+    index.upsert({'id': 'f2', 'name': 'summary.txt'})
+    assert 'f2' not in ids(index.search('report'))
+    assert index.search('summary')['files'][0]['mimeType'] == 'text/plain'
+
+    index.upsert({'id': 'f3', 'name': 'reporting-tools.xlsx', 'trashed': True})
+    index.remove('f1')
+    assert ids(index.search('report')) == []
+    assert index.search('summary')['indexed_files'] == 3
+
+
+class ChangesHandler:
+    """files.list 返回 files，changes.list 按页面令牌返回 changes，get_media 返回 contents 中的内容"""
+
+    def __init__(self, files, changes=None, contents=None):
+        self.files = files
+        self.changes = changes or {}
+        self.contents = contents or {}
+        self.change_tokens = []
+
+    def __call__(self, method, uri, headers, body):
+        parsed = urlparse(uri)
+        params = parse_qs(parsed.query)
+        if parsed.path.endswith('/changes/startPageToken'):
+            return 200, {'startPageToken': '1'}, None
+        if parsed.path.endswith('/changes'):
+            token = params['pageToken'][0]
+            self.change_tokens.append(token)
+            if token not in self.changes:
+                return 410, {'error': {'code': 410, 'message': 'expired'}}, None
+            return 200, self.changes[token], None
+        if params.get('alt') == ['media']:
+            return 200, self.contents[parsed.path.rsplit('/', 1)[1]], None
+        return 200, {'files': self.files}, None
+
+
+@pytest.fixture
+def refresh(drive_service, transfer_config, monkeypatch):
+    transfer_config(num_retries=0)
+
+    def run(index, handler):
+        service, _ = drive_service(handler)
+        monkeypatch.setattr(search_index_module, 'authorized_http', lambda credentials: StubHttp(handler))
+        index.refresh(service, None)
+
+    return run
+
+
+def test_refresh_rebuilds_then_applies_changes(refresh):
+    index = SearchIndex()
+    index.upsert({'id': 'gone', 'name': 'deleted elsewhere.txt'})
+    refresh(index, ChangesHandler(FILES))
+    assert index.search('report')['indexed_files'] == len(FILES)
+    assert ids(index.search('deleted')) == []
+
+    handler = ChangesHandler([], {'1': {'newStartPageToken': '2', 'changes': [
+        {'changeType': 'file', 'fileId': 'f2', 'removed': True},
+        {'changeType': 'file', 'fileId': 'f3', 'file': dict(FILES[2], trashed=True)},
+        {'changeType': 'file', 'fileId': 'f6', 'file': {'id': 'f6', 'name': 'report draft.txt'}},
+    ]}})
+    refresh(index, handler)
+    assert handler.change_tokens == ['1']
+    assert set(ids(index.search('report'))) == {'f1', 'f6'}
+
+
+def test_expired_token_rebuilds_index(refresh):
+    index = SearchIndex()
+    refresh(index, ChangesHandler(FILES))
+    handler = ChangesHandler([{'id': 'f9', 'name': 'fresh.txt'}])
+    refresh(index, handler)
+    assert handler.change_tokens == ['1']
+    assert index.search('fresh')['indexed_files'] == 1
+
+
+def test_small_text_contents_are_indexed(refresh, transfer_config):
+    transfer_config(search_index_content_max_bytes=1024)
+    index = SearchIndex()
+    notes = {'id': 'n1', 'name': 'notes.txt', 'mimeType': 'text/plain', 'size': '20', 'md5Checksum': 'a'}
+    refresh(index, ChangesHandler([notes], contents={'n1': b'budget for kubernetes'}))
+    assert ids(index.search('kubernetes', content=True)) == ['n1']
+    assert ids(index.search('kubernetes')) == []
+
+
+def test_list_results_do_not_feed_the_index(drive_service, monkeypatch):
+    def handle(method, uri, headers, body):
+        return 200, {'files': [{'id': 't1', 'name': 'trashed.txt', 'trashed': True}]}, None
+
+    service, _ = drive_service(handle)
+    index = SearchIndex()
+    monkeypatch.setattr(google_drive_service, 'service', service)
+    monkeypatch.setattr(google_drive_service, '_local', threading.local())
+    monkeypatch.setattr(google_drive_module, 'authorized_http', lambda credentials: StubHttp(handle))
+    monkeypatch.setattr(google_drive_module, 'search_index', index)
+
+    google_drive_service.list_files(query=f"name = '{uuid.uuid4().hex}' or trashed = true")
+    assert index.search('trashed')['indexed_files'] == 0
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""上传去重：按大小预筛、命中后向 Drive 确认，未命中时复用已算出的 MD5"""
+
+import hashlib
+import io
+from urllib.parse import urlparse
+
+import pytest
+from fastapi import UploadFile
+
+import service.google_drive_service as google_drive_module
+from service.drive_transfer import HashingReader
+from service.google_drive_service import google_drive_service
+from service.upload_dedup import FolderChecksumIndex
+
+CONTENT = b'hello world'
+MD5 = hashlib.md5(CONTENT).hexdigest()
+
+
+class CountingReader(io.BytesIO):
+    """记录读取次数的流"""
+
+    def __init__(self, data: bytes):
+        super().__init__(data)
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return super().read(size)
+
+
+class FolderHandler:
+    """folder 中的文件列表、单个文件的当前状态与上传，trashed 中的文件已被移到回收站"""
+
+    def __init__(self, files, trashed=()):
+        self.files = files
+        self.trashed = set(trashed)
+        self.lists = 0
+
+    def __call__(self, method, uri, headers, body):
+        path = urlparse(uri).path
+        if method == 'POST':
+            return 200, drive_file('uploaded', CONTENT), None
+        if path.endswith('/files'):
+            self.lists += 1
+            return 200, {'files': self.files}, None
+        file_id = path.rsplit('/', 1)[1]
+        file_info = next(f for f in self.files if f['id'] == file_id)
+        return 200, dict(file_info, parents=['folder'], trashed=file_id in self.trashed), None
+
+
+def drive_file(file_id, content, md5=None):
+    return {'id': file_id, 'name': f'{file_id}.txt', 'size': str(len(content)),
+            'md5Checksum': md5 or hashlib.md5(content).hexdigest()}
+
+
+@pytest.fixture
+def folder(drive_service, transfer_config):
+    transfer_config(num_retries=0)
+
+    def create(files, trashed=()):
+        handler = FolderHandler(files, trashed)
+        service, _ = drive_service(handler)
+        return FolderChecksumIndex(ttl=60), service, handler
+
+    return create
+
+
+def test_no_size_match_does_not_read_stream(folder):
+    index, service, _ = folder([drive_file('other', b'x' * 3)])
+    fd = CountingReader(CONTENT)
+    assert index.find_duplicate(service, 'folder', fd, len(CONTENT)) == (None, None)
+    assert fd.reads == 0
+
+
+def test_duplicate_is_confirmed_and_returned(folder):
+    index, service, _ = folder([drive_file('same', CONTENT)])
+    existing, md5 = index.find_duplicate(service, 'folder', io.BytesIO(CONTENT), len(CONTENT))
+    assert existing['id'] == 'same' and md5 == MD5
+
+
+def test_miss_returns_md5_for_reuse(folder):
+    index, service, _ = folder([drive_file('similar', b'hello WORLD')])
+    fd = io.BytesIO(CONTENT)
+    assert index.find_duplicate(service, 'folder', fd, len(CONTENT)) == (None, MD5)
+    assert fd.tell() == 0
+
+
+def test_trashed_duplicate_is_dropped_from_index(folder):
+    index, service, handler = folder([drive_file('gone', CONTENT)], trashed=['gone'])
+    assert index.find_duplicate(service, 'folder', io.BytesIO(CONTENT), len(CONTENT)) == (None, MD5)
+    # 移除后同样大小的候选不复存在，不再读取内容
+    fd = CountingReader(CONTENT)
+    assert index.find_duplicate(service, 'folder', fd, len(CONTENT)) == (None, None)
+    assert fd.reads == 0 and handler.lists == 1
+
+
+def test_uploaded_file_is_added_to_loaded_index(folder):
+    index, service, handler = folder([])
+    assert index.find_duplicate(service, 'folder', io.BytesIO(CONTENT), len(CONTENT)) == (None, None)
+    uploaded = drive_file('new', CONTENT)
+    handler.files.append(uploaded)
+    index.add('folder', uploaded)
+    assert index.find_duplicate(service, 'folder', io.BytesIO(CONTENT), len(CONTENT))[0]['id'] == 'new'
+    assert handler.lists == 1
+
+
+def test_hashing_reader_hashes_each_byte_once():
+    reader = HashingReader(io.BytesIO(CONTENT))
+    reader.read(5)
+    # 上传重试时回退重读，已计入摘要的字节不重复计算
+    reader.seek(0)
+    assert reader.read() == CONTENT
+    assert reader.hexdigest() == MD5 and reader.hashed_bytes == len(CONTENT)
+
+
+def test_dedup_upload_reuses_comparison_md5(folder, monkeypatch):
+    index, service, handler = folder([drive_file('similar', b'hello WORLD')])
+    monkeypatch.setattr(google_drive_service, 'service', service)
+    monkeypatch.setattr(google_drive_module, 'folder_checksum_index', index)
+    monkeypatch.setattr(google_drive_module, 'HashingReader', lambda fd: pytest.fail('内容不应再算一遍 MD5'))
+
+    result = google_drive_service.upload_file(UploadFile(io.BytesIO(CONTENT), filename='a.txt'), 'folder', dedup=True)
+
+    assert result['file_id'] == 'uploaded' and result['deduplicated'] is False
+    # 上传结果带着复用的 MD5 加入索引，再次上传相同内容时命中
+    handler.files.append(drive_file('uploaded', CONTENT))
+    assert index.find_duplicate(service, 'folder', io.BytesIO(CONTENT), len(CONTENT))[0]['id'] == 'uploaded'
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""异步上传任务队列：暂存登记、可续传上传、失败退避重试与重启后从已提交位置续传"""
+
+import io
+import os
+import re
+
+import pytest
+from fastapi import UploadFile
+
+import service.drive_transfer as drive_transfer
+import service.upload_job_service as upload_job_module
+from service.drive_transfer import UPLOAD_CHUNK_ALIGNMENT
+from service.upload_job_service import UploadJobService, JOB_PENDING, JOB_COMPLETED, JOB_FAILED
+from tests.drive_stub import StubHttp
+
+SESSION_URI = 'https://www.googleapis.com/upload/drive/v3/files?uploadType=resumable&upload_id=job'
+CONTENT = os.urandom(UPLOAD_CHUNK_ALIGNMENT * 2 + 100)
+
+
+class Session:
+    """模拟可续传会话，fail_puts 为剩余需要返回 503 的写入次数，仅在提交过数据后生效"""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.sessions = 0
+        self.fail_puts = 0
+        self.puts = []
+
+    def __call__(self, method, uri, headers, body):
+        if method == 'POST':
+            self.sessions += 1
+            self.data = bytearray()
+            return 200, b'', {'location': SESSION_URI}
+        content_range = headers['content-range']
+        self.puts.append(content_range)
+        match = re.match(r'bytes (\d+)-(\d+)/(\d+)$', content_range)
+        if match:
+            if self.fail_puts and self.data:
+                self.fail_puts -= 1
+                return 503, {'error': {'code': 503, 'message': 'backend error'}}, None
+            assert int(match.group(1)) == len(self.data)
+            self.data += body
+        if len(self.data) == len(CONTENT):
+            return 200, {'id': 'f1', 'name': 'a.bin', 'size': str(len(CONTENT))}, None
+        return 308, b'', {'range': f'bytes=0-{len(self.data) - 1}'} if self.data else None
+
+
+@pytest.fixture
+def session(transfer_config, monkeypatch):
+    transfer_config(upload_chunk_size=UPLOAD_CHUNK_ALIGNMENT, num_retries=0, upload_job_retry_delay=10,
+                    upload_job_max_attempts=2)
+    session = Session()
+    monkeypatch.setattr(upload_job_module, 'authorized_http', lambda credentials: StubHttp(session))
+    monkeypatch.setattr(drive_transfer, 'build_http', lambda: StubHttp(session))
+    return session
+
+
+@pytest.fixture
+def jobs(tmp_path):
+    return UploadJobService(job_dir=str(tmp_path))
+
+
+def create_job(jobs: UploadJobService) -> str:
+    return jobs.create_job(UploadFile(io.BytesIO(CONTENT), filename='a.bin'), 'folder')['job_id']
+
+
+def run_next(jobs: UploadJobService):
+    job = jobs._claim()
+    assert job is not None
+    jobs._run_job(job)
+
+
+def make_due(jobs: UploadJobService, job_id: str):
+    jobs._update(job_id, next_attempt_at=0)
+
+
+def test_job_is_staged_then_uploaded(jobs, session):
+    job_id = create_job(jobs)
+    job = jobs.get_job(job_id)
+    assert job['status'] == JOB_PENDING and job['size'] == len(CONTENT) and job['progress'] == 0.0
+    assert os.path.exists(jobs._staging_path(job_id))
+
+    run_next(jobs)
+
+    job = jobs.get_job(job_id)
+    assert job['status'] == JOB_COMPLETED and job['progress'] == 100.0
+    assert job['data']['file_id'] == 'f1'
+    assert bytes(session.data) == CONTENT
+    assert not os.path.exists(jobs._staging_path(job_id))
+    assert jobs._claim() is None
+
+
+def test_failed_attempt_resumes_from_committed_offset(jobs, session):
+    session.fail_puts = 1
+    job_id = create_job(jobs)
+    run_next(jobs)
+
+    job = jobs.get_job(job_id)
+    assert job['status'] == JOB_PENDING and job['attempts'] == 1 and 'backend error' in job['error']
+    assert job['bytes_uploaded'] == UPLOAD_CHUNK_ALIGNMENT
+    # 退避期内不会被取出
+    assert jobs._claim() is None
+
+    make_due(jobs, job_id)
+    session.puts.clear()
+    run_next(jobs)
+
+    assert jobs.get_job(job_id)['status'] == JOB_COMPLETED
+    assert session.sessions == 1 and bytes(session.data) == CONTENT
+    # 先查询已提交位置，再从第二块开始续传
+    assert session.puts[0] == f'bytes */{len(CONTENT)}'
+    assert session.puts[1].startswith(f'bytes {UPLOAD_CHUNK_ALIGNMENT}-')
+
+
+def test_job_fails_after_max_attempts(jobs, session):
+    session.fail_puts = 10
+    job_id = create_job(jobs)
+    run_next(jobs)
+    make_due(jobs, job_id)
+    run_next(jobs)
+
+    job = jobs.get_job(job_id)
+    assert job['status'] == JOB_FAILED and job['attempts'] == 2
+    assert not os.path.exists(jobs._staging_path(job_id))
+
+
+def test_running_job_is_requeued_after_restart(jobs, session):
+    job_id = create_job(jobs)
+    assert jobs._claim()['job_id'] == job_id
+
+    restarted = UploadJobService(job_dir=jobs.job_dir)
+    assert restarted.get_job(job_id)['status'] == JOB_PENDING
+    run_next(restarted)
+    assert restarted.get_job(job_id)['status'] == JOB_COMPLETED
+
+
+def test_restart_removes_orphaned_staging_files(jobs):
+    orphan = jobs._staging_path('orphan')
+    with open(orphan, 'wb') as f:
+        f.write(b'x')
+    UploadJobService(job_dir=jobs.job_dir)
+    assert not os.path.exists(orphan)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""客户端直传：创建上传会话与确认上传结果"""
+
+import json
+
+import pytest
+from fastapi import HTTPException
+
+import service.drive_transfer as drive_transfer
+from service.drive_transfer import create_upload_session, is_upload_session_uri
+from service.list_cache import list_cache
+from service.metadata_cache import account_key
+from service.multi_user_google_drive_service import multi_user_google_drive_service
+from service.upload_session import confirm_upload_session
+from tests.drive_stub import StubHttp
+
+SESSION_URI = 'https://www.googleapis.com/upload/drive/v3/files?uploadType=resumable&upload_id=s1'
+
+
+def test_create_upload_session_sends_metadata(transfer_config):
+    transfer_config(num_retries=0)
+    http = StubHttp(lambda method, uri, headers, body: (200, b'', {'location': SESSION_URI}))
+
+    session_uri = create_upload_session(http, {'name': '报告.pdf', 'parents': ['folder']}, 'application/pdf',
+                                        size=1234, origin='https://app.example.com')
+
+    assert session_uri == SESSION_URI
+    method, uri, headers, body = http.requests[0]
+    assert method == 'POST' and 'uploadType=resumable' in uri
+    assert json.loads(body) == {'name': '报告.pdf', 'parents': ['folder']}
+    assert headers['x-upload-content-type'] == 'application/pdf'
+    assert headers['x-upload-content-length'] == '1234'
+    assert headers['origin'] == 'https://app.example.com'
+
+
+@pytest.mark.parametrize('session_uri, expected', [
+    (SESSION_URI, True),
+    ('http://www.googleapis.com/upload/drive/v3/files?upload_id=s1', False),
+    ('https://evil.example.com/upload/drive/v3/files?upload_id=s1', False),
+    ('https://www.googleapis.com/drive/v3/files?upload_id=s1', False),
+    ('https://www.googleapis.com/upload/drive/v3/files?uploadType=resumable', False),
+    ('', False),
+    (None, False),
+])
+def test_is_upload_session_uri(session_uri, expected):
+    assert is_upload_session_uri(session_uri) is expected
+
+
+@pytest.fixture
+def session(monkeypatch):
+    """返回设置会话查询结果的函数，查询请求记录在其 requests 属性中"""
+    state = {}
+
+    def handle(method, uri, headers, body):
+        return state['response']
+
+    http = StubHttp(handle)
+    monkeypatch.setattr(drive_transfer, 'build_http', lambda: http)
+
+    def respond(status, content=b'', headers=None):
+        state['response'] = (status, content, headers)
+
+    respond.requests = http.requests
+    return respond
+
+
+def test_confirm_complete_session(session):
+    session(200, {'id': 'f1', 'name': 'a.txt', 'size': '10', 'mimeType': 'text/plain'})
+    result = confirm_upload_session(SESSION_URI, size=10)
+    assert result['status'] == 'complete' and result['file_id'] == 'f1'
+    method, uri, headers, body = session.requests[0]
+    assert (method, uri) == ('PUT', SESSION_URI)
+    assert headers['content-range'] == 'bytes */10'
+    assert 'authorization' not in headers
+
+
+def test_confirm_incomplete_session_reports_offset(session):
+    session(308, b'', {'range': 'bytes=0-262143'})
+    result = confirm_upload_session(SESSION_URI)
+    assert result['status'] == 'incomplete' and result['committed_bytes'] == 262144
+    assert session.requests[0][2]['content-range'] == 'bytes */*'
+
+
+def test_confirm_rejects_foreign_uri(session):
+    with pytest.raises(HTTPException) as error:
+        confirm_upload_session('https://evil.example.com/upload?upload_id=s1')
+    assert error.value.status_code == 400
+    assert session.requests == []
+
+
+@pytest.mark.parametrize('status, expected', [(404, 410), (410, 410), (500, 502)])
+def test_confirm_maps_session_errors(session, status, expected):
+    session(status, {'error': {'code': status, 'message': 'gone'}})
+    with pytest.raises(HTTPException) as error:
+        confirm_upload_session(SESSION_URI)
+    assert error.value.status_code == expected
+
+
+@pytest.mark.parametrize('status, invalidated', [(200, True), (308, False)])
+def test_multi_user_complete_invalidates_user_list_cache(session, monkeypatch, status, invalidated):
+    cleared = []
+    monkeypatch.setattr(list_cache, 'invalidate_parent', lambda account, parent_id=None: cleared.append(account))
+    session(status, {'id': 'f1', 'name': 'a.txt'} if status == 200 else b'', {'range': 'bytes=0-9'})
+    multi_user_google_drive_service.complete_upload_session('{"access_token": "t"}', SESSION_URI)
+    assert cleared == ([account_key('{"access_token": "t"}')] if invalidated else [])
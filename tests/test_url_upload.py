@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""从 URL 上传：源站地址校验、逐跳校验重定向、拒绝压缩编码、断线续传与分块写入 Drive 会话"""
+
+import asyncio
+import gzip
+import os
+import re
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import service.url_upload as url_upload
+from service.drive_transfer import UPLOAD_CHUNK_ALIGNMENT
+from tests.drive_stub import StubHttp
+
+SESSION_URI = 'https://www.googleapis.com/upload/drive/v3/files?uploadType=resumable&upload_id=url'
+CONTENT = os.urandom(UPLOAD_CHUNK_ALIGNMENT + 1000)
+ADDRESSES = {
+    'public.example': ['93.184.216.34'],
+    'mirror.example': ['93.184.216.35'],
+    'internal.example': ['10.0.0.5'],
+    'mixed.example': ['93.184.216.34', '127.0.0.1'],
+    'metadata.example': ['169.254.169.254'],
+}
+
+
+class SourceStream(httpx.AsyncByteStream):
+    """按 64 KiB 分段输出的源站响应体，与真实连接一样只能读取一次"""
+
+    def __init__(self, content: bytes):
+        self.content = content
+
+    async def __aiter__(self):
+        for start in range(0, len(self.content), 65536):
+            yield self.content[start:start + 65536]
+
+
+def source_response(content: bytes, headers=None) -> httpx.Response:
+    return httpx.Response(200, stream=SourceStream(content), headers=headers)
+
+
+class DriveSession:
+    def __init__(self):
+        self.created = None
+        self.data = bytearray()
+
+    def __call__(self, method, uri, headers, body):
+        if method == 'POST':
+            self.created = body
+            return 200, b'', {'location': SESSION_URI}
+        match = re.match(r'bytes (\d+)-(\d+)/(\*|\d+)$', headers['content-range'])
+        if match:
+            self.data += body
+        if not headers['content-range'].endswith('/*'):
+            return 200, {'id': 'f1', 'size': str(len(self.data))}, None
+        return 308, b'', {'range': f'bytes=0-{len(self.data) - 1}'}
+
+
+@pytest.fixture
+def source(transfer_config, monkeypatch):
+    """返回设置源站响应函数的函数，源站收到的请求记录在其 requests 属性中"""
+    transfer_config(upload_chunk_size=UPLOAD_CHUNK_ALIGNMENT, num_retries=0)
+    session = DriveSession()
+    monkeypatch.setattr(url_upload, 'authorized_http', lambda credentials: StubHttp(session))
+    monkeypatch.setattr(url_upload, 'build_http', lambda: StubHttp(session))
+
+    async def resolve(host, port):
+        return ADDRESSES[host]
+
+    monkeypatch.setattr(url_upload, '_resolve_addresses', resolve)
+    requests = []
+    state = {}
+
+    def handle(request):
+        requests.append(request)
+        return state['handler'](request)
+
+    client = httpx.AsyncClient
+    monkeypatch.setattr(url_upload.httpx, 'AsyncClient',
+                        lambda **kwargs: client(transport=httpx.MockTransport(handle), **kwargs))
+
+    def serve(handler):
+        state['handler'] = handler
+
+    serve.requests, serve.session = requests, session
+    return serve
+
+
+def upload(url: str):
+    return asyncio.run(url_upload.upload_from_url(None, url, {'parents': ['folder']}))
+
+
+def test_upload_streams_source_into_drive_session(source):
+    source(lambda request: source_response(CONTENT, {'Content-Type': 'application/pdf'}))
+    uploaded_file, content_type = upload('https://public.example/files/%E6%8A%A5%E5%91%8A')
+
+    assert uploaded_file['id'] == 'f1' and content_type == 'application/pdf'
+    assert bytes(source.session.data) == CONTENT
+    assert b'"\\u62a5\\u544a.pdf"' in source.session.created
+    # 连接固定到校验过的地址，Host 与 SNI 仍为原主机名
+    request = source.requests[0]
+    assert request.url.host == '93.184.216.34'
+    assert request.headers['host'] == 'public.example'
+    assert request.extensions['sni_hostname'] == 'public.example'
+    assert request.headers['accept-encoding'] == 'identity'
+
+
+@pytest.mark.parametrize('host', ['internal.example', 'mixed.example', 'metadata.example'])
+def test_private_addresses_are_rejected(source, host):
+    source(lambda request: pytest.fail('不应访问非公网地址'))
+    with pytest.raises(HTTPException) as error:
+        upload(f'http://{host}/a.txt')
+    assert error.value.status_code == 400
+    assert source.requests == []
+
+
+def test_private_addresses_allowed_by_config(source, transfer_config):
+    transfer_config(url_upload_allow_private=True)
+    source(lambda request: source_response(b'hello'))
+    upload('http://internal.example/a.txt')
+    assert bytes(source.session.data) == b'hello'
+
+
+def test_redirect_to_private_address_is_rejected(source):
+    source(lambda request: httpx.Response(302, headers={'Location': 'http://internal.example/secret'}))
+    with pytest.raises(HTTPException) as error:
+        upload('https://public.example/start')
+    assert error.value.status_code == 400
+    assert len(source.requests) == 1
+
+
+def test_redirect_is_followed_per_hop(source):
+    def handler(request):
+        if request.headers['host'] == 'public.example':
+            return httpx.Response(302, headers={'Location': 'https://mirror.example/dl/report.txt'})
+        return source_response(b'hello')
+
+    source(handler)
+    upload('https://public.example/start')
+    assert [request.url.host for request in source.requests] == ['93.184.216.34', '93.184.216.35']
+    # 文件名取重定向后的地址
+    assert b'"report.txt"' in source.session.created
+
+
+def test_too_many_redirects(source, transfer_config):
+    transfer_config(url_upload_max_redirects=2)
+    source(lambda request: httpx.Response(302, headers={'Location': '/again'}))
+    with pytest.raises(HTTPException) as error:
+        upload('https://public.example/start')
+    assert error.value.status_code == 502
+    assert len(source.requests) == 3
+
+
+def test_encoded_body_is_rejected(source):
+    source(lambda request: source_response(gzip.compress(b'hello'), {'Content-Encoding': 'gzip'}))
+    with pytest.raises(HTTPException) as error:
+        upload('https://public.example/a.txt')
+    assert error.value.status_code == 502
+    assert source.session.created is None
+
+
+class BrokenStream(SourceStream):
+    """输出 limit 字节后连接中断"""
+
+    def __init__(self, content: bytes, limit: int):
+        super().__init__(content[:limit])
+
+    async def __aiter__(self):
+        async for data in super().__aiter__():
+            yield data
+        raise httpx.ReadError('connection reset')
+
+
+def test_source_disconnect_resumes_with_range(source, transfer_config):
+    transfer_config(num_retries=1)
+
+    def handler(request):
+        if 'range' not in request.headers:
+            return httpx.Response(200, stream=BrokenStream(CONTENT, 100000),
+                                  headers={'Content-Length': str(len(CONTENT)), 'ETag': '"v1"'})
+        start = int(request.headers['range'][len('bytes='):-1])
+        return httpx.Response(206, stream=SourceStream(CONTENT[start:]), headers={
+            'Content-Range': f'bytes {start}-{len(CONTENT) - 1}/{len(CONTENT)}'})
+
+    source(handler)
+    upload('https://public.example/a.bin')
+
+    assert bytes(source.session.data) == CONTENT
+    assert source.requests[1].headers['range'] == 'bytes=100000-'
+    assert source.requests[1].headers['if-range'] == '"v1"'